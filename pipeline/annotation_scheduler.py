@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Phase 4 (anytime variant) — Iterative-deepening Stockfish annotation
+
+First sweeps every branching and leaf node at a shallow depth, so the whole
+tree has an eval early. It then spends the remaining budget deepening nodes
+in priority order: popular nodes, branching nodes and nodes whose eval sits
+near the is_dubious/is_busted thresholds first. Every pass is written back
+as it completes, so stopping at any point leaves the best evals found so far.
+
+Usage:
+  python annotation_scheduler.py --budget-minutes 60
+  python annotation_scheduler.py --sweep-depth 10 --step 4 --max-searches 50000
+"""
+
+import argparse
+import heapq
+import itertools
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+import chess.engine
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from db import get_cached_eval, get_connection, iter_leaf_nodes, iter_nodes, store_evals
+from stockfish_annotator import (
+    DEPTH_LEAF,
+    PersistentEngine,
+    annotation_from_eval,
+    node_position_key,
+    search_position,
+    target_depth,
+    write_annotations,
+)
+
+SWEEP_DEPTH = 12
+DEPTH_STEP = 4
+# Mover-perspective thresholds from stockfish_annotator.is_dubious / is_busted.
+THRESHOLDS_CP = (-50.0, -150.0)
+CLOSENESS_SCALE_CP = 25.0
+
+
+def threshold_closeness(eval_cp: float, side: str) -> float:
+    """1.0 on a dubious/busted threshold, falling towards 0 as the eval moves away from both."""
+    mover_cp = eval_cp if side == "W" else -eval_cp
+    distance = min(abs(mover_cp - t) for t in THRESHOLDS_CP)
+    return 1.0 / (1.0 + distance / CLOSENESS_SCALE_CP)
+
+
+def deepening_priority(node, eval_cp: float, depth: int) -> float:
+    """How much another, deeper pass on node is worth. Decays with the depth already searched."""
+    weight = math.log1p(node.game_count or 0) + 1.0
+    if node.is_branching_node:
+        weight *= 1.5
+    return weight * threshold_closeness(eval_cp, node.side) / depth
+
+
+def schedule_annotations(
+    conn,
+    engine,
+    *,
+    sweep_depth: int = SWEEP_DEPTH,
+    step: int = DEPTH_STEP,
+    max_depth: int | None = None,
+    budget_seconds: float | None = None,
+    max_searches: int | None = None,
+    max_nodes: int | None = None,
+    write_batch: int = 100,
+) -> dict:
+    """
+    Sweep, then deepen by priority until every node reaches its depth cap
+    (max_depth, or target_depth(node) if None) or the budget runs out.
+    Leaves come back on later runs until they reach their cap, so a run cut
+    short by the budget is picked up where it stopped. Returns counts: swept,
+    deepened, searches (engine searches only; max_searches ignores answers
+    from the position_evals cache).
+    """
+    deadline = time.monotonic() + budget_seconds if budget_seconds else None
+    stats = {"swept": 0, "deepened": 0, "searches": 0}
+    pending = []
+
+    def out_of_budget() -> bool:
+        if deadline is not None and time.monotonic() >= deadline:
+            return True
+        return max_searches is not None and stats["searches"] >= max_searches
+
+    def flush():
+        nonlocal pending
+        if pending:
+            write_annotations(conn, pending)
+            conn.commit()
+            pending = []
+
+    def search(node, depth):
+        ev = get_cached_eval(conn, node_position_key(node), depth)
+        if ev is None:
+            try:
+                ev = search_position(engine, chess.Board(node.fen), depth)
+            except chess.engine.EngineError as e:
+                print(f"Engine error on {node.node_id}: {e}", file=sys.stderr)
+                return None
+            stats["searches"] += 1
+            if ev is None:
+                return None
+            store_evals(conn, [ev])
+        annotation = annotation_from_eval(node, ev)
+        pending.append((node.node_id, annotation))
+        if len(pending) >= write_batch:
+            flush()
+        return annotation
+
+    # Streamed with WITH HOLD: the sweep commits while the cursors are open.
+    nodes = itertools.chain(
+        iter_nodes(conn, is_branching=True, order_by="game_count DESC", limit=max_nodes, withhold=True),
+        iter_leaf_nodes(conn, limit=max_nodes, below_depth=max_depth or DEPTH_LEAF, withhold=True),
+    )
+    heap = []
+    order = itertools.count()  # tie-breaker so nodes are never compared
+    for node in nodes:
+        cap = max_depth or target_depth(node)
+        depth, eval_cp = node.stockfish_depth or 0, node.stockfish_eval
+        if eval_cp is None or depth < min(sweep_depth, cap):
+            if out_of_budget():
+                break
+            annotation = search(node, min(sweep_depth, cap))
+            if annotation is None:
+                continue
+            depth, eval_cp = annotation["stockfish_depth"], annotation["stockfish_eval"]
+            stats["swept"] += 1
+        if depth < cap:
+            heapq.heappush(heap, (-deepening_priority(node, eval_cp, depth), next(order), node, depth, cap))
+    flush()
+    print(f"Sweep done: {stats['swept']} nodes at depth {sweep_depth}", file=sys.stderr)
+
+    while heap and not out_of_budget():
+        _, _, node, depth, cap = heapq.heappop(heap)
+        annotation = search(node, min(depth + step, cap))
+        if annotation is None:
+            continue
+        stats["deepened"] += 1
+        depth = annotation["stockfish_depth"]
+        if depth < cap:
+            priority = deepening_priority(node, annotation["stockfish_eval"], depth)
+            heapq.heappush(heap, (-priority, next(order), node, depth, cap))
+    flush()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Iterative-deepening Stockfish annotation")
+    parser.add_argument("--sweep-depth", type=int, default=SWEEP_DEPTH)
+    parser.add_argument("--step", type=int, default=DEPTH_STEP, help="Depth added per deepening pass")
+    parser.add_argument("--max-depth", type=int, default=None, help="Depth cap (default: per-node 18/22/26)")
+    parser.add_argument("--budget-minutes", type=float, default=None, help="Stop after this much wall time")
+    parser.add_argument("--max-searches", type=int, default=None, help="Stop after this many engine searches")
+    parser.add_argument("--max-nodes", type=int, default=None)
+    args = parser.parse_args()
+
+    engine = PersistentEngine(os.environ.get("STOCKFISH_PATH", "stockfish"))
+    try:
+        with get_connection() as conn:
+            stats = schedule_annotations(
+                conn,
+                engine,
+                sweep_depth=args.sweep_depth,
+                step=args.step,
+                max_depth=args.max_depth,
+                budget_seconds=args.budget_minutes * 60 if args.budget_minutes else None,
+                max_searches=args.max_searches,
+                max_nodes=args.max_nodes,
+            )
+    except FileNotFoundError:
+        print("Stockfish not found. Install it or set STOCKFISH_PATH.", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        engine.close()
+    print(f"Swept {stats['swept']} nodes, {stats['deepened']} deeper passes, {stats['searches']} searches.")
+
+
+if __name__ == "__main__":
+    main()
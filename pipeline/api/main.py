@@ -6,10 +6,14 @@ Endpoints:
   GET /opening/eco/{eco_code}  - Tree by ECO
   GET /opening/search?q=...  - Fuzzy name search
   GET /structure/{name}/openings  - Openings by pawn structure
+  GET /structure/search  - Positions by pawn squares, e.g. ?white=c4,e4&black_absent=d
   POST /node/pgn  - Walk tree by PGN moves
+  GET /metrics/pool  - Connection pool size, wait-time and checkout metrics
 """
 
+import re
 import sys
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -18,52 +22,41 @@ import chess
 from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel
 
-from db import get_connection, get_node_by_fen, get_children, get_seed_nodes
-from export import build_tree
+from db import pool_stats
+from db_async import (
+    close_async_pool,
+    get_async_pool,
+    get_child_summaries,
+    get_connection,
+    get_node_by_position_key,
+    get_seed_nodes,
+    get_structure_openings,
+    get_subtree,
+    get_transpositions,
+    search_pawn_structures,
+)
+from export import assemble_tree
+from positions import fen_position_key, position_key
+from structure_sql import parse_pawn_squares, pawn_filter_sql
 
-app = FastAPI(title="Chess Opening Knowledge Base API", version="1.0.0")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the connection pool at startup so the first request skips the handshake."""
+    await get_async_pool()
+    yield
+    await close_async_pool()
 
-class PgnWalkRequest(BaseModel):
-    moves: str  # e.g. "1.e4 e5 2.Nf3 Nc6 3.Bc4"
 
+app = FastAPI(title="Chess Opening Knowledge Base API", version="1.0.0", lifespan=lifespan)
 
-def node_to_response(conn, node, include_children: bool = True, include_transpositions: bool = True):
-    """Convert node to API response dict."""
-    children = []
-    if include_children and node.node_id:
-        for child_id, _ in get_children(conn, node.node_id):
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT node_id, pgn_move, game_count FROM opening_nodes WHERE node_id = %s",
-                    (child_id,),
-                )
-                r = cur.fetchone()
-            if r:
-                children.append({"node_id": str(r[0]), "pgn_move": r[1], "game_count": r[2] or 0})
 
-    transpositions = []
-    if include_transpositions and node.node_id:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT n.node_id, n.opening_name, n.eco_code
-                FROM opening_nodes n
-                WHERE n.node_id IN (
-                    SELECT node_id_b FROM node_transpositions WHERE node_id_a = %s
-                    UNION
-                    SELECT node_id_a FROM node_transpositions WHERE node_id_b = %s
-                )
-                """,
-                (node.node_id, node.node_id),
-            )
-            for row in cur.fetchall():
-                transpositions.append({
-                    "node_id": str(row[0]),
-                    "opening_name": row[1],
-                    "eco_code": row[2],
-                })
+class PgnWalkRequest(BaseModel):
+    moves: str  # e.g. "1.e4 e5 2.Nf3 Nc6 3.Bc4"
+
 
+def node_to_response(node, children: list[tuple] = (), transpositions: list[tuple] = ()) -> dict:
+    """Convert node plus its child summaries and transpositions to an API response dict."""
     return {
         "node_id": str(node.node_id) if node.node_id else None,
         "fen": node.fen,
@@ -80,36 +73,80 @@ def node_to_response(conn, node, include_children: bool = True, include_transpos
         "white_win_pct": node.white_win_pct,
         "draw_pct": node.draw_pct,
         "resulting_structure": node.resulting_structure,
-        "children": children,
-        "transpositions": transpositions,
+        "children": [
+            {"node_id": str(node_id), "pgn_move": pgn_move, "game_count": game_count}
+            for node_id, pgn_move, game_count in children
+        ],
+        "transpositions": [
+            {"node_id": str(node_id), "opening_name": opening_name, "eco_code": eco_code}
+            for node_id, opening_name, eco_code in transpositions
+        ],
     }
 
 
+async def load_node_response(conn, node, include_children: bool = True, include_transpositions: bool = True) -> dict:
+    """Fetch children and transpositions for node and build its response."""
+    children = []
+    if include_children and node.node_id:
+        children = await get_child_summaries(conn, node.node_id)
+    transpositions = []
+    if include_transpositions and node.node_id:
+        transpositions = await get_transpositions(conn, node.node_id)
+    return node_to_response(node, children, transpositions)
+
+
+async def load_tree(conn, root_id, max_depth: int, min_games: int) -> dict | None:
+    """Async export.build_tree: one subtree query, assembled in memory."""
+    nodes, children = await get_subtree(conn, root_id, max_depth, min_games)
+    return assemble_tree(nodes, children, root_id, max_depth, 0, min_games)
+
+
+def parse_pgn_moves(moves: str) -> chess.Board:
+    """Play a '1.e4 e5 2.Nf3' style move string from the start position."""
+    # Strip move numbers (1. 2. etc) and parse SAN moves
+    pgn_clean = re.sub(r"\d+\.\s*", "", moves)
+    sans = pgn_clean.split()
+    if not sans:
+        raise HTTPException(status_code=400, detail="Invalid PGN")
+    board = chess.Board()
+    for san in sans:
+        try:
+            move = board.parse_san(san)
+            board.push(move)
+        except (chess.InvalidMoveError, chess.AmbiguousMoveError):
+            raise HTTPException(status_code=400, detail=f"Invalid move: {san}")
+    return board
+
+
 @app.get("/node/fen/{fen:path}")
-def get_node_by_fen_endpoint(fen: str):
+async def get_node_by_fen_endpoint(fen: str):
     """Lookup node by FEN."""
     fen = fen.replace("_", " ")
-    with get_connection() as conn:
-        node = get_node_by_fen(conn, fen)
+    try:
+        key = fen_position_key(fen)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid FEN")
+    async with get_connection() as conn:
+        node = await get_node_by_position_key(conn, key)
         if not node:
             raise HTTPException(status_code=404, detail="Node not found")
-        return node_to_response(conn, node)
+        return await load_node_response(conn, node)
 
 
 @app.get("/opening/eco/{eco_code}")
-def get_opening_by_eco(
+async def get_opening_by_eco(
     eco_code: str,
     depth: int = Query(15, le=15),
     min_games: int = Query(50),
 ):
     """Get full opening tree by ECO code, up to specified depth."""
-    with get_connection() as conn:
-        seeds = get_seed_nodes(conn)
+    async with get_connection() as conn:
+        seeds = await get_seed_nodes(conn)
         seeds = [s for s in seeds if s.eco_code == eco_code]
         if not seeds:
             raise HTTPException(status_code=404, detail=f"ECO {eco_code} not found")
         seed = seeds[0]
-        tree = build_tree(conn, seed.node_id, depth, 0, min_games)
+        tree = await load_tree(conn, seed.node_id, depth, min_games)
         if not tree:
             raise HTTPException(status_code=404, detail="Opening tree is empty")
 
@@ -122,7 +159,7 @@ def get_opening_by_eco(
 
 
 @app.get("/opening/{opening_id}/tree")
-def get_opening_tree(
+async def get_opening_tree(
     opening_id: str,
     depth: int = Query(15, le=15),
     min_games: int = Query(50),
@@ -132,9 +169,9 @@ def get_opening_tree(
     opening_id matches the 'id' field in exported JSON files (e.g. 'c50-italian-game').
     Falls back to ECO code prefix match if no exact id match.
     """
-    with get_connection() as conn:
+    async with get_connection() as conn:
         eco_guess = opening_id.split("-")[0].upper() if "-" in opening_id else opening_id.upper()
-        seeds = get_seed_nodes(conn)
+        seeds = await get_seed_nodes(conn)
         matches = [s for s in seeds if s.eco_code == eco_guess]
         if not matches:
             name_guess = opening_id.replace("-", " ").lower()
@@ -143,7 +180,7 @@ def get_opening_tree(
             raise HTTPException(status_code=404, detail=f"Opening '{opening_id}' not found")
 
         seed = matches[0]
-        tree = build_tree(conn, seed.node_id, depth, 0, min_games)
+        tree = await load_tree(conn, seed.node_id, depth, min_games)
         if not tree:
             raise HTTPException(status_code=404, detail="Opening tree is empty")
 
@@ -159,10 +196,10 @@ def get_opening_tree(
 
 
 @app.get("/opening/search")
-def search_openings(q: str = Query(..., min_length=1), limit: int = Query(20, le=100)):
+async def search_openings(q: str = Query(..., min_length=1), limit: int = Query(20, le=100)):
     """Fuzzy search by opening name."""
-    with get_connection() as conn:
-        seeds = get_seed_nodes(conn)
+    async with get_connection() as conn:
+        seeds = await get_seed_nodes(conn)
         q_lower = q.lower()
         matches = [s for s in seeds if q_lower in s.opening_name.lower()][:limit]
         return [
@@ -171,44 +208,62 @@ def search_openings(q: str = Query(..., min_length=1), limit: int = Query(20, le
         ]
 
 
+@app.get("/structure/search")
+async def search_structures(
+    white: str = Query("", description="Squares or files White must have pawns on, e.g. c4,e4"),
+    black: str = Query("", description="Squares or files Black must have pawns on"),
+    white_absent: str = Query("", description="Squares or files with no White pawn, e.g. d"),
+    black_absent: str = Query("", description="Squares or files with no Black pawn"),
+    limit: int = Query(50, le=500),
+):
+    """Most-played positions matching a pawn pattern, evaluated on the stored pawn bitboards."""
+    try:
+        predicate = pawn_filter_sql(
+            parse_pawn_squares(white),
+            parse_pawn_squares(black),
+            parse_pawn_squares(white_absent),
+            parse_pawn_squares(black_absent),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid pawn filter: {e}")
+    async with get_connection() as conn:
+        nodes = await search_pawn_structures(conn, predicate, limit)
+    return [
+        {
+            "node_id": str(node.node_id),
+            "fen": node.fen,
+            "pgn_move": node.pgn_move,
+            "eco_code": node.eco_code,
+            "opening_name": node.opening_name,
+            "game_count": node.game_count,
+        }
+        for node in nodes
+    ]
+
+
 @app.get("/structure/{structure_name}/openings")
-def get_openings_by_structure(structure_name: str):
+async def get_openings_by_structure(structure_name: str):
     """Get openings that resolve to a pawn structure."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT DISTINCT eco_code, opening_name FROM opening_nodes
-                WHERE resulting_structure ILIKE %s
-                """,
-                (f"%{structure_name}%",),
-            )
-            rows = cur.fetchall()
+    async with get_connection() as conn:
+        rows = await get_structure_openings(conn, structure_name)
         return [{"eco_code": r[0], "opening_name": r[1]} for r in rows]
 
 
 @app.post("/node/pgn")
-def walk_pgn(body: PgnWalkRequest):
+async def walk_pgn(body: PgnWalkRequest):
     """Walk tree by PGN move sequence, return final node."""
-    import re
-    # Strip move numbers (1. 2. etc) and parse SAN moves
-    pgn_clean = re.sub(r"\d+\.\s*", "", body.moves)
-    moves = pgn_clean.split()
-    if not moves:
-        raise HTTPException(status_code=400, detail="Invalid PGN")
-    board = chess.Board()
-    for san in moves:
-        try:
-            move = board.parse_san(san)
-            board.push(move)
-        except (chess.InvalidMoveError, chess.AmbiguousMoveError):
-            raise HTTPException(status_code=400, detail=f"Invalid move: {san}")
-    fen = board.fen()
-    with get_connection() as conn:
-        node = get_node_by_fen(conn, fen)
+    key = position_key(parse_pgn_moves(body.moves))
+    async with get_connection() as conn:
+        node = await get_node_by_position_key(conn, key)
         if not node:
             raise HTTPException(status_code=404, detail="Position not in database")
-        return node_to_response(conn, node)
+        return await load_node_response(conn, node)
+
+
+@app.get("/metrics/pool")
+async def get_pool_metrics():
+    """Connection pool metrics, for tuning DB_POOL_* settings under load."""
+    return pool_stats()
 
 
 @app.get("/health")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Load benchmark: sync vs async query API under concurrent clients.
+
+Runs a single uvicorn worker per mode against the database in DATABASE_URL:
+  async - api.main:app (async def handlers on db_async and the async pool)
+  sync  - sync_app below: the same /node/fen and /node/pgn endpoints as plain
+          def handlers on db.py, i.e. blocking calls in Starlette's threadpool
+
+Each concurrency level fires --requests requests split across /node/fen and
+/node/pgn and reports throughput and p50/p99 latency. Needs a populated
+opening_nodes table; FENs are sampled from it and move sequences from the
+ECO TSVs it was seeded with.
+
+Usage:
+  python benchmarks/bench_api_concurrency.py --concurrency 50 200 1000 --requests 5000
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import FastAPI, HTTPException
+
+from api.main import PgnWalkRequest, node_to_response, parse_pgn_moves
+from db import get_child_summaries, get_connection, get_node_by_position_key, get_transpositions, stream_query
+from positions import fen_position_key, position_key
+
+PIPELINE_DIR = Path(__file__).resolve().parent.parent
+
+sync_app = FastAPI(title="Sync baseline")
+
+
+def _sync_response(conn, node) -> dict:
+    return node_to_response(
+        node,
+        get_child_summaries(conn, node.node_id),
+        get_transpositions(conn, node.node_id),
+    )
+
+
+@sync_app.get("/node/fen/{fen:path}")
+def sync_node_by_fen(fen: str):
+    try:
+        key = fen_position_key(fen.replace("_", " "))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid FEN")
+    with get_connection() as conn:
+        node = get_node_by_position_key(conn, key)
+        if not node:
+            raise HTTPException(status_code=404, detail="Node not found")
+        return _sync_response(conn, node)
+
+
+@sync_app.post("/node/pgn")
+def sync_walk_pgn(body: PgnWalkRequest):
+    key = position_key(parse_pgn_moves(body.moves))
+    with get_connection() as conn:
+        node = get_node_by_position_key(conn, key)
+        if not node:
+            raise HTTPException(status_code=404, detail="Position not in database")
+        return _sync_response(conn, node)
+
+
+APPS = {
+    "sync": "benchmarks.bench_api_concurrency:sync_app",
+    "async": "api.main:app",
+}
+
+
+def sample_fens(count: int) -> list[str]:
+    """FENs of up to count random nodes that have game data."""
+    with get_connection() as conn:
+        rows = stream_query(
+            conn,
+            "SELECT fen FROM opening_nodes WHERE game_count > 0 ORDER BY random() LIMIT %s",
+            (count,),
+        )
+        return [fen for (fen,) in rows]
+
+
+def sample_lines(eco_dir: Path, count: int) -> list[str]:
+    """Move strings from the ECO TSVs; each ends on a seed node written by eco_ingest."""
+    lines = []
+    for tsv_path in sorted(eco_dir.glob("*.tsv")):
+        with open(tsv_path, encoding="utf-8") as f:
+            lines.extend(row["pgn"] for row in csv.DictReader(f, delimiter="\t") if row.get("pgn"))
+    random.shuffle(lines)
+    return lines[:count]
+
+
+def start_server(target: str, port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--workers", "1", "--log-level", "warning"],
+        cwd=PIPELINE_DIR,
+        env=dict(os.environ, PYTHONPATH=str(PIPELINE_DIR)),
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"uvicorn did not start for {target}")
+
+
+async def run_load(base_url: str, fens: list[str], lines: list[str], concurrency: int, total: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    next_request = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for i in next_request:
+                started = time.perf_counter()
+                if i % 2 or not lines:
+                    resp = await client.get("/node/fen/" + random.choice(fens).replace(" ", "_"))
+                else:
+                    resp = await client.post("/node/pgn", json={"moves": random.choice(lines)})
+                latencies.append(time.perf_counter() - started)
+                if resp.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async API load benchmark")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per concurrency level")
+    parser.add_argument("--sample", type=int, default=500, help="Distinct positions to request")
+    parser.add_argument("--eco-dir", default="data/eco", help="ECO TSVs for /node/pgn move sequences")
+    parser.add_argument("--modes", nargs="+", choices=list(APPS), default=list(APPS))
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    fens = sample_fens(args.sample)
+    lines = sample_lines(Path(args.eco_dir), args.sample)
+    if not fens:
+        sys.exit("opening_nodes is empty; run the pipeline first")
+
+    print(f"{'mode':<6} {'clients':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for mode in args.modes:
+        proc = start_server(APPS[mode], args.port)
+        try:
+            for concurrency in args.concurrency:
+                r = asyncio.run(run_load(f"http://127.0.0.1:{args.port}", fens, lines, concurrency, args.requests))
+                print(
+                    f"{mode:<6} {concurrency:>8} {r['rps']:>9.0f} {r['p50_ms']:>9.1f} "
+                    f"{r['p99_ms']:>9.1f} {r['errors']:>7}"
+                )
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
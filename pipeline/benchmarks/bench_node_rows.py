@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: memory and time to materialize OpeningNode rows.
+
+Compares the previous representation (plain dataclass with two list default
+factories per instance) against the slotted OpeningNode built by db.node_from_row.
+Does not need a database; rows are synthesized in the NODE_COLUMNS layout.
+
+Usage:
+  python benchmarks/bench_node_rows.py --rows 1000000
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Literal
+from uuid import UUID
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from db import node_from_row
+
+
+@dataclass
+class LegacyOpeningNode:
+    """OpeningNode as it was before slots and lazy list fields."""
+
+    node_id: UUID | None = None
+    fen: str = ""
+    pgn_move: str = ""
+    move_number: int = 0
+    side: Literal["W", "B"] = "W"
+    eco_code: str = ""
+    opening_name: str = ""
+    variation_name: str | None = None
+    parent_node_id: UUID | None = None
+    child_node_ids: list[UUID] = field(default_factory=list)
+    is_branching_node: bool = False
+    stockfish_eval: float | None = None
+    stockfish_depth: int | None = None
+    best_move: str | None = None
+    is_dubious: bool = False
+    is_busted: bool = False
+    transposition_ids: list[UUID] = field(default_factory=list)
+    resulting_structure: str | None = None
+    game_count: int = 0
+    white_win_pct: float | None = None
+    draw_pct: float | None = None
+    is_leaf: bool = False
+
+
+LEGACY_COLUMNS = 20  # NODE_COLUMNS before position_key was added
+
+
+def legacy_from_row(r) -> LegacyOpeningNode:
+    return LegacyOpeningNode(
+        node_id=r[0], fen=r[1], pgn_move=r[2], move_number=r[3], side=r[4],
+        eco_code=r[5] or "", opening_name=r[6] or "", variation_name=r[7],
+        parent_node_id=r[8], is_branching_node=r[9], is_leaf=r[10],
+        stockfish_eval=r[11], stockfish_depth=r[12], best_move=r[13],
+        is_dubious=r[14], is_busted=r[15], resulting_structure=r[16],
+        game_count=r[17] or 0, white_win_pct=r[18], draw_pct=r[19],
+    )
+
+
+def make_rows(n: int) -> list[tuple]:
+    """Rows share their string/UUID payloads so only node objects are measured."""
+    node_id = uuid.uuid4()
+    fen = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+    row = (node_id, fen, "e4", 1, "W", "C50", "Italian Game", None, node_id, True, False,
+           31.5, 22, "e5", False, False, None, 1200, 38.2, 34.1, -4_567_890_123_456_789_012)
+    return [row] * n
+
+
+def measure(mapper, rows: list[tuple]) -> tuple[float, int]:
+    """Time without tracing (tracemalloc slows allocation), then trace peak memory."""
+    gc.collect()
+    t0 = time.perf_counter()
+    nodes = [mapper(r) for r in rows]
+    elapsed = time.perf_counter() - t0
+    del nodes
+    gc.collect()
+    tracemalloc.start()
+    nodes = [mapper(r) for r in rows]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del nodes
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    # Sliced up front so the baseline sees the old row width without timing the slice.
+    legacy_rows = [rows[0][:LEGACY_COLUMNS]] * args.rows
+    scale = 1_000_000 / args.rows
+    results = {}
+    for label, mapper, mapped_rows in (
+        ("before (dataclass + lists)", legacy_from_row, legacy_rows),
+        ("after (slots, lazy lists)", node_from_row, rows),
+    ):
+        elapsed, peak = measure(mapper, mapped_rows)
+        results[label] = (elapsed * scale, peak * scale)
+
+    print(f"Per 1M rows (measured on {args.rows:,}):")
+    for label, (elapsed, peak) in results.items():
+        print(f"  {label:28s} {elapsed:7.2f} s   {peak / 2**20:8.1f} MiB")
+    (t_old, m_old), (t_new, m_new) = results.values()
+    print(f"  time x{t_old / t_new:.2f} faster, memory x{m_old / m_new:.2f} smaller")
+
+
+if __name__ == "__main__":
+    main()
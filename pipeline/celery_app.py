@@ -1,9 +1,20 @@
-"""Celery application for parallel Stockfish annotation."""
+"""Celery application for parallel Stockfish annotation.
+
+Each worker process keeps one Stockfish engine open for its whole life
+(Threads/Hash from STOCKFISH_THREADS/STOCKFISH_HASH_MB), so tasks pay no
+process spawn or UCI handshake and keep a warm hash table. Tasks carry
+batches of node IDs.
+"""
 
 import os
+import sys
+import warnings
+
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+STOCKFISH_PATH = os.environ.get("STOCKFISH_PATH", "stockfish")
 
 app = Celery("annotator", broker=REDIS_URL, backend=REDIS_URL)
 app.conf.update(
@@ -14,47 +25,77 @@ app.conf.update(
     worker_prefetch_multiplier=1,
 )
 
+_engine = None
+
+
+def get_engine(stockfish_path: str = STOCKFISH_PATH):
+    """This worker process's engine, created on first use."""
+    global _engine
+    if _engine is None:
+        from stockfish_annotator import PersistentEngine
+
+        _engine = PersistentEngine(stockfish_path)
+    return _engine
+
+
+@worker_process_init.connect
+def _start_engine(**kwargs):
+    get_engine().engine  # spawn Stockfish before the first task arrives
+
+
+@worker_process_shutdown.connect
+def _stop_engine(**kwargs):
+    global _engine
+    if _engine is not None:
+        _engine.close()
+        _engine = None
+
 
 @app.task(bind=True, max_retries=3)
-def annotate_node_task(self, node_id_str: str, stockfish_path: str, depth: int):
-    """Celery task: annotate a single node with Stockfish."""
+def annotate_nodes_task(self, node_id_strs: list[str], depth: int | None = None):
+    """Celery task: annotate a batch of nodes on this worker's engine, one commit per batch."""
     import uuid
-    from db import get_connection, get_node_by_id, update_node, log_node_change
-    from stockfish_annotator import is_dubious, is_busted, score_to_cp
-    import chess
+
     import chess.engine
 
-    node_id = uuid.UUID(node_id_str)
+    from db import get_connection, get_nodes_by_ids
+    from stockfish_annotator import analyse_node, target_depth, write_annotation
+
+    engine = get_engine()
     try:
         with get_connection() as conn:
-            node = get_node_by_id(conn, node_id)
-            if node is None or node.stockfish_eval is not None:
-                return
-
-            board = chess.Board(node.fen)
-            with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-                info = engine.analyse(board, chess.engine.Limit(depth=depth), multipv=1)
-
-            if not info:
-                return
-            score = info[0].get("score")
-            if score is None:
-                return
-
-            eval_cp = score_to_cp(score)
-            pv = info[0].get("pv", [])
-            best_san = board.san(pv[0]) if pv else None
-
-            update_node(
-                conn, node_id,
-                stockfish_eval=eval_cp,
-                stockfish_depth=depth,
-                best_move=best_san,
-                is_dubious=is_dubious(eval_cp, node.side),
-                is_busted=is_busted(eval_cp, node.side),
-            )
-            log_node_change(conn, node_id, "stockfish_eval", None, eval_cp)
-            log_node_change(conn, node_id, "stockfish_depth", None, depth)
+            nodes = get_nodes_by_ids(conn, [uuid.UUID(s) for s in node_id_strs])
+            annotated = 0
+            for node in nodes:
+                if node.stockfish_eval is not None:
+                    continue
+                try:
+                    annotation = analyse_node(engine, node, depth or target_depth(node), conn)
+                except chess.engine.EngineError as e:
+                    print(f"Engine error on {node.node_id}: {e}", file=sys.stderr)
+                    continue
+                if annotation is None:
+                    continue
+                write_annotation(conn, node.node_id, annotation)
+                annotated += 1
             conn.commit()
+            return annotated
     except Exception as exc:
         raise self.retry(exc=exc, countdown=5)
+
+
+@app.task
+def annotate_node_task(node_id_str: str, stockfish_path: str | None = None, depth: int | None = None):
+    """
+    Celery task: annotate a single node. Kept for callers that enqueue one node
+    at a time. The engine is always the worker's (STOCKFISH_PATH); stockfish_path
+    is still accepted so queued (node_id, stockfish_path, depth) calls keep
+    working, but it is ignored and deprecated.
+    """
+    if stockfish_path is not None:
+        warnings.warn(
+            "annotate_node_task ignores stockfish_path; workers use STOCKFISH_PATH",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    return annotate_nodes_task([node_id_str], depth)
@@ -1,14 +1,70 @@
 """Database layer for the Chess Opening Knowledge Base."""
 
+import atexit
+import itertools
 import os
-from contextlib import contextmanager
-from typing import Iterator
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
 from uuid import UUID
 
 import psycopg
-from psycopg.rows import class_row
+from psycopg.rows import RowMaker
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 
-from models import OpeningEntry, OpeningNode
+from models import OpeningEntry, OpeningNode, PositionEval
+from positions import fen_pawn_bitboards, fen_position_key, to_signed64
+
+# Pool sizing is per process: the API and each pipeline script get their own pool.
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "600"))
+POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600"))
+
+# Rows per round trip for server-side (streaming) cursors.
+DEFAULT_ITERSIZE = int(os.environ.get("DB_ITERSIZE", "2000"))
+
+_pool: ConnectionPool | None = None
+_async_pool: AsyncConnectionPool | None = None
+_stream_ids = itertools.count()
+
+# Column order shared by every opening_nodes reader; node_from_row maps rows in this order.
+NODE_COLUMNS = (
+    "node_id", "fen", "pgn_move", "move_number", "side", "eco_code", "opening_name",
+    "variation_name", "parent_node_id", "is_branching_node", "is_leaf", "stockfish_eval",
+    "stockfish_depth", "best_move", "is_dubious", "is_busted", "resulting_structure",
+    "game_count", "white_win_pct", "draw_pct", "position_key",
+)
+
+
+def node_columns(alias: str | None = None) -> str:
+    """SELECT list for NODE_COLUMNS, optionally qualified with a table alias."""
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(prefix + c for c in NODE_COLUMNS)
+
+
+NODE_SELECT = node_columns()
+
+
+def node_from_row(row, offset: int = 0) -> OpeningNode:
+    """Map a row holding NODE_COLUMNS (starting at offset) to an OpeningNode."""
+    if offset:
+        row = row[offset:]
+    return OpeningNode(
+        node_id=row[0], fen=row[1], pgn_move=row[2], move_number=row[3], side=row[4],
+        eco_code=row[5] or "", opening_name=row[6] or "", variation_name=row[7],
+        parent_node_id=row[8], is_branching_node=row[9], is_leaf=row[10],
+        stockfish_eval=row[11], stockfish_depth=row[12], best_move=row[13],
+        is_dubious=row[14], is_busted=row[15], resulting_structure=row[16],
+        game_count=row[17] or 0, white_win_pct=row[18], draw_pct=row[19],
+        position_key=row[20],
+    )
+
+
+def node_row(cursor) -> RowMaker[OpeningNode]:
+    """psycopg row factory for queries selecting NODE_SELECT."""
+    return node_from_row
 
 
 def get_connection_string() -> str:
@@ -19,18 +75,177 @@ def get_connection_string() -> str:
     )
 
 
+def _pool_kwargs() -> dict:
+    return dict(
+        min_size=POOL_MIN_SIZE,
+        max_size=max(POOL_MIN_SIZE, POOL_MAX_SIZE),
+        timeout=POOL_TIMEOUT,
+        max_idle=POOL_MAX_IDLE,
+        max_lifetime=POOL_MAX_LIFETIME,
+    )
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, opening it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            get_connection_string(),
+            check=ConnectionPool.check_connection,
+            name="chess_openings",
+            open=True,
+            **_pool_kwargs(),
+        )
+    return _pool
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """Return the process-wide async connection pool, opening it on first use."""
+    global _async_pool
+    if _async_pool is None:
+        pool = AsyncConnectionPool(
+            get_connection_string(),
+            check=AsyncConnectionPool.check_connection,
+            name="chess_openings_async",
+            open=False,
+            **_pool_kwargs(),
+        )
+        await pool.open()
+        _async_pool = pool
+    return _async_pool
+
+
+def close_pool() -> None:
+    """Close the sync pool (registered atexit for pipeline scripts)."""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+async def close_async_pool() -> None:
+    """Close the async pool (called on API shutdown)."""
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+atexit.register(close_pool)
+
+
 @contextmanager
 def get_connection():
-    """Context manager for database connections."""
-    conn = psycopg.connect(get_connection_string())
-    try:
+    """Context manager for pooled database connections.
+
+    Commits on success and rolls back on error; the connection is returned to
+    the pool rather than closed. Health is checked on checkout.
+    """
+    with get_pool().connection() as conn:
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+
+
+@asynccontextmanager
+async def get_async_connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """Async counterpart of get_connection(), backed by the async pool."""
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+def _summarize_pool_stats(stats: dict) -> dict:
+    requests = stats.get("requests_num", 0)
+    return {
+        "size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "min_size": stats.get("pool_min", 0),
+        "max_size": stats.get("pool_max", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "checkouts": requests,
+        "checkouts_queued": stats.get("requests_queued", 0),
+        "checkout_errors": stats.get("requests_errors", 0),
+        "wait_ms_total": stats.get("requests_wait_ms", 0),
+        "wait_ms_avg": stats.get("requests_wait_ms", 0) / requests if requests else 0.0,
+        "usage_ms_total": stats.get("usage_ms", 0),
+        "connections_opened": stats.get("connections_num", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+        "bad_returns": stats.get("returns_bad", 0),
+    }
+
+
+def pool_stats() -> dict:
+    """Size, wait-time and checkout metrics for the open pools (sync and async)."""
+    out = {}
+    if _pool is not None:
+        out["sync"] = _summarize_pool_stats(_pool.get_stats())
+    if _async_pool is not None:
+        out["async"] = _summarize_pool_stats(_async_pool.get_stats())
+    return out
+
+
+# Merge rules shared by upsert_node and upsert_nodes: never overwrite known values with
+# NULL, OR the flags together and keep the largest game_count.
+_NODE_UPSERT_CONFLICT = """
+    ON CONFLICT (fen) DO UPDATE SET
+        pgn_move = COALESCE(EXCLUDED.pgn_move, opening_nodes.pgn_move),
+        move_number = COALESCE(EXCLUDED.move_number, opening_nodes.move_number),
+        side = COALESCE(EXCLUDED.side, opening_nodes.side),
+        eco_code = COALESCE(NULLIF(EXCLUDED.eco_code, ''), opening_nodes.eco_code),
+        opening_name = COALESCE(NULLIF(EXCLUDED.opening_name, ''), opening_nodes.opening_name),
+        variation_name = COALESCE(EXCLUDED.variation_name, opening_nodes.variation_name),
+        parent_node_id = COALESCE(EXCLUDED.parent_node_id, opening_nodes.parent_node_id),
+        is_branching_node = opening_nodes.is_branching_node OR EXCLUDED.is_branching_node,
+        is_leaf = opening_nodes.is_leaf OR EXCLUDED.is_leaf,
+        stockfish_eval = COALESCE(EXCLUDED.stockfish_eval, opening_nodes.stockfish_eval),
+        stockfish_depth = COALESCE(EXCLUDED.stockfish_depth, opening_nodes.stockfish_depth),
+        best_move = COALESCE(EXCLUDED.best_move, opening_nodes.best_move),
+        is_dubious = opening_nodes.is_dubious OR EXCLUDED.is_dubious,
+        is_busted = opening_nodes.is_busted OR EXCLUDED.is_busted,
+        resulting_structure = COALESCE(EXCLUDED.resulting_structure, opening_nodes.resulting_structure),
+        game_count = GREATEST(opening_nodes.game_count, COALESCE(EXCLUDED.game_count, 0)),
+        white_win_pct = COALESCE(EXCLUDED.white_win_pct, opening_nodes.white_win_pct),
+        draw_pct = COALESCE(EXCLUDED.draw_pct, opening_nodes.draw_pct),
+        position_key = EXCLUDED.position_key,
+        white_pawns = EXCLUDED.white_pawns,
+        black_pawns = EXCLUDED.black_pawns,
+        updated_at = NOW()
+"""
+
+_NODE_WRITE_COLUMNS = (
+    "fen", "pgn_move", "move_number", "side", "eco_code", "opening_name", "variation_name",
+    "parent_node_id", "is_branching_node", "is_leaf", "stockfish_eval", "stockfish_depth",
+    "best_move", "is_dubious", "is_busted", "resulting_structure", "game_count",
+    "white_win_pct", "draw_pct", "position_key", "white_pawns", "black_pawns",
+)
+
+
+def _node_write_values(node: OpeningNode) -> tuple:
+    """Values for _NODE_WRITE_COLUMNS, in order. Pawn bitboards are always derived from the FEN."""
+    white_pawns, black_pawns = fen_pawn_bitboards(node.fen)
+    return (
+        node.fen,
+        node.pgn_move,
+        node.move_number,
+        node.side,
+        node.eco_code or None,
+        node.opening_name or None,
+        node.variation_name,
+        node.parent_node_id,
+        node.is_branching_node,
+        node.is_leaf,
+        node.stockfish_eval,
+        node.stockfish_depth,
+        node.best_move,
+        node.is_dubious,
+        node.is_busted,
+        node.resulting_structure,
+        node.game_count,
+        node.white_win_pct,
+        node.draw_pct,
+        node.position_key if node.position_key is not None else fen_position_key(node.fen),
+        to_signed64(white_pawns),
+        to_signed64(black_pawns),
+    )
 
 
 def upsert_node(conn: psycopg.Connection, node: OpeningNode) -> OpeningNode:
@@ -38,91 +253,85 @@ def upsert_node(conn: psycopg.Connection, node: OpeningNode) -> OpeningNode:
     Insert or update a node. Uses FEN as conflict key.
     Returns the node with node_id populated.
     """
-    with conn.cursor() as cur:
+    with conn.cursor(row_factory=node_row) as cur:
         cur.execute(
-            """
+            f"""
             INSERT INTO opening_nodes (
                 fen, pgn_move, move_number, side, eco_code, opening_name, variation_name,
                 parent_node_id, is_branching_node, is_leaf, stockfish_eval, stockfish_depth,
                 best_move, is_dubious, is_busted, resulting_structure, game_count,
-                white_win_pct, draw_pct
+                white_win_pct, draw_pct, position_key, white_pawns, black_pawns
             ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
             )
-            ON CONFLICT (fen) DO UPDATE SET
-                pgn_move = COALESCE(EXCLUDED.pgn_move, opening_nodes.pgn_move),
-                move_number = COALESCE(EXCLUDED.move_number, opening_nodes.move_number),
-                side = COALESCE(EXCLUDED.side, opening_nodes.side),
-                eco_code = COALESCE(NULLIF(EXCLUDED.eco_code, ''), opening_nodes.eco_code),
-                opening_name = COALESCE(NULLIF(EXCLUDED.opening_name, ''), opening_nodes.opening_name),
-                variation_name = COALESCE(EXCLUDED.variation_name, opening_nodes.variation_name),
-                parent_node_id = COALESCE(EXCLUDED.parent_node_id, opening_nodes.parent_node_id),
-                is_branching_node = opening_nodes.is_branching_node OR EXCLUDED.is_branching_node,
-                is_leaf = opening_nodes.is_leaf OR EXCLUDED.is_leaf,
-                stockfish_eval = COALESCE(EXCLUDED.stockfish_eval, opening_nodes.stockfish_eval),
-                stockfish_depth = COALESCE(EXCLUDED.stockfish_depth, opening_nodes.stockfish_depth),
-                best_move = COALESCE(EXCLUDED.best_move, opening_nodes.best_move),
-                is_dubious = opening_nodes.is_dubious OR EXCLUDED.is_dubious,
-                is_busted = opening_nodes.is_busted OR EXCLUDED.is_busted,
-                resulting_structure = COALESCE(EXCLUDED.resulting_structure, opening_nodes.resulting_structure),
-                game_count = GREATEST(opening_nodes.game_count, COALESCE(EXCLUDED.game_count, 0)),
-                white_win_pct = COALESCE(EXCLUDED.white_win_pct, opening_nodes.white_win_pct),
-                draw_pct = COALESCE(EXCLUDED.draw_pct, opening_nodes.draw_pct),
-                updated_at = NOW()
-            RETURNING node_id, fen, pgn_move, move_number, side, eco_code, opening_name,
-                variation_name, parent_node_id, is_branching_node, is_leaf, stockfish_eval,
-                stockfish_depth, best_move, is_dubious, is_busted, resulting_structure,
-                game_count, white_win_pct, draw_pct
+            {_NODE_UPSERT_CONFLICT}
+            RETURNING {NODE_SELECT}
             """,
-            (
-                node.fen,
-                node.pgn_move,
-                node.move_number,
-                node.side,
-                node.eco_code or None,
-                node.opening_name or None,
-                node.variation_name,
-                node.parent_node_id,
-                node.is_branching_node,
-                node.is_leaf,
-                node.stockfish_eval,
-                node.stockfish_depth,
-                node.best_move,
-                node.is_dubious,
-                node.is_busted,
-                node.resulting_structure,
-                node.game_count,
-                node.white_win_pct,
-                node.draw_pct,
-            ),
+            _node_write_values(node),
         )
-        row = cur.fetchone()
-        if row:
-            return OpeningNode(
-                node_id=row[0],
-                fen=row[1],
-                pgn_move=row[2],
-                move_number=row[3],
-                side=row[4],
-                eco_code=row[5] or "",
-                opening_name=row[6] or "",
-                variation_name=row[7],
-                parent_node_id=row[8],
-                is_branching_node=row[9],
-                is_leaf=row[10],
-                stockfish_eval=row[11],
-                stockfish_depth=row[12],
-                best_move=row[13],
-                is_dubious=row[14],
-                is_busted=row[15],
-                resulting_structure=row[16],
-                game_count=row[17] or 0,
-                white_win_pct=row[18],
-                draw_pct=row[19],
-            )
+        stored = cur.fetchone()
+        if stored:
+            return stored
     raise RuntimeError("upsert_node failed to return row")
 
 
+def upsert_nodes(conn: psycopg.Connection, nodes: list[OpeningNode]) -> dict[str, UUID]:
+    """
+    Bulk insert or update nodes: COPY into a temp staging table, then one merge.
+    Applies the same merge rules as upsert_node. Within a batch, the last node for
+    a given FEN wins before merging with the stored row.
+    Returns node_id keyed by FEN.
+    """
+    if not nodes:
+        return {}
+    columns = ", ".join(_NODE_WRITE_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS opening_nodes_stage (
+                seq             INTEGER,
+                fen             TEXT,
+                pgn_move        TEXT,
+                move_number     INTEGER,
+                side            CHAR(1),
+                eco_code        TEXT,
+                opening_name    TEXT,
+                variation_name  TEXT,
+                parent_node_id  UUID,
+                is_branching_node BOOLEAN,
+                is_leaf         BOOLEAN,
+                stockfish_eval  REAL,
+                stockfish_depth INTEGER,
+                best_move       TEXT,
+                is_dubious      BOOLEAN,
+                is_busted       BOOLEAN,
+                resulting_structure TEXT,
+                game_count      INTEGER,
+                white_win_pct   REAL,
+                draw_pct        REAL,
+                position_key    BIGINT,
+                white_pawns     BIGINT,
+                black_pawns     BIGINT
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        cur.execute("TRUNCATE opening_nodes_stage")
+        with cur.copy(f"COPY opening_nodes_stage (seq, {columns}) FROM STDIN") as copy:
+            for seq, node in enumerate(nodes):
+                copy.write_row((seq, *_node_write_values(node)))
+        cur.execute(
+            f"""
+            INSERT INTO opening_nodes ({columns})
+            SELECT DISTINCT ON (fen) {columns}
+            FROM opening_nodes_stage
+            ORDER BY fen, seq DESC
+            {_NODE_UPSERT_CONFLICT}
+            RETURNING fen, node_id
+            """
+        )
+        return {fen: node_id for fen, node_id in cur.fetchall()}
+
+
 def add_child(conn: psycopg.Connection, parent_id: UUID, child_id: UUID, sort_order: int = 0) -> None:
     """Add a parent-child relationship."""
     with conn.cursor() as cur:
@@ -136,6 +345,43 @@ def add_child(conn: psycopg.Connection, parent_id: UUID, child_id: UUID, sort_or
         )
 
 
+def add_children(conn: psycopg.Connection, edges: list[tuple[UUID, UUID, int]]) -> None:
+    """Add many (parent_id, child_id, sort_order) relationships in one pipelined batch."""
+    if not edges:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO node_children (parent_id, child_id, sort_order)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (parent_id, child_id) DO UPDATE SET sort_order = EXCLUDED.sort_order
+            """,
+            edges,
+        )
+
+
+def set_branching_nodes(conn: psycopg.Connection, node_ids: list[UUID]) -> None:
+    """Mark many nodes as branching in one statement."""
+    if not node_ids:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE opening_nodes SET is_branching_node = TRUE, updated_at = NOW() WHERE node_id = ANY(%s)",
+            (list(node_ids),),
+        )
+
+
+def set_position_keys(conn: psycopg.Connection, keys: list[tuple[UUID, int]]) -> None:
+    """Write (node_id, position_key) pairs in one pipelined batch."""
+    if not keys:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            "UPDATE opening_nodes SET position_key = %s WHERE node_id = %s",
+            [(key, node_id) for node_id, key in keys],
+        )
+
+
 def set_branching(conn: psycopg.Connection, node_id: UUID, is_branching: bool) -> None:
     """Mark a node as branching."""
     with conn.cursor() as cur:
@@ -147,68 +393,72 @@ def set_branching(conn: psycopg.Connection, node_id: UUID, is_branching: bool) -
 
 def get_node_by_id(conn: psycopg.Connection, node_id: UUID) -> OpeningNode | None:
     """Fetch a single node by node_id UUID."""
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT node_id, fen, pgn_move, move_number, side, eco_code, opening_name,
-                variation_name, parent_node_id, is_branching_node, is_leaf, stockfish_eval,
-                stockfish_depth, best_move, is_dubious, is_busted, resulting_structure,
-                game_count, white_win_pct, draw_pct
-            FROM opening_nodes WHERE node_id = %s
-            """,
-            (node_id,),
-        )
-        row = cur.fetchone()
-    if not row:
-        return None
-    return OpeningNode(
-        node_id=row[0], fen=row[1], pgn_move=row[2], move_number=row[3], side=row[4],
-        eco_code=row[5] or "", opening_name=row[6] or "", variation_name=row[7],
-        parent_node_id=row[8], is_branching_node=row[9], is_leaf=row[10],
-        stockfish_eval=row[11], stockfish_depth=row[12], best_move=row[13],
-        is_dubious=row[14], is_busted=row[15], resulting_structure=row[16],
-        game_count=row[17] or 0, white_win_pct=row[18], draw_pct=row[19],
-    )
+    with conn.cursor(row_factory=node_row) as cur:
+        cur.execute(f"SELECT {NODE_SELECT} FROM opening_nodes WHERE node_id = %s", (node_id,))
+        return cur.fetchone()
+
+
+def get_nodes_by_ids(conn: psycopg.Connection, node_ids: list[UUID]) -> list[OpeningNode]:
+    """Fetch many nodes by node_id in one query. Unknown ids are skipped."""
+    if not node_ids:
+        return []
+    with conn.cursor(row_factory=node_row) as cur:
+        cur.execute(f"SELECT {NODE_SELECT} FROM opening_nodes WHERE node_id = ANY(%s)", (list(node_ids),))
+        return cur.fetchall()
 
 
 def get_node_by_fen(conn: psycopg.Connection, fen: str) -> OpeningNode | None:
     """Get a node by FEN."""
-    with conn.cursor() as cur:
+    with conn.cursor(row_factory=node_row) as cur:
+        cur.execute(f"SELECT {NODE_SELECT} FROM opening_nodes WHERE fen = %s", (fen,))
+        return cur.fetchone()
+
+
+def iter_position_keys(conn: psycopg.Connection, *, itersize: int = DEFAULT_ITERSIZE) -> Iterator[int]:
+    """Stream every distinct position_key in ascending order (positions.PositionKeySet.from_sorted)."""
+    rows = stream_query(
+        conn,
+        "SELECT DISTINCT position_key FROM opening_nodes WHERE position_key IS NOT NULL ORDER BY position_key",
+        itersize=itersize,
+    )
+    for (key,) in rows:
+        yield key
+
+
+def get_node_by_position_key(conn: psycopg.Connection, key: int) -> OpeningNode | None:
+    """Get the node for a position key. If several FENs share it, the most played wins."""
+    with conn.cursor(row_factory=node_row) as cur:
         cur.execute(
-            """
-            SELECT node_id, fen, pgn_move, move_number, side, eco_code, opening_name,
-                variation_name, parent_node_id, is_branching_node, is_leaf, stockfish_eval,
-                stockfish_depth, best_move, is_dubious, is_busted, resulting_structure,
-                game_count, white_win_pct, draw_pct
-            FROM opening_nodes WHERE fen = %s
+            f"SELECT {NODE_SELECT} FROM opening_nodes WHERE position_key = %s ORDER BY game_count DESC LIMIT 1",
+            (key,),
+        )
+        return cur.fetchone()
+
+
+def get_nodes_by_position_keys(conn: psycopg.Connection, keys: list[int]) -> dict[int, OpeningNode]:
+    """Get the nodes for many position keys in one query, keyed by position_key."""
+    if not keys:
+        return {}
+    with conn.cursor(row_factory=node_row) as cur:
+        cur.execute(
+            f"""
+            SELECT DISTINCT ON (position_key) {NODE_SELECT}
+            FROM opening_nodes
+            WHERE position_key = ANY(%s)
+            ORDER BY position_key, game_count DESC
             """,
-            (fen,),
+            (list(keys),),
         )
-        row = cur.fetchone()
-        if row:
-            return OpeningNode(
-                node_id=row[0],
-                fen=row[1],
-                pgn_move=row[2],
-                move_number=row[3],
-                side=row[4],
-                eco_code=row[5] or "",
-                opening_name=row[6] or "",
-                variation_name=row[7],
-                parent_node_id=row[8],
-                is_branching_node=row[9],
-                is_leaf=row[10],
-                stockfish_eval=row[11],
-                stockfish_depth=row[12],
-                best_move=row[13],
-                is_dubious=row[14],
-                is_busted=row[15],
-                resulting_structure=row[16],
-                game_count=row[17] or 0,
-                white_win_pct=row[18],
-                draw_pct=row[19],
-            )
-        return None
+        return {node.position_key: node for node in cur.fetchall()}
+
+
+def get_nodes_by_fens(conn: psycopg.Connection, fens: list[str]) -> dict[str, OpeningNode]:
+    """Get the nodes for many FENs in one query, keyed by FEN. Unknown FENs are absent."""
+    if not fens:
+        return {}
+    with conn.cursor(row_factory=node_row) as cur:
+        cur.execute(f"SELECT {NODE_SELECT} FROM opening_nodes WHERE fen = ANY(%s)", (list(fens),))
+        return {node.fen: node for node in cur.fetchall()}
 
 
 def log_node_change(
@@ -234,6 +484,28 @@ def log_node_change(
         )
 
 
+def log_node_changes(conn: psycopg.Connection, changes: list[tuple[UUID, str, object, object]]) -> None:
+    """Record many (node_id, field_name, old_value, new_value) changes in one pipelined batch."""
+    if not changes:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO node_changelog (node_id, field_name, old_value, new_value)
+            VALUES (%s, %s, %s, %s)
+            """,
+            [
+                (
+                    node_id,
+                    field_name,
+                    str(old_value) if old_value is not None else None,
+                    str(new_value) if new_value is not None else None,
+                )
+                for node_id, field_name, old_value, new_value in changes
+            ],
+        )
+
+
 def update_node(
     conn: psycopg.Connection,
     node_id: UUID,
@@ -276,15 +548,155 @@ def update_node(
         )
 
 
-def get_nodes(
+def update_annotations(conn: psycopg.Connection, annotations: list[tuple[UUID, dict]]) -> None:
+    """
+    Write many Stockfish annotations in one pipelined batch. Each dict holds the
+    update_node fields stockfish_eval, stockfish_depth, best_move, is_dubious, is_busted.
+    """
+    if not annotations:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            """
+            UPDATE opening_nodes SET
+                stockfish_eval = %(stockfish_eval)s,
+                stockfish_depth = %(stockfish_depth)s,
+                best_move = COALESCE(%(best_move)s, best_move),
+                is_dubious = %(is_dubious)s,
+                is_busted = %(is_busted)s,
+                updated_at = NOW()
+            WHERE node_id = %(node_id)s
+            """,
+            [{**annotation, "node_id": node_id} for node_id, annotation in annotations],
+        )
+
+
+def set_minimax_evals(conn: psycopg.Connection, rows: list[tuple[UUID, float | None, bool]]) -> None:
+    """Write (node_id, minimax_eval, minimax_disagrees) for many nodes: COPY to a staging table, one UPDATE."""
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS minimax_stage (
+                node_id         UUID,
+                minimax_eval    REAL,
+                minimax_disagrees BOOLEAN
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        cur.execute("TRUNCATE minimax_stage")
+        with cur.copy("COPY minimax_stage (node_id, minimax_eval, minimax_disagrees) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+        cur.execute(
+            """
+            UPDATE opening_nodes n SET
+                minimax_eval = s.minimax_eval,
+                minimax_disagrees = s.minimax_disagrees,
+                updated_at = NOW()
+            FROM minimax_stage s
+            WHERE n.node_id = s.node_id
+            """
+        )
+
+
+def set_structures(conn: psycopg.Connection, rows: list[tuple[UUID, str]]) -> None:
+    """Write (node_id, resulting_structure) for many nodes: COPY to a staging table, one UPDATE."""
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS structure_stage (
+                node_id             UUID,
+                resulting_structure TEXT
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        cur.execute("TRUNCATE structure_stage")
+        with cur.copy("COPY structure_stage (node_id, resulting_structure) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+        cur.execute(
+            """
+            UPDATE opening_nodes n SET
+                resulting_structure = s.resulting_structure,
+                updated_at = NOW()
+            FROM structure_stage s
+            WHERE n.node_id = s.node_id
+            """
+        )
+
+
+def set_node_stats(conn: psycopg.Connection, rows: list[tuple[UUID, int, float | None, float | None]]) -> None:
+    """
+    Write (node_id, game_count, white_win_pct, draw_pct) for many nodes: COPY to
+    a staging table, one UPDATE. A plain SET, so all three stay from one source
+    (the upsert merge keeps GREATEST(game_count)).
+    """
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS node_stats_stage (
+                node_id         UUID,
+                game_count      INTEGER,
+                white_win_pct   REAL,
+                draw_pct        REAL
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        cur.execute("TRUNCATE node_stats_stage")
+        with cur.copy("COPY node_stats_stage (node_id, game_count, white_win_pct, draw_pct) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+        cur.execute(
+            """
+            UPDATE opening_nodes n SET
+                game_count = s.game_count,
+                white_win_pct = s.white_win_pct,
+                draw_pct = s.draw_pct,
+                updated_at = NOW()
+            FROM node_stats_stage s
+            WHERE n.node_id = s.node_id
+            """
+        )
+
+
+def stream_query(
+    conn: psycopg.Connection,
+    sql: str,
+    params=None,
+    *,
+    itersize: int = DEFAULT_ITERSIZE,
+    withhold: bool = False,
+    row_factory=None,
+) -> Iterator:
+    """
+    Yield rows from a named server-side cursor, fetching itersize rows per round trip.
+    Pass withhold=True when the caller commits while still iterating.
+    """
+    with conn.cursor(
+        name=f"stream_{next(_stream_ids)}", withhold=withhold, row_factory=row_factory
+    ) as cur:
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        yield from cur
+
+
+def iter_nodes(
     conn: psycopg.Connection,
     *,
     is_branching: bool | None = None,
     is_leaf: bool | None = None,
     order_by: str = "game_count DESC",
     limit: int | None = None,
-) -> list[OpeningNode]:
-    """Get nodes with optional filters."""
+    itersize: int = DEFAULT_ITERSIZE,
+    withhold: bool = False,
+) -> Iterator[OpeningNode]:
+    """Stream nodes with optional filters from a server-side cursor."""
     conditions = []
     params = []
     if is_branching is not None:
@@ -295,43 +707,25 @@ def get_nodes(
         params.append(is_leaf)
     where = " AND ".join(conditions) if conditions else "TRUE"
     sql = f"""
-        SELECT node_id, fen, pgn_move, move_number, side, eco_code, opening_name,
-            variation_name, parent_node_id, is_branching_node, is_leaf, stockfish_eval,
-            stockfish_depth, best_move, is_dubious, is_busted, resulting_structure,
-            game_count, white_win_pct, draw_pct
+        SELECT {NODE_SELECT}
         FROM opening_nodes WHERE {where}
         ORDER BY {order_by}
     """
     if limit:
         sql += f" LIMIT {limit}"
-    with conn.cursor() as cur:
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        return [
-            OpeningNode(
-                node_id=r[0],
-                fen=r[1],
-                pgn_move=r[2],
-                move_number=r[3],
-                side=r[4],
-                eco_code=r[5] or "",
-                opening_name=r[6] or "",
-                variation_name=r[7],
-                parent_node_id=r[8],
-                is_branching_node=r[9],
-                is_leaf=r[10],
-                stockfish_eval=r[11],
-                stockfish_depth=r[12],
-                best_move=r[13],
-                is_dubious=r[14],
-                is_busted=r[15],
-                resulting_structure=r[16],
-                game_count=r[17] or 0,
-                white_win_pct=r[18],
-                draw_pct=r[19],
-            )
-            for r in rows
-        ]
+    yield from stream_query(conn, sql, params, itersize=itersize, withhold=withhold, row_factory=node_row)
+
+
+def get_nodes(
+    conn: psycopg.Connection,
+    *,
+    is_branching: bool | None = None,
+    is_leaf: bool | None = None,
+    order_by: str = "game_count DESC",
+    limit: int | None = None,
+) -> list[OpeningNode]:
+    """Get nodes with optional filters."""
+    return list(iter_nodes(conn, is_branching=is_branching, is_leaf=is_leaf, order_by=order_by, limit=limit))
 
 
 def get_children(conn: psycopg.Connection, parent_id: UUID) -> list[tuple[UUID, int]]:
@@ -344,6 +738,87 @@ def get_children(conn: psycopg.Connection, parent_id: UUID) -> list[tuple[UUID,
         return [(r[0], r[1]) for r in cur.fetchall()]
 
 
+_SUBTREE_SQL = f"""
+    WITH RECURSIVE walk(parent_id, node_id, sort_order, depth) AS (
+        SELECT NULL::uuid, %(root_id)s::uuid, 0, 0
+        UNION
+        SELECT c.parent_id, c.child_id, c.sort_order, w.depth + 1
+        FROM walk w
+        JOIN node_children c ON c.parent_id = w.node_id
+        JOIN opening_nodes child ON child.node_id = c.child_id
+        WHERE w.depth <= %(max_depth)s AND child.game_count >= %(min_games)s
+    )
+    SELECT DISTINCT w.parent_id, w.sort_order, {node_columns("n")}
+    FROM walk w
+    JOIN opening_nodes n ON n.node_id = w.node_id
+"""
+
+
+def _subtree_from_rows(rows) -> tuple[dict[UUID, OpeningNode], dict[UUID, list[tuple[UUID, int]]]]:
+    nodes: dict[UUID, OpeningNode] = {}
+    children: dict[UUID, list[tuple[UUID, int]]] = {}
+    for row in rows:
+        parent_id, sort_order, node_id = row[0], row[1], row[2]
+        if node_id not in nodes:
+            nodes[node_id] = node_from_row(row, 2)
+        if parent_id is not None:
+            children.setdefault(parent_id, []).append((node_id, sort_order))
+    for pairs in children.values():
+        pairs.sort(key=lambda p: p[1])
+    return nodes, children
+
+
+def get_subtree(
+    conn: psycopg.Connection,
+    root_id: UUID,
+    max_depth: int,
+    min_games: int,
+) -> tuple[dict[UUID, OpeningNode], dict[UUID, list[tuple[UUID, int]]]]:
+    """
+    Fetch the subtree under root_id in one recursive query.
+    Children with game_count below min_games are pruned. Nodes are fetched one level
+    past max_depth so the deepest level still knows its children's moves and counts.
+    Returns (nodes by node_id, children by parent_id as (child_id, sort_order) ordered
+    by sort_order).
+    """
+    with conn.cursor() as cur:
+        cur.execute(_SUBTREE_SQL, {"root_id": root_id, "max_depth": max_depth, "min_games": min_games})
+        return _subtree_from_rows(cur.fetchall())
+
+
+_CHILD_SUMMARY_SQL = """
+    SELECT n.node_id, n.pgn_move, n.game_count
+    FROM node_children c
+    JOIN opening_nodes n ON n.node_id = c.child_id
+    WHERE c.parent_id = %s
+    ORDER BY c.sort_order
+"""
+
+_TRANSPOSITIONS_SQL = """
+    SELECT n.node_id, n.opening_name, n.eco_code
+    FROM opening_nodes n
+    WHERE n.node_id IN (
+        SELECT node_id_b FROM node_transpositions WHERE node_id_a = %(node_id)s
+        UNION
+        SELECT node_id_a FROM node_transpositions WHERE node_id_b = %(node_id)s
+    )
+"""
+
+
+def get_child_summaries(conn: psycopg.Connection, parent_id: UUID) -> list[tuple[UUID, str, int]]:
+    """(node_id, pgn_move, game_count) for each child, in sort order, in one query."""
+    with conn.cursor() as cur:
+        cur.execute(_CHILD_SUMMARY_SQL, (parent_id,))
+        return [(r[0], r[1], r[2] or 0) for r in cur.fetchall()]
+
+
+def get_transpositions(conn: psycopg.Connection, node_id: UUID) -> list[tuple[UUID, str, str]]:
+    """(node_id, opening_name, eco_code) for every node linked to node_id as a transposition."""
+    with conn.cursor() as cur:
+        cur.execute(_TRANSPOSITIONS_SQL, {"node_id": node_id})
+        return [(r[0], r[1], r[2]) for r in cur.fetchall()]
+
+
 def upsert_transposition(conn: psycopg.Connection, node_id_a: UUID, node_id_b: UUID) -> None:
     """Add a transposition link (ensures a < b)."""
     a, b = (node_id_a, node_id_b) if node_id_a < node_id_b else (node_id_b, node_id_a)
@@ -356,6 +831,18 @@ def upsert_transposition(conn: psycopg.Connection, node_id_a: UUID, node_id_b: U
         )
 
 
+def upsert_transpositions(conn: psycopg.Connection, pairs: list[tuple[UUID, UUID]]) -> None:
+    """Add many transposition links in one pipelined batch (each ordered a < b, self-links dropped)."""
+    rows = {(a, b) if a < b else (b, a) for a, b in pairs if a != b}
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            "INSERT INTO node_transpositions (node_id_a, node_id_b) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            sorted(rows),
+        )
+
+
 def upsert_entry(conn: psycopg.Connection, entry: OpeningEntry) -> OpeningEntry:
     """Insert or update an opening entry."""
     resolution_ids = entry.resolution_node_ids or []
@@ -390,76 +877,92 @@ def upsert_entry(conn: psycopg.Connection, entry: OpeningEntry) -> OpeningEntry:
     return entry
 
 
-def get_seed_nodes(conn: psycopg.Connection, limit: int | None = None) -> list[OpeningNode]:
-    """Get root nodes with ECO codes (from Phase 1)."""
-    sql = """
-        SELECT node_id, fen, pgn_move, move_number, side, eco_code, opening_name,
-            variation_name, parent_node_id, is_branching_node, is_leaf, stockfish_eval,
-            stockfish_depth, best_move, is_dubious, is_busted, resulting_structure,
-            game_count, white_win_pct, draw_pct
+def upsert_entries(conn: psycopg.Connection, entries: list[OpeningEntry]) -> None:
+    """Insert or update many opening entries in one pipelined batch (opening_id is not returned)."""
+    if not entries:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO opening_entries (eco_code, name, aliases, category, root_node_id, primary_color, tags, resolution_node_ids, related_opening_ids)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (eco_code, name) DO UPDATE SET
+                root_node_id = EXCLUDED.root_node_id,
+                resolution_node_ids = COALESCE(EXCLUDED.resolution_node_ids, opening_entries.resolution_node_ids),
+                related_opening_ids = COALESCE(EXCLUDED.related_opening_ids, opening_entries.related_opening_ids),
+                updated_at = NOW()
+            """,
+            [
+                (
+                    e.eco_code,
+                    e.name,
+                    e.aliases,
+                    e.category,
+                    e.root_node_id,
+                    e.primary_color,
+                    e.tags,
+                    e.resolution_node_ids or [],
+                    e.related_opening_ids or [],
+                )
+                for e in entries
+            ],
+        )
+
+
+def iter_seed_nodes(
+    conn: psycopg.Connection,
+    limit: int | None = None,
+    *,
+    itersize: int = DEFAULT_ITERSIZE,
+    withhold: bool = False,
+) -> Iterator[OpeningNode]:
+    """Stream root nodes with ECO codes (from Phase 1)."""
+    sql = f"""
+        SELECT {NODE_SELECT}
         FROM opening_nodes
         WHERE parent_node_id IS NULL AND eco_code IS NOT NULL AND eco_code != ''
     """
     if limit:
         sql += f" LIMIT {limit}"
-    with conn.cursor() as cur:
-        cur.execute(sql)
-        rows = cur.fetchall()
-        return [
-            OpeningNode(
-                node_id=r[0],
-                fen=r[1],
-                pgn_move=r[2],
-                move_number=r[3],
-                side=r[4],
-                eco_code=r[5] or "",
-                opening_name=r[6] or "",
-                variation_name=r[7],
-                parent_node_id=r[8],
-                is_branching_node=r[9],
-                is_leaf=r[10],
-                stockfish_eval=r[11],
-                stockfish_depth=r[12],
-                best_move=r[13],
-                is_dubious=r[14],
-                is_busted=r[15],
-                resulting_structure=r[16],
-                game_count=r[17] or 0,
-                white_win_pct=r[18],
-                draw_pct=r[19],
-            )
-            for r in rows
-        ]
+    yield from stream_query(conn, sql, None, itersize=itersize, withhold=withhold, row_factory=node_row)
 
 
-def get_leaf_nodes(conn: psycopg.Connection, limit: int | None = None) -> list[OpeningNode]:
-    """Get leaf nodes (no children) that lack Stockfish eval."""
-    sql = """
-        SELECT n.node_id, n.fen, n.pgn_move, n.move_number, n.side, n.eco_code, n.opening_name,
-            n.variation_name, n.parent_node_id, n.is_branching_node, n.is_leaf, n.stockfish_eval,
-            n.stockfish_depth, n.best_move, n.is_dubious, n.is_busted, n.resulting_structure,
-            n.game_count, n.white_win_pct, n.draw_pct
+def get_seed_nodes(conn: psycopg.Connection, limit: int | None = None) -> list[OpeningNode]:
+    """Get root nodes with ECO codes (from Phase 1)."""
+    return list(iter_seed_nodes(conn, limit))
+
+
+def iter_leaf_nodes(
+    conn: psycopg.Connection,
+    limit: int | None = None,
+    *,
+    below_depth: int | None = None,
+    itersize: int = DEFAULT_ITERSIZE,
+    withhold: bool = False,
+) -> Iterator[OpeningNode]:
+    """
+    Stream leaf nodes (no children) that lack Stockfish eval, or with below_depth,
+    those whose eval is shallower than that depth (unevaluated leaves included).
+    """
+    if below_depth is None:
+        condition, params = "n.stockfish_eval IS NULL", None
+    else:
+        condition, params = "COALESCE(n.stockfish_depth, 0) < %s", (below_depth,)
+    sql = f"""
+        SELECT {node_columns("n")}
         FROM opening_nodes n
         WHERE NOT EXISTS (SELECT 1 FROM node_children WHERE parent_id = n.node_id)
-        AND n.stockfish_eval IS NULL
+        AND {condition}
         ORDER BY n.game_count DESC
     """
     if limit:
         sql += f" LIMIT {limit}"
-    with conn.cursor() as cur:
-        cur.execute(sql)
-        rows = cur.fetchall()
-        return [
-            OpeningNode(
-                node_id=r[0], fen=r[1], pgn_move=r[2], move_number=r[3], side=r[4],
-                eco_code=r[5] or "", opening_name=r[6] or "", variation_name=r[7],
-                parent_node_id=r[8], is_branching_node=r[9], is_leaf=r[10],
-                stockfish_eval=r[11], stockfish_depth=r[12], best_move=r[13],
-                is_dubious=r[14], is_busted=r[15], resulting_structure=r[16],
-                game_count=r[17] or 0, white_win_pct=r[18], draw_pct=r[19],
-            )
-            for r in rows
-        ]
+    yield from stream_query(conn, sql, params, itersize=itersize, withhold=withhold, row_factory=node_row)
+
+
+def get_leaf_nodes(conn: psycopg.Connection, limit: int | None = None) -> list[OpeningNode]:
+    """Get leaf nodes (no children) that lack Stockfish eval."""
+    return list(iter_leaf_nodes(conn, limit))
 
 
 def get_eco_count(conn: psycopg.Connection) -> int:
@@ -467,3 +970,219 @@ def get_eco_count(conn: psycopg.Connection) -> int:
     with conn.cursor() as cur:
         cur.execute("SELECT COUNT(DISTINCT eco_code) FROM opening_nodes WHERE eco_code IS NOT NULL AND eco_code != ''")
         return cur.fetchone()[0] or 0
+
+
+def get_max_ply(conn: psycopg.Connection) -> int | None:
+    """Deepest node in half-moves from the start position (side is who just moved), or None if empty."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT MAX(CASE WHEN side = 'W' THEN 2 * move_number - 1 ELSE 2 * move_number - 2 END) FROM opening_nodes"
+        )
+        return cur.fetchone()[0]
+
+
+def enqueue_annotation_jobs(conn: psycopg.Connection, jobs: list[tuple[UUID, int, int]]) -> int:
+    """
+    Queue (node_id, priority, target_depth) jobs in one statement.
+    Jobs already queued at that depth are left alone, so reruns add no duplicates.
+    Returns the number of jobs added.
+    """
+    if not jobs:
+        return 0
+    node_ids, priorities, depths = zip(*jobs)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO annotation_jobs (node_id, priority, target_depth)
+            SELECT * FROM unnest(%s::uuid[], %s::integer[], %s::integer[])
+            ON CONFLICT (node_id, target_depth) DO NOTHING
+            """,
+            (list(node_ids), list(priorities), list(depths)),
+        )
+        return cur.rowcount
+
+
+def claim_annotation_jobs(
+    conn: psycopg.Connection,
+    worker: str,
+    batch_size: int,
+    lease_seconds: int,
+    max_attempts: int = 3,
+) -> list[tuple[OpeningNode, int]]:
+    """
+    Lease up to batch_size of the highest-priority jobs to worker and return
+    (node, target_depth) pairs. Pending jobs and running jobs whose lease has
+    expired are both claimable; SKIP LOCKED lets concurrent workers claim
+    disjoint batches without waiting on each other. Expired leases with no
+    attempts left (the worker died on the last try) are marked failed in the
+    same statement. Commit to publish the lease.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            WITH expired AS (
+                UPDATE annotation_jobs SET
+                    status = 'failed',
+                    leased_until = NULL,
+                    last_error = 'lease expired on attempt ' || attempts || ' (worker ' || COALESCE(worker, '?') || ')',
+                    updated_at = NOW()
+                WHERE (node_id, target_depth) IN (
+                    SELECT node_id, target_depth FROM annotation_jobs
+                    WHERE status = 'running' AND leased_until < NOW() AND attempts >= %(max_attempts)s
+                    FOR UPDATE SKIP LOCKED
+                )
+            )
+            UPDATE annotation_jobs j SET
+                status = 'running',
+                leased_until = NOW() + make_interval(secs => %(lease_seconds)s),
+                attempts = j.attempts + 1,
+                worker = %(worker)s,
+                updated_at = NOW()
+            FROM opening_nodes n
+            WHERE n.node_id = j.node_id
+              AND (j.node_id, j.target_depth) IN (
+                SELECT node_id, target_depth FROM annotation_jobs
+                WHERE (status = 'pending' OR (status = 'running' AND leased_until < NOW()))
+                  AND attempts < %(max_attempts)s
+                ORDER BY priority DESC
+                LIMIT %(batch_size)s
+                FOR UPDATE SKIP LOCKED
+              )
+            RETURNING j.target_depth, {node_columns("n")}
+            """,
+            {"worker": worker, "batch_size": batch_size, "lease_seconds": lease_seconds, "max_attempts": max_attempts},
+        )
+        return [(node_from_row(row, 1), row[0]) for row in cur.fetchall()]
+
+
+# A job is only settled by the worker still holding its lease: once the lease
+# expires another worker may have claimed it, and that worker's result wins.
+_HELD_BY_WORKER = "worker = %s AND status = 'running' AND leased_until > NOW()"
+
+
+def complete_annotation_jobs(conn: psycopg.Connection, worker: str, jobs: list[tuple[UUID, int]]) -> int:
+    """Mark (node_id, target_depth) jobs leased to worker done. Returns how many were still held."""
+    if not jobs:
+        return 0
+    with conn.cursor() as cur:
+        cur.executemany(
+            f"""
+            UPDATE annotation_jobs SET status = 'done', leased_until = NULL, last_error = NULL, updated_at = NOW()
+            WHERE node_id = %s AND target_depth = %s AND {_HELD_BY_WORKER}
+            """,
+            [(node_id, target_depth, worker) for node_id, target_depth in jobs],
+        )
+        return cur.rowcount
+
+
+def fail_annotation_job(
+    conn: psycopg.Connection,
+    worker: str,
+    node_id: UUID,
+    target_depth: int,
+    error: str,
+    max_attempts: int = 3,
+) -> bool:
+    """
+    Release a job leased to worker for retry, or mark it failed once it has used
+    max_attempts. Returns False if worker no longer held the lease.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            UPDATE annotation_jobs SET
+                status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                leased_until = NULL,
+                last_error = %s,
+                updated_at = NOW()
+            WHERE node_id = %s AND target_depth = %s AND {_HELD_BY_WORKER}
+            """,
+            (max_attempts, error, node_id, target_depth, worker),
+        )
+        return cur.rowcount == 1
+
+
+def release_annotation_job(conn: psycopg.Connection, worker: str, node_id: UUID, target_depth: int, error: str) -> bool:
+    """
+    Hand a job leased to worker back to the queue without spending an attempt,
+    for failures that were not the job's fault. Returns False if the lease was lost.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            UPDATE annotation_jobs SET
+                status = 'pending',
+                attempts = GREATEST(attempts - 1, 0),
+                leased_until = NULL,
+                last_error = %s,
+                updated_at = NOW()
+            WHERE node_id = %s AND target_depth = %s AND {_HELD_BY_WORKER}
+            """,
+            (error, node_id, target_depth, worker),
+        )
+        return cur.rowcount == 1
+
+
+def annotation_job_counts(conn: psycopg.Connection) -> dict[str, int]:
+    """Number of annotation jobs per status."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT status, COUNT(*) FROM annotation_jobs GROUP BY status")
+        return {status: count for status, count in cur.fetchall()}
+
+
+def _eval_from_row(row) -> PositionEval:
+    return PositionEval(position_key=row[0], depth=row[1], score_cp=row[2], pv=list(row[3] or []), multipv=row[4] or [])
+
+
+def get_cached_evals(
+    conn: psycopg.Connection,
+    keys: list[int],
+    min_depth: int = 0,
+    min_multipv: int = 1,
+) -> dict[int, PositionEval]:
+    """
+    Cached engine results for many position keys, keyed by position_key.
+    Only entries searched to at least min_depth (and with min_multipv lines, if > 1) are returned.
+    """
+    if not keys:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT position_key, depth, score_cp, pv, multipv FROM position_evals
+            WHERE position_key = ANY(%s) AND depth >= %s
+              AND (%s <= 1 OR jsonb_array_length(multipv) >= %s)
+            """,
+            (list(keys), min_depth, min_multipv, min_multipv),
+        )
+        return {row[0]: _eval_from_row(row) for row in cur.fetchall()}
+
+
+def get_cached_eval(
+    conn: psycopg.Connection, key: int, min_depth: int = 0, min_multipv: int = 1
+) -> PositionEval | None:
+    """Cached engine result for one position, if one at least min_depth deep exists."""
+    return get_cached_evals(conn, [key], min_depth, min_multipv).get(key)
+
+
+def store_evals(conn: psycopg.Connection, evals: list[PositionEval]) -> None:
+    """Cache engine results. An existing entry is only replaced by a deeper (or wider, at equal depth) one."""
+    if not evals:
+        return
+    with conn.cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO position_evals (position_key, depth, score_cp, pv, multipv)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (position_key) DO UPDATE SET
+                depth = EXCLUDED.depth,
+                score_cp = EXCLUDED.score_cp,
+                pv = EXCLUDED.pv,
+                multipv = EXCLUDED.multipv,
+                updated_at = NOW()
+            WHERE EXCLUDED.depth > position_evals.depth
+               OR (EXCLUDED.depth = position_evals.depth
+                   AND jsonb_array_length(EXCLUDED.multipv) > jsonb_array_length(position_evals.multipv))
+            """,
+            [(ev.position_key, ev.depth, ev.score_cp, ev.pv, Jsonb(ev.multipv)) for ev in evals],
+        )
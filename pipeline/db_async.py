@@ -0,0 +1,145 @@
+"""Async read API for the query service, on psycopg.AsyncConnection.
+
+Mirrors the read functions in db.py and shares their SQL and row mapping.
+Connections come from the async pool in db.py.
+"""
+
+from uuid import UUID
+
+import psycopg
+
+from db import (
+    NODE_SELECT,
+    _CHILD_SUMMARY_SQL,
+    _SUBTREE_SQL,
+    _TRANSPOSITIONS_SQL,
+    _subtree_from_rows,
+    close_async_pool,
+    get_async_connection,
+    get_async_pool,
+    node_row,
+)
+from models import OpeningNode
+from structure_sql import STRUCTURE_LABELS
+
+# Same name as db.get_connection so callers read the same in both modes.
+get_connection = get_async_connection
+
+
+async def get_node_by_id(conn: psycopg.AsyncConnection, node_id: UUID) -> OpeningNode | None:
+    """Fetch a single node by node_id UUID."""
+    async with conn.cursor(row_factory=node_row) as cur:
+        await cur.execute(f"SELECT {NODE_SELECT} FROM opening_nodes WHERE node_id = %s", (node_id,))
+        return await cur.fetchone()
+
+
+async def get_node_by_fen(conn: psycopg.AsyncConnection, fen: str) -> OpeningNode | None:
+    """Get a node by FEN."""
+    async with conn.cursor(row_factory=node_row) as cur:
+        await cur.execute(f"SELECT {NODE_SELECT} FROM opening_nodes WHERE fen = %s", (fen,))
+        return await cur.fetchone()
+
+
+async def get_node_by_position_key(conn: psycopg.AsyncConnection, key: int) -> OpeningNode | None:
+    """Get the node for a position key. If several FENs share it, the most played wins."""
+    async with conn.cursor(row_factory=node_row) as cur:
+        await cur.execute(
+            f"SELECT {NODE_SELECT} FROM opening_nodes WHERE position_key = %s ORDER BY game_count DESC LIMIT 1",
+            (key,),
+        )
+        return await cur.fetchone()
+
+
+async def get_children(conn: psycopg.AsyncConnection, parent_id: UUID) -> list[tuple[UUID, int]]:
+    """Get child node IDs and sort order for a parent."""
+    async with conn.cursor() as cur:
+        await cur.execute(
+            "SELECT child_id, sort_order FROM node_children WHERE parent_id = %s ORDER BY sort_order",
+            (parent_id,),
+        )
+        return [(r[0], r[1]) for r in await cur.fetchall()]
+
+
+async def get_child_summaries(conn: psycopg.AsyncConnection, parent_id: UUID) -> list[tuple[UUID, str, int]]:
+    """(node_id, pgn_move, game_count) for each child, in sort order, in one query."""
+    async with conn.cursor() as cur:
+        await cur.execute(_CHILD_SUMMARY_SQL, (parent_id,))
+        return [(r[0], r[1], r[2] or 0) for r in await cur.fetchall()]
+
+
+async def get_transpositions(conn: psycopg.AsyncConnection, node_id: UUID) -> list[tuple[UUID, str, str]]:
+    """(node_id, opening_name, eco_code) for every node linked to node_id as a transposition."""
+    async with conn.cursor() as cur:
+        await cur.execute(_TRANSPOSITIONS_SQL, {"node_id": node_id})
+        return [(r[0], r[1], r[2]) for r in await cur.fetchall()]
+
+
+async def get_seed_nodes(conn: psycopg.AsyncConnection, limit: int | None = None) -> list[OpeningNode]:
+    """Get root nodes with ECO codes (from Phase 1)."""
+    sql = f"""
+        SELECT {NODE_SELECT}
+        FROM opening_nodes
+        WHERE parent_node_id IS NULL AND eco_code IS NOT NULL AND eco_code != ''
+    """
+    if limit:
+        sql += f" LIMIT {limit}"
+    async with conn.cursor(row_factory=node_row) as cur:
+        await cur.execute(sql)
+        return await cur.fetchall()
+
+
+async def get_subtree(
+    conn: psycopg.AsyncConnection,
+    root_id: UUID,
+    max_depth: int,
+    min_games: int,
+) -> tuple[dict[UUID, OpeningNode], dict[UUID, list[tuple[UUID, int]]]]:
+    """Async db.get_subtree: the pruned subtree under root_id in one recursive query."""
+    async with conn.cursor() as cur:
+        await cur.execute(_SUBTREE_SQL, {"root_id": root_id, "max_depth": max_depth, "min_games": min_games})
+        return _subtree_from_rows(await cur.fetchall())
+
+
+async def get_structure_openings(conn: psycopg.AsyncConnection, structure_name: str) -> list[tuple[str, str]]:
+    """
+    Distinct (eco_code, opening_name) whose pawns match the name. Known structure
+    labels are looked up on the indexed pawn_structure column (computed from the
+    bitboards, so untagged nodes count); any other name falls back to the stored
+    resulting_structure.
+    """
+    labels = [label for label in STRUCTURE_LABELS if structure_name.lower() in label.lower()]
+    async with conn.cursor() as cur:
+        if labels:
+            await cur.execute(
+                """
+                SELECT DISTINCT eco_code, opening_name FROM opening_nodes
+                WHERE pawn_structure = ANY(%s)
+                """,
+                (labels,),
+            )
+        else:
+            await cur.execute(
+                """
+                SELECT DISTINCT eco_code, opening_name FROM opening_nodes
+                WHERE resulting_structure ILIKE %s
+                """,
+                (f"%{structure_name}%",),
+            )
+        return [(r[0], r[1]) for r in await cur.fetchall()]
+
+
+async def search_pawn_structures(
+    conn: psycopg.AsyncConnection, predicate: str, limit: int = 50
+) -> list[OpeningNode]:
+    """Most-played nodes matching a structure_sql predicate over white_pawns/black_pawns."""
+    async with conn.cursor(row_factory=node_row) as cur:
+        await cur.execute(
+            f"""
+            SELECT {NODE_SELECT} FROM opening_nodes
+            WHERE white_pawns IS NOT NULL AND ({predicate})
+            ORDER BY game_count DESC
+            LIMIT %s
+            """,
+            (limit,),
+        )
+        return await cur.fetchall()
@@ -20,7 +20,7 @@ import chess
 
 # Add parent for imports
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from db import get_connection, upsert_entry, upsert_node
+from db import get_connection, upsert_entries, upsert_nodes
 from models import OpeningEntry, OpeningNode
 
 
@@ -53,10 +53,10 @@ def parse_eco_row(eco: str, name: str, pgn: str) -> tuple[str, str, list[str]]:
 def ingest_eco(conn, source: str | Path) -> tuple[int, int]:
     """
     Ingest ECO taxonomy. Returns (nodes_created, entries_created).
+    Nodes and entries are written in bulk once all TSV rows are parsed.
     """
     source = Path(source) if isinstance(source, str) else source
-    nodes_created = 0
-    entries_created = 0
+    nodes: list[OpeningNode] = []
 
     # Collect TSV files (a.tsv through e.tsv)
     if source.is_dir():
@@ -122,19 +122,20 @@ def ingest_eco(conn, source: str | Path) -> tuple[int, int]:
                     is_branching_node=False,
                     game_count=0,
                 )
-                node = upsert_node(conn, node)
-                nodes_created += 1
-
-                entry = OpeningEntry(
-                    eco_code=eco_code,
-                    name=opening_name,
-                    root_node_id=node.node_id,
-                    primary_color="W",
-                )
-                upsert_entry(conn, entry)
-                entries_created += 1
-
-    return nodes_created, entries_created
+                nodes.append(node)
+
+    node_ids = upsert_nodes(conn, nodes)
+    entries = [
+        OpeningEntry(
+            eco_code=node.eco_code,
+            name=node.opening_name,
+            root_node_id=node_ids[node.fen],
+            primary_color="W",
+        )
+        for node in nodes
+    ]
+    upsert_entries(conn, entries)
+    return len(nodes), len(entries)
 
 
 def main():
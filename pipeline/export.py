@@ -16,10 +16,12 @@ import sys
 from pathlib import Path
 
 import chess
+import chess.pgn
 import chess.polyglot
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from db import get_connection, get_node_by_fen, get_children, get_seed_nodes
+from db import NODE_COLUMNS, NODE_SELECT, get_connection, get_children, get_seed_nodes, get_subtree, stream_query
+from positions import to_unsigned64
 
 
 def node_to_openingiq(node, children_data: list) -> dict:
@@ -54,44 +56,24 @@ def node_to_openingiq(node, children_data: list) -> dict:
     return out
 
 
-def build_tree(conn, node_id, max_depth: int, current_depth: int, min_games: int) -> dict | None:
-    """Recursively build OpeningIQ tree from node."""
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT node_id, fen, pgn_move, move_number, side, eco_code, opening_name,
-                variation_name, parent_node_id, is_branching_node, is_leaf, stockfish_eval,
-                stockfish_depth, best_move, is_dubious, is_busted, resulting_structure,
-                game_count, white_win_pct, draw_pct
-            FROM opening_nodes WHERE node_id = %s
-            """,
-            (node_id,),
-        )
-        r = cur.fetchone()
-    if not r:
+def assemble_tree(
+    nodes: dict,
+    children: dict,
+    node_id,
+    max_depth: int,
+    current_depth: int,
+    min_games: int,
+) -> dict | None:
+    """Build the OpeningIQ tree for node_id from a subtree already fetched by get_subtree."""
+    node = nodes.get(node_id)
+    if node is None:
         return None
 
-    from models import OpeningNode
-    node = OpeningNode(
-        node_id=r[0], fen=r[1], pgn_move=r[2], move_number=r[3], side=r[4],
-        eco_code=r[5] or "", opening_name=r[6] or "", variation_name=r[7],
-        parent_node_id=r[8], is_branching_node=r[9], is_leaf=r[10],
-        stockfish_eval=r[11], stockfish_depth=r[12], best_move=r[13],
-        is_dubious=r[14], is_busted=r[15], resulting_structure=r[16],
-        game_count=r[17] or 0, white_win_pct=r[18], draw_pct=r[19],
-    )
-
-    child_pairs = get_children(conn, node_id)
     children_data = []
-    for child_id, _ in child_pairs:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT pgn_move, game_count FROM opening_nodes WHERE node_id = %s",
-                (child_id,),
-            )
-            row = cur.fetchone()
-        if row:
-            children_data.append({"san": row[0], "game_count": row[1] or 0, "child_id": child_id})
+    for child_id, _ in children.get(node_id, []):
+        child = nodes.get(child_id)
+        if child:
+            children_data.append({"san": child.pgn_move, "game_count": child.game_count or 0, "child_id": child_id})
 
     # Filter by min_games
     children_data = [c for c in children_data if c.get("game_count", 0) >= min_games]
@@ -102,13 +84,19 @@ def build_tree(conn, node_id, max_depth: int, current_depth: int, min_games: int
     if current_depth < max_depth and children_data:
         out["children"] = []
         for c in children_data:
-            child_node = build_tree(conn, c["child_id"], max_depth, current_depth + 1, min_games)
+            child_node = assemble_tree(nodes, children, c["child_id"], max_depth, current_depth + 1, min_games)
             if child_node:
                 out["children"].append(child_node)
 
     return out
 
 
+def build_tree(conn, node_id, max_depth: int, current_depth: int, min_games: int) -> dict | None:
+    """Build OpeningIQ tree from node. The whole subtree is fetched in one query."""
+    nodes, children = get_subtree(conn, node_id, max_depth - current_depth, min_games)
+    return assemble_tree(nodes, children, node_id, max_depth, current_depth, min_games)
+
+
 def export_json(conn, output_dir: Path, eco_filter: str | None, max_depth: int, min_games: int) -> int:
     """Export per-opening JSON files in OpeningIQ schema."""
     seeds = get_seed_nodes(conn)
@@ -147,27 +135,16 @@ def export_json(conn, output_dir: Path, eco_filter: str | None, max_depth: int,
 
 
 def export_csv(conn, output_path: Path) -> int:
-    """Export all nodes to CSV."""
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT node_id, fen, pgn_move, move_number, side, eco_code, opening_name,
-                variation_name, parent_node_id, is_branching_node, is_leaf, stockfish_eval,
-                stockfish_depth, best_move, is_dubious, is_busted, resulting_structure,
-                game_count, white_win_pct, draw_pct
-            FROM opening_nodes
-            """
-        )
-        rows = cur.fetchall()
-    fields = ["node_id", "fen", "pgn_move", "move_number", "side", "eco_code", "opening_name",
-              "variation_name", "parent_node_id", "is_branching_node", "is_leaf", "stockfish_eval",
-              "stockfish_depth", "best_move", "is_dubious", "is_busted", "resulting_structure",
-              "game_count", "white_win_pct", "draw_pct"]
+    """Export all nodes to CSV, streaming rows from a server-side cursor."""
+    rows = stream_query(conn, f"SELECT {NODE_SELECT} FROM opening_nodes")
+    count = 0
     with open(output_path, "w", encoding="utf-8", newline="") as f:
         w = csv.writer(f)
-        w.writerow(fields)
-        w.writerows(rows)
-    return len(rows)
+        w.writerow(NODE_COLUMNS)
+        for row in rows:
+            w.writerow(row)
+            count += 1
+    return count
 
 
 def _add_pgn_node(
@@ -268,7 +245,7 @@ def _collect_polyglot_entries(
     min_games: int,
     entries: list,
 ) -> None:
-    """Recursively collect (fen, san, weight) tuples for Polyglot export."""
+    """Recursively collect (fen, position_key, san, weight) tuples for Polyglot export."""
     if current_depth >= max_depth:
         return
 
@@ -288,11 +265,11 @@ def _collect_polyglot_entries(
         return
 
     with conn.cursor() as cur:
-        cur.execute("SELECT fen FROM opening_nodes WHERE node_id = %s", (node_id,))
+        cur.execute("SELECT fen, position_key FROM opening_nodes WHERE node_id = %s", (node_id,))
         parent_row = cur.fetchone()
     if not parent_row:
         return
-    parent_fen = parent_row[0]
+    parent_fen, parent_key = parent_row
 
     total_games = sum(r[3] or 0 for r in child_rows)
     if total_games == 0:
@@ -302,7 +279,7 @@ def _collect_polyglot_entries(
         child_id, child_fen, san, game_count = row[0], row[1], row[2], row[3]
         weight = int(((game_count or 0) / total_games) * 65535)
         weight = max(1, min(65535, weight))
-        entries.append((parent_fen, san, weight))
+        entries.append((parent_fen, parent_key, san, weight))
         _collect_polyglot_entries(conn, child_id, current_depth + 1, max_depth, min_games, entries)
 
 
@@ -337,11 +314,14 @@ def export_polyglot(
         path = output_dir / f"{safe_eco}_{safe_name}.bin"
 
         poly_entries = []
-        for fen, san, weight in entries:
+        for fen, stored_key, san, weight in entries:
             try:
                 board = chess.Board(fen)
                 move = board.parse_san(san)
-                key = chess.polyglot.zobrist_hash(board)
+                if stored_key is not None:
+                    key = to_unsigned64(stored_key)
+                else:
+                    key = chess.polyglot.zobrist_hash(board)
                 poly_entries.append((key, move, weight))
             except (chess.InvalidMoveError, chess.AmbiguousMoveError, ValueError):
                 continue
@@ -22,15 +22,16 @@ import httpx
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 from db import (
-    add_child,
+    add_children,
     get_connection,
-    get_node_by_fen,
+    get_nodes_by_position_keys,
     get_seed_nodes,
-    set_branching,
-    upsert_node,
+    set_branching_nodes,
+    upsert_nodes,
     upsert_transposition,
 )
 from models import OpeningNode
+from positions import position_key
 
 LICHESS_API = "https://explorer.lichess.ovh/masters"
 MIN_GAME_COUNT = 50
@@ -64,59 +65,59 @@ async def expand_tree(
     semaphore: asyncio.Semaphore,
     max_seeds: int | None = None,
 ) -> int:
-    """Expand tree from seed nodes. Returns nodes added."""
+    """
+    Expand tree from seed nodes, one depth level at a time. Returns nodes added.
+    Each level's nodes, edges and branching flags are written in bulk.
+    """
     seed_nodes = get_seed_nodes(conn, limit=max_seeds)
     if not seed_nodes:
         print("No seed nodes found. Run eco_ingest.py first.", file=sys.stderr)
         return 0
 
     nodes_added = 0
-    queue = deque((n, 0) for n in seed_nodes)
-
-    while queue:
-        node, depth = queue.popleft()
-        if depth >= max_depth:
-            continue
-
-        async with semaphore:
-            try:
-                data = await lichess_master_moves(node.fen, session, token)
-            except Exception as e:
-                print(f"API error for {node.fen[:50]}...: {e}", file=sys.stderr)
-                if "429" in str(e):
-                    await asyncio.sleep(2)
-                    queue.append((node, depth))
-                continue
-
-        moves = data.get("moves", [])
-        if len(moves) >= 2:
-            set_branching(conn, node.node_id, True)
-
-        for i, move_data in enumerate(moves):
-            white = move_data.get("white", 0)
-            draws = move_data.get("draws", 0)
-            black = move_data.get("black", 0)
-            total = white + draws + black
-            if total < min_games:
-                continue
-
-            san = move_data.get("san", "")
-            if not san:
-                continue
-
-            try:
-                board = chess.Board(node.fen)
-                board.push_san(san)
-                child_fen = board.fen()
-            except (chess.InvalidMoveError, chess.AmbiguousMoveError):
-                continue
-
-            existing = get_node_by_fen(conn, child_fen)
-            if existing:
-                child_node = existing
-                if node.node_id != existing.parent_node_id:
-                    upsert_transposition(conn, node.node_id, existing.node_id)
-            else:
+    level = list(seed_nodes)
+    depth = 0
+
+    while level and depth < max_depth:
+        # (parent, sort_order, child) for every move that passes the game threshold
+        candidates: list[tuple[OpeningNode, int, OpeningNode]] = []
+        branching_ids = []
+        queue = deque(level)
+        while queue:
+            node = queue.popleft()
+            async with semaphore:
+                try:
+                    data = await lichess_master_moves(node.fen, session, token)
+                except Exception as e:
+                    print(f"API error for {node.fen[:50]}...: {e}", file=sys.stderr)
+                    if "429" in str(e):
+                        await asyncio.sleep(2)
+                        queue.append(node)
+                    continue
+
+            moves = data.get("moves", [])
+            if len(moves) >= 2:
+                branching_ids.append(node.node_id)
+
+            for i, move_data in enumerate(moves):
+                white = move_data.get("white", 0)
+                draws = move_data.get("draws", 0)
+                black = move_data.get("black", 0)
+                total = white + draws + black
+                if total < min_games:
+                    continue
+
+                san = move_data.get("san", "")
+                if not san:
+                    continue
+
+                try:
+                    board = chess.Board(node.fen)
+                    board.push_san(san)
+                    child_fen = board.fen()
+                except (chess.InvalidMoveError, chess.AmbiguousMoveError):
+                    continue
+
                 white_win_pct = (white / total * 100) if total else None
                 draw_pct = (draws / total * 100) if total else None
                 child_node = OpeningNode(
@@ -130,15 +131,38 @@ async def expand_tree(
                     draw_pct=draw_pct,
                     eco_code=node.eco_code or "",
                     opening_name=node.opening_name or "",
+                    position_key=position_key(board),
                 )
-                child_node = upsert_node(conn, child_node)
-                nodes_added += 1
-
-            add_child(conn, node.node_id, child_node.node_id, sort_order=i)
-            queue.append((child_node, depth + 1))
-
+                candidates.append((node, i, child_node))
+
+        set_branching_nodes(conn, branching_ids)
+
+        # Keyed by position_key, so a child reached by another move order (or with
+        # different move counters) links to the stored node instead of a new row.
+        existing = get_nodes_by_position_keys(conn, list({c.position_key for _, _, c in candidates}))
+        new_nodes: dict[int, OpeningNode] = {}
+        for _, _, child in candidates:
+            if child.position_key not in existing and child.position_key not in new_nodes:
+                new_nodes[child.position_key] = child
+        new_ids = upsert_nodes(conn, list(new_nodes.values()))
+        for child in new_nodes.values():
+            child.node_id = new_ids.get(child.fen, child.node_id)
+        nodes_added += len(new_nodes)
+
+        edges = []
+        next_level: dict = {}
+        for parent, sort_order, candidate in candidates:
+            child = existing.get(candidate.position_key) or new_nodes[candidate.position_key]
+            if parent.node_id != child.parent_node_id:
+                upsert_transposition(conn, parent.node_id, child.node_id)
+            edges.append((parent.node_id, child.node_id, sort_order))
+            next_level.setdefault(child.node_id, child)
+        add_children(conn, edges)
         conn.commit()
 
+        level = list(next_level.values())
+        depth += 1
+
     return nodes_added
 
 
@@ -0,0 +1,8 @@
+-- Migration: Add position_key (64-bit Polyglot Zobrist hash) to opening_nodes
+-- Run with: psql $DATABASE_URL -f 003_add_position_key.sql
+-- Then fill existing rows: python scripts/backfill_position_keys.py
+
+ALTER TABLE opening_nodes
+    ADD COLUMN IF NOT EXISTS position_key BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_opening_nodes_position_key ON opening_nodes(position_key);
@@ -0,0 +1,19 @@
+-- Migration: Add annotation_jobs work queue for stockfish_annotator.py --queue
+-- Run with: psql $DATABASE_URL -f 004_add_annotation_jobs.sql
+
+CREATE TABLE IF NOT EXISTS annotation_jobs (
+    node_id         UUID NOT NULL REFERENCES opening_nodes(node_id) ON DELETE CASCADE,
+    target_depth    INTEGER NOT NULL,
+    priority        INTEGER NOT NULL DEFAULT 0,     -- higher is claimed first (game_count)
+    status          TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    leased_until    TIMESTAMPTZ,                    -- running jobs past this are claimable again
+    worker          TEXT,
+    last_error      TEXT,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (node_id, target_depth)
+);
+
+CREATE INDEX IF NOT EXISTS idx_annotation_jobs_claim ON annotation_jobs(priority DESC)
+    WHERE status IN ('pending', 'running');
@@ -0,0 +1,11 @@
+-- Migration: Add position_evals engine cache keyed by position_key
+-- Run with: psql $DATABASE_URL -f 005_add_position_evals.sql
+
+CREATE TABLE IF NOT EXISTS position_evals (
+    position_key    BIGINT PRIMARY KEY,             -- see positions.py; ignores move counters
+    depth           INTEGER NOT NULL,
+    score_cp        REAL NOT NULL,                  -- White's perspective, mate capped at ±1000
+    pv              TEXT[] NOT NULL DEFAULT '{}',   -- UCI moves
+    multipv         JSONB NOT NULL DEFAULT '[]',    -- [{"score_cp", "pv"}] per MultiPV line
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,9 @@
+-- Migration: Add minimax back-propagation results to opening_nodes
+-- Run with: psql $DATABASE_URL -f 006_add_minimax_eval.sql
+
+ALTER TABLE opening_nodes
+    ADD COLUMN IF NOT EXISTS minimax_eval REAL,
+    ADD COLUMN IF NOT EXISTS minimax_disagrees BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_opening_nodes_minimax_disagrees ON opening_nodes(minimax_disagrees)
+    WHERE minimax_disagrees = TRUE;
@@ -0,0 +1,42 @@
+-- Migration: Add white/black pawn bitboards to opening_nodes for structure queries in SQL
+-- Run with: psql $DATABASE_URL -f 007_add_pawn_bitboards.sql
+-- Bit i is square i in python-chess numbering (a1 = 0), stored signed like position_key.
+-- New rows get them from db._node_write_values; existing rows are backfilled below.
+
+ALTER TABLE opening_nodes
+    ADD COLUMN IF NOT EXISTS white_pawns BIGINT,
+    ADD COLUMN IF NOT EXISTS black_pawns BIGINT;
+
+-- Same parse as positions.fen_pawn_bitboards; pawn is 'P' (white) or 'p' (black).
+CREATE OR REPLACE FUNCTION fen_pawn_bitboard(fen TEXT, pawn TEXT) RETURNS BIGINT
+LANGUAGE plpgsql IMMUTABLE STRICT AS $$
+DECLARE
+    sq INTEGER := 56;
+    bits BIGINT := 0;
+    ch TEXT;
+BEGIN
+    FOREACH ch IN ARRAY regexp_split_to_array(split_part(fen, ' ', 1), '') LOOP
+        IF ch = '/' THEN
+            sq := sq - 16;
+        ELSIF ch BETWEEN '1' AND '8' THEN
+            sq := sq + ch::INTEGER;
+        ELSE
+            IF ch = pawn THEN
+                bits := bits | (1::BIGINT << sq);
+            END IF;
+            sq := sq + 1;
+        END IF;
+    END LOOP;
+    RETURN bits;
+END
+$$;
+
+UPDATE opening_nodes SET
+    white_pawns = fen_pawn_bitboard(fen, 'P'),
+    black_pawns = fen_pawn_bitboard(fen, 'p')
+WHERE white_pawns IS NULL OR black_pawns IS NULL;
+
+-- Covering index: structure predicates are bitwise, so they scan this narrow
+-- index (index-only) instead of the heap.
+CREATE INDEX IF NOT EXISTS idx_opening_nodes_pawns ON opening_nodes(white_pawns, black_pawns)
+    INCLUDE (eco_code, opening_name, game_count);
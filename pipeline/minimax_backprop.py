@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Phase 4b — Minimax back-propagation
+
+Backs engine evals up the move tree without searching. Working bottom-up over
+the whole node_children graph in memory, each interior node whose children all
+have a value gets the best child value for the side to move (max for White,
+min for Black; evals are White-perspective, so this is negamax). A child's
+value is its own backed-up value if it has one, else its stockfish_eval.
+
+The result is stored in opening_nodes.minimax_eval. minimax_disagrees flags
+nodes where it differs from the node's direct stockfish_eval by more than
+--threshold centipawns: the few nodes worth a deeper search.
+
+Usage:
+  python minimax_backprop.py --threshold 50
+"""
+
+import argparse
+import sys
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from db import get_connection, set_minimax_evals, stream_query
+
+DISAGREEMENT_CP = 50.0
+
+
+def cyclic_nodes(children: dict) -> set:
+    """Nodes on a cycle of the children graph (iterative Tarjan SCC; self-loops count)."""
+    index: dict = {}
+    low: dict = {}
+    stack: list = []
+    on_stack: set = set()
+    cyclic: set = set()
+    counter = 0
+    for root in children:
+        if root in index:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(children.get(root, ())))]
+        while work:
+            node, kids = work[-1]
+            for kid in kids:
+                if kid not in index:
+                    index[kid] = low[kid] = counter
+                    counter += 1
+                    stack.append(kid)
+                    on_stack.add(kid)
+                    work.append((kid, iter(children.get(kid, ()))))
+                    break
+                if kid in on_stack:
+                    low[node] = min(low[node], index[kid])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in children.get(node, ()):
+                        cyclic.update(component)
+    return cyclic
+
+
+def backpropagate(
+    evals: dict,
+    white_to_move: dict,
+    edges: list[tuple],
+    threshold: float = DISAGREEMENT_CP,
+) -> dict:
+    """
+    Minimax over the tree graph. evals maps node_id to stockfish_eval (or None);
+    white_to_move maps node_id to the side to move; edges are (parent_id, child_id).
+    Returns {node_id: (minimax_eval or None, disagrees)} for every node with children.
+
+    Children are linked by position_key, so a move order that returns to an
+    earlier position makes a real cycle. A repetition has no minimax value, so
+    nodes on a cycle are left unvalued ((None, False)) and their parents use
+    their direct stockfish_eval, as for any unvalued child.
+    """
+    children: dict = {}
+    for parent_id, child_id in edges:
+        if parent_id in evals and child_id in evals:
+            children.setdefault(parent_id, []).append(child_id)
+    on_cycle = cyclic_nodes(children)
+    parents: dict = {}
+    for parent_id, kids in children.items():
+        if parent_id in on_cycle:
+            continue
+        for child_id in kids:
+            parents.setdefault(child_id, []).append(parent_id)
+
+    # Kahn's algorithm on the reversed graph: a node is ready once all its children are.
+    # Cycle nodes' own edges are dropped, so they start ready and the rest is acyclic.
+    remaining = {node_id: len(kids) for node_id, kids in children.items() if node_id not in on_cycle}
+    ready = deque(node_id for node_id in evals if node_id not in remaining)
+    backed_up: dict = {}
+    result = {node_id: (None, False) for node_id in on_cycle}
+    while ready:
+        node_id = ready.popleft()
+        kids = children.get(node_id)
+        if kids and node_id not in on_cycle:
+            values = [backed_up.get(k) if backed_up.get(k) is not None else evals[k] for k in kids]
+            value = None
+            if all(v is not None for v in values):
+                value = max(values) if white_to_move[node_id] else min(values)
+            backed_up[node_id] = value
+            direct = evals[node_id]
+            disagrees = value is not None and direct is not None and abs(value - direct) > threshold
+            result[node_id] = (value, disagrees)
+        for parent_id in parents.get(node_id, ()):
+            remaining[parent_id] -= 1
+            if remaining[parent_id] == 0:
+                ready.append(parent_id)
+    return result
+
+
+def load_graph(conn) -> tuple[dict, dict, list[tuple]]:
+    """evals, white_to_move and edges for the whole tree, via streaming cursors."""
+    evals, white_to_move = {}, {}
+    for node_id, side, stockfish_eval in stream_query(conn, "SELECT node_id, side, stockfish_eval FROM opening_nodes"):
+        evals[node_id] = stockfish_eval
+        white_to_move[node_id] = side == "B"  # side is who just moved
+    edges = list(stream_query(conn, "SELECT parent_id, child_id FROM node_children"))
+    return evals, white_to_move, edges
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back engine evals up the opening tree")
+    parser.add_argument("--threshold", type=float, default=DISAGREEMENT_CP, help="Flag disagreements above this (cp)")
+    args = parser.parse_args()
+
+    with get_connection() as conn:
+        evals, white_to_move, edges = load_graph(conn)
+        result = backpropagate(evals, white_to_move, edges, args.threshold)
+        set_minimax_evals(conn, [(node_id, value, disagrees) for node_id, (value, disagrees) in result.items()])
+        conn.commit()
+
+    valued = sum(1 for value, _ in result.values() if value is not None)
+    flagged = sum(1 for _, disagrees in result.values() if disagrees)
+    print(f"Backed up {valued}/{len(result)} interior nodes; {flagged} disagree by more than {args.threshold} cp.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,13 @@ from typing import Literal
 from uuid import UUID
 
 
-@dataclass
+@dataclass(slots=True)
 class OpeningNode:
-    """Atomic unit: every tracked position in the move tree."""
+    """Atomic unit: every tracked position in the move tree.
+
+    Slotted so bulk loads stay compact. child_node_ids and transposition_ids are
+    rarely populated, so their lists are only allocated on first access.
+    """
 
     node_id: UUID | None = None
     fen: str = ""
@@ -18,19 +22,40 @@ class OpeningNode:
     opening_name: str = ""
     variation_name: str | None = None
     parent_node_id: UUID | None = None
-    child_node_ids: list[UUID] = field(default_factory=list)
     is_branching_node: bool = False
     stockfish_eval: float | None = None
     stockfish_depth: int | None = None
     best_move: str | None = None
     is_dubious: bool = False
     is_busted: bool = False
-    transposition_ids: list[UUID] = field(default_factory=list)
     resulting_structure: str | None = None
     game_count: int = 0
     white_win_pct: float | None = None
     draw_pct: float | None = None
     is_leaf: bool = False
+    position_key: int | None = None  # signed 64-bit Polyglot Zobrist hash, see positions.py
+    _child_node_ids: list[UUID] | None = field(default=None, init=False, repr=False, compare=False)
+    _transposition_ids: list[UUID] | None = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def child_node_ids(self) -> list[UUID]:
+        if self._child_node_ids is None:
+            self._child_node_ids = []
+        return self._child_node_ids
+
+    @child_node_ids.setter
+    def child_node_ids(self, value: list[UUID]) -> None:
+        self._child_node_ids = value
+
+    @property
+    def transposition_ids(self) -> list[UUID]:
+        if self._transposition_ids is None:
+            self._transposition_ids = []
+        return self._transposition_ids
+
+    @transposition_ids.setter
+    def transposition_ids(self, value: list[UUID]) -> None:
+        self._transposition_ids = value
 
 
 @dataclass
@@ -49,6 +74,21 @@ class OpeningEntry:
     tags: list[str] = field(default_factory=list)
 
 
+@dataclass
+class PositionEval:
+    """Cached engine result for a position, shared by every FEN with the same position_key."""
+
+    position_key: int
+    depth: int
+    score_cp: float  # White's perspective, mate capped at ±1000
+    pv: list[str] = field(default_factory=list)  # principal variation, UCI
+    multipv: list[dict] = field(default_factory=list)  # [{"score_cp", "pv"}] per line when searched with MultiPV
+
+    @property
+    def best_move(self) -> str | None:
+        return self.pv[0] if self.pv else None
+
+
 @dataclass
 class PawnStructure:
     """Named middlegame pawn configurations arising from multiple openings."""
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Phase 2 (offline variant) — Explorer stats from a local PGN corpus
+
+Builds the same per-position stats lichess_crawler.py fetches from the
+Lichess masters explorer (game_count, white_win_pct, draw_pct), but from our
+own archive. Games are streamed to --depth plies through pgn_io shards and
+counted in a process pool with --workers; each shard tallies per-position
+W/D/L totals and per-move counts keyed by position key. Tallies are held to
+--memory-mb across all processes: they spill sorted runs to disk
+(position_counts.SpillingTally) that the parent merges, keeping in memory only
+positions above --min-games and the moves between them.
+
+Positions played in at least --min-games games are then written level by
+level: nodes with upsert_nodes, edges (sort_order by popularity) with
+add_children, and nodes with two or more kept moves flagged branching.
+Positions already in the tree keep their row and get all three stats set
+together; new ones inherit eco_code/opening_name from their parent, and a
+kept move into a node stored under another parent is recorded as a
+transposition, as in the crawler.
+Games from a set-up position (FEN header) or a variant, and games without
+a 1-0 / 0-1 / 1/2-1/2 result, are skipped.
+
+Usage:
+  python pgn_explorer.py --pgn data/masters/*.pgn.zst --min-games 50
+  python pgn_explorer.py --pgn data/twic/*.pgn --workers 0 --depth 15
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import chess
+import chess.pgn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from db import (
+    add_children,
+    get_connection,
+    get_nodes_by_position_keys,
+    set_branching_nodes,
+    set_node_stats,
+    upsert_nodes,
+    upsert_transpositions,
+)
+from models import OpeningNode
+from pgn_io import Shard, open_shard, plan_shards
+from position_counts import SpillingTally
+from positions import position_key
+
+MIN_GAME_COUNT = 50
+MAX_DEPTH = 15
+SHARD_BYTES = 64 << 20
+MEMORY_MB = 1024
+RESULTS = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}  # index into a [white, draws, black] tally
+
+# key -> [ply, fen, white, draws, black]; fen and ply are from the earliest ply the position was seen at.
+Positions = dict[int, list]
+# (parent_key, child_key) -> [san, games]
+Moves = dict[tuple[int, int], list]
+
+
+class ExplorerVisitor(chess.pgn.BaseVisitor):
+    """
+    read_game visitor for stats: mainline SAN to max_ply, variations, comments
+    and NAGs skipped. The result is (result index or None, [(key, fen, san)] per
+    ply, starting with the initial position's (key, fen, None)).
+    """
+
+    def __init__(self, max_ply: int):
+        self.max_ply = max_ply
+
+    def begin_game(self):
+        self.outcome = None
+        self.setup = False
+        self.ply = 0
+        self.san = None
+        self.stopped = False
+        self.line: list[tuple[int, str, str | None]] = []
+
+    def visit_header(self, tagname: str, tagvalue: str) -> None:
+        if tagname == "Result":
+            self.outcome = RESULTS.get(tagvalue)
+        elif tagname == "FEN" or (tagname == "Variant" and tagvalue.lower() not in ("standard", "chess")):
+            self.setup = True
+
+    def end_headers(self):
+        if self.outcome is None or self.setup:
+            return chess.pgn.SKIP
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def begin_parse_san(self, board: chess.Board, san: str):
+        if self.stopped or self.ply >= self.max_ply:
+            return chess.pgn.SKIP
+
+    def visit_move(self, board: chess.Board, move: chess.Move) -> None:
+        self.ply += 1
+        self.san = board.san(move)
+
+    def visit_board(self, board: chess.Board) -> None:
+        # Called once for the start position, then after every move (and for skipped SAN tokens).
+        if not self.line or self.san is not None:
+            self.line.append((position_key(board), board.fen(), self.san))
+            self.san = None
+
+    def handle_error(self, error: Exception) -> None:
+        # An illegal move ends the game: keep the positions before it.
+        self.stopped = True
+
+    def result(self) -> tuple[int | None, list[tuple[int, str, str | None]]]:
+        if self.setup:
+            return None, []
+        return self.outcome, self.line
+
+
+class PositionTally(SpillingTally):
+    """key -> [ply, fen, white, draws, black], spilled to disk at its memory budget."""
+
+    def combine(self, record: list, other: list) -> None:
+        if other[0] < record[0]:
+            record[0], record[1] = other[0], other[1]
+        record[2] += other[2]
+        record[3] += other[3]
+        record[4] += other[4]
+
+
+class MoveTally(SpillingTally):
+    """(parent_key, child_key) -> [san, games], spilled to disk at its memory budget."""
+
+    def combine(self, record: list, other: list) -> None:
+        record[1] += other[1]
+
+
+def count_games(handle, positions: PositionTally, moves: MoveTally, max_ply: int = MAX_DEPTH) -> int:
+    """Tally every game read from a text stream into positions and moves. Returns games counted."""
+    visitor = lambda: ExplorerVisitor(max_ply)  # noqa: E731 - read_game wants a factory
+    games = 0
+    while (scanned := chess.pgn.read_game(handle, Visitor=visitor)) is not None:
+        outcome, line = scanned
+        if outcome is None or not line:
+            continue
+        games += 1
+        parent_key = None
+        for ply, (key, fen, san) in enumerate(line):
+            entry = positions.entries.get(key)
+            if entry is None:
+                entry = [ply, fen, 0, 0, 0]
+                entry[2 + outcome] += 1
+                positions.insert(key, entry)
+            else:
+                if ply < entry[0]:
+                    entry[0], entry[1] = ply, fen
+                entry[2 + outcome] += 1
+            if parent_key is not None:
+                move = moves.entries.get((parent_key, key))
+                if move is None:
+                    moves.insert((parent_key, key), [san, 1])
+                else:
+                    move[1] += 1
+            parent_key = key
+    return games
+
+
+def count_shard(shard: Shard, positions: PositionTally, moves: MoveTally, max_ply: int = MAX_DEPTH) -> int:
+    """Tally one shard of a PGN file. Returns games counted."""
+    pgn_path, start, end = shard
+    try:
+        with open_shard(shard) as handle:
+            return count_games(handle, positions, moves, max_ply)
+    except Exception as e:
+        print(f"Error reading {pgn_path} [{start}:{end}]: {e}", file=sys.stderr)
+        return 0
+
+
+_pool_max_ply = MAX_DEPTH
+_pool_memory_bytes = MEMORY_MB << 20
+_pool_spill_dir: str | None = None
+
+
+def _init_pool_worker(max_ply: int, memory_bytes: int, spill_dir: str) -> None:
+    global _pool_max_ply, _pool_memory_bytes, _pool_spill_dir
+    _pool_max_ply, _pool_memory_bytes, _pool_spill_dir = max_ply, memory_bytes, spill_dir
+
+
+def _pool_count_shard(shard: Shard) -> tuple[list[Path], list[Path], int]:
+    """Runs in a pool process: tally one shard under this worker's budget and return its spilled runs."""
+    positions = PositionTally(_pool_memory_bytes // 2, _pool_spill_dir)
+    moves = MoveTally(_pool_memory_bytes // 2, _pool_spill_dir)
+    games = count_shard(shard, positions, moves, _pool_max_ply)
+    positions.spill()
+    moves.spill()
+    return positions.runs, moves.runs, games
+
+
+def build_stats(
+    pgn_paths: list[Path],
+    *,
+    min_games: int = 1,
+    max_ply: int = MAX_DEPTH,
+    workers: int = 1,
+    shard_bytes: int = SHARD_BYTES,
+    memory_bytes: int = MEMORY_MB << 20,
+    spill_dir: str | None = None,
+) -> tuple[Positions, Moves, int]:
+    """
+    Count every shard of pgn_paths (in a process pool if workers > 1) and merge
+    the tallies. Counting stays within memory_bytes across all processes
+    (workers plus the parent), spilling sorted runs to spill_dir; only
+    positions with at least min_games games, and moves between them, are
+    returned in memory.
+    """
+    existing = []
+    for pgn_path in pgn_paths:
+        if not pgn_path.exists():
+            print(f"Warning: {pgn_path} not found", file=sys.stderr)
+            continue
+        existing.append(pgn_path)
+    shards = plan_shards(existing, shard_bytes)
+    per_process = memory_bytes // (workers + 1 if workers > 1 else 1)
+
+    games = 0
+    with tempfile.TemporaryDirectory(prefix="pgn-explorer-", dir=spill_dir) as run_dir:
+        position_tally = PositionTally(per_process // 2, run_dir)
+        move_tally = MoveTally(per_process // 2, run_dir)
+        try:
+            if workers > 1:
+                with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_pool_worker, initargs=(max_ply, per_process, run_dir)
+                ) as pool:
+                    for position_runs, move_runs, shard_games in pool.map(_pool_count_shard, shards):
+                        position_tally.adopt(position_runs)
+                        move_tally.adopt(move_runs)
+                        games += shard_games
+            else:
+                for shard in shards:
+                    games += count_shard(shard, position_tally, move_tally, max_ply)
+
+            positions: Positions = {
+                key: record for key, record in position_tally.merged() if sum(record[2:]) >= min_games
+            }
+            moves: Moves = {
+                edge: record
+                for edge, record in move_tally.merged()
+                if edge[0] in positions and edge[1] in positions
+            }
+        finally:
+            position_tally.close()
+            move_tally.close()
+    return positions, moves, games
+
+
+def plan_tree(positions: Positions, moves: Moves, min_games: int) -> tuple[list[list[int]], dict, dict]:
+    """
+    Which positions to write and how to link them. Returns (levels, parent, children):
+    levels are lists of keys by ply, each reachable from the level before; parent
+    maps a key to the key it hangs under (its most played kept move in, from an
+    earlier ply); children maps a key to [(child_key, san)] kept moves, most
+    played first. Moves back to an earlier ply (piece shuffles) are not edges.
+    """
+    kept = {key for key, entry in positions.items() if sum(entry[2:]) >= min_games}
+    incoming: dict[int, list] = {}
+    children: dict[int, list] = {}
+    for (parent_key, child_key), (san, games) in sorted(moves.items(), key=lambda item: -item[1][1]):
+        if parent_key not in kept or child_key not in kept:
+            continue
+        if positions[parent_key][0] >= positions[child_key][0]:
+            continue
+        incoming.setdefault(child_key, []).append(parent_key)
+        children.setdefault(parent_key, []).append((child_key, san))
+
+    levels: list[list[int]] = []
+    parent: dict[int, int] = {}
+    placed = set()
+    by_ply: dict[int, list] = {}
+    for key in kept:
+        by_ply.setdefault(positions[key][0], []).append(key)
+    for ply in sorted(by_ply):
+        level = []
+        for key in sorted(by_ply[ply], key=lambda k: -sum(positions[k][2:])):
+            if ply == 0:
+                level.append(key)
+                continue
+            linked = next((p for p in incoming.get(key, ()) if p in placed), None)
+            if linked is None:
+                continue
+            parent[key] = linked
+            level.append(key)
+        placed.update(level)
+        levels.append(level)
+    children = {
+        key: [(child, san) for child, san in kids if child in placed] for key, kids in children.items() if key in placed
+    }
+    return levels, parent, children
+
+
+def _stats(entry: list) -> dict:
+    white, draws, black = entry[2:]
+    total = white + draws + black
+    return {
+        "game_count": total,
+        "white_win_pct": white / total * 100 if total else None,
+        "draw_pct": draws / total * 100 if total else None,
+    }
+
+
+def write_tree(conn, positions: Positions, moves: Moves, min_games: int) -> tuple[int, int, int]:
+    """
+    Write kept positions level by level: new ones through upsert_nodes, stats
+    of ones already in the tree through set_node_stats (a plain SET, so a
+    refresh can lower game_count). Then edges, transpositions (a child whose
+    stored parent is not this move's parent, as in the crawler) and branching
+    flags. Commits once at the end. Returns (nodes written, new nodes, edges).
+    """
+    levels, parent, children = plan_tree(positions, moves, min_games)
+    san_in = {
+        child: san for key, kids in children.items() for child, san in kids if parent.get(child) == key
+    }
+    stored: dict[int, OpeningNode] = {}
+    stats_rows = []
+    written = created = 0
+    for level in levels:
+        if not level:
+            continue
+        existing = get_nodes_by_position_keys(conn, level)
+        batch = []
+        for key in level:
+            ply, fen, *_ = positions[key]
+            stats = _stats(positions[key])
+            if key in existing:
+                node = stored[key] = existing[key]
+                stats_rows.append((node.node_id, stats["game_count"], stats["white_win_pct"], stats["draw_pct"]))
+                continue
+            board = chess.Board(fen)
+            up = stored.get(parent.get(key))
+            batch.append((key, OpeningNode(
+                fen=fen,
+                pgn_move=san_in.get(key, ""),
+                move_number=board.fullmove_number,
+                side="W" if board.turn == chess.BLACK else "B",
+                parent_node_id=up.node_id if up else None,
+                eco_code=up.eco_code if up else "",
+                opening_name=up.opening_name if up else "",
+                position_key=key,
+                **stats,
+            )))
+        ids = upsert_nodes(conn, [node for _, node in batch]) if batch else {}
+        for key, node in batch:
+            node.node_id = ids.get(node.fen, node.node_id)
+            stored[key] = node
+        created += len(batch)
+        written += len(level)
+    set_node_stats(conn, stats_rows)
+
+    edges = []
+    transpositions = []
+    branching = []
+    for key, kids in children.items():
+        for sort_order, (child, _) in enumerate(kids):
+            parent_node, child_node = stored[key], stored[child]
+            edges.append((parent_node.node_id, child_node.node_id, sort_order))
+            if child_node.parent_node_id != parent_node.node_id:
+                transpositions.append((parent_node.node_id, child_node.node_id))
+        if len(kids) >= 2:
+            branching.append(stored[key].node_id)
+    add_children(conn, edges)
+    upsert_transpositions(conn, transpositions)
+    set_branching_nodes(conn, branching)
+    conn.commit()
+    return written, created, len(edges)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build explorer stats and tree nodes from a local PGN corpus")
+    parser.add_argument("--pgn", type=Path, nargs="+", required=True, help="PGN files (.pgn, .gz, .bz2, .zst)")
+    parser.add_argument("--min-games", type=int, default=MIN_GAME_COUNT)
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH, help="Plies read per game")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (0 = one per core)")
+    parser.add_argument("--shard-mb", type=int, default=SHARD_BYTES >> 20, help="Target shard size for plain files")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_MB, help="Cap on tally memory, all processes")
+    parser.add_argument("--spill-dir", default=None, help="Directory for sorted runs (default: system temp)")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+    positions, moves, games = build_stats(
+        args.pgn,
+        min_games=args.min_games,
+        max_ply=args.depth,
+        workers=workers,
+        shard_bytes=args.shard_mb << 20,
+        memory_bytes=args.memory_mb << 20,
+        spill_dir=args.spill_dir,
+    )
+    counted = time.perf_counter() - started
+    print(f"Counted {games} games ({len(positions)} positions kept) in {counted:.1f}s.", file=sys.stderr)
+
+    with get_connection() as conn:
+        written, created, edges = write_tree(conn, positions, moves, args.min_games)
+    print(f"Wrote {written} nodes ({created} new) and {edges} edges in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
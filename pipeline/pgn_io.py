@@ -0,0 +1,112 @@
+"""PGN input: transparent decompression and memory-mapped shards cut at game boundaries.
+
+Plain .pgn files are split into byte ranges by searching a memory map for
+'[Event ' header lines, so shards can be read independently (and in other
+processes) without scanning the file up front. A shard is parsed straight
+from the mapped pages through a buffered reader, never copied whole. .pgn.gz, .pgn.bz2 and
+.pgn.zst are decompressed as a stream, never to disk; a compressed file
+cannot be cut, so it is always one shard.
+"""
+
+import bz2
+import gzip
+import io
+import mmap
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, TextIO
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".zst", ".zstd")
+GAME_START = b"\n[Event "
+
+Shard = tuple[Path, int, int | None]  # (path, start, end); end None = whole (compressed) file
+
+
+def is_compressed(path: Path) -> bool:
+    return path.suffix.lower() in COMPRESSED_SUFFIXES
+
+
+def open_pgn(path: Path) -> TextIO:
+    """Text stream over a PGN file, decompressing .gz/.bz2/.zst on the fly."""
+    suffix = path.suffix.lower()
+    if suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if suffix == ".bz2":
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    if suffix in (".zst", ".zstd"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"{path}: reading .zst needs the zstandard package") from None
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def game_bounds(mm, shard_bytes: int) -> list[tuple[int, int]]:
+    """(start, end) ranges of roughly shard_bytes over a mapped PGN file, each starting on a game."""
+    size = len(mm)
+    starts = [0]
+    offset = shard_bytes
+    while offset < size:
+        # From the byte before, so a header starting right at offset is found.
+        i = mm.find(GAME_START, offset - 1)
+        if i < 0:
+            break
+        starts.append(i + 1)
+        offset = i + 1 + shard_bytes
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def plan_shards(pgn_paths: list[Path], shard_bytes: int) -> list[Shard]:
+    """Shards for every file: game-aligned byte ranges for plain files, one whole-file shard if compressed."""
+    shards = []
+    for pgn_path in pgn_paths:
+        if is_compressed(pgn_path):
+            shards.append((pgn_path, 0, None))
+            continue
+        if pgn_path.stat().st_size == 0:
+            continue
+        with open(pgn_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            shards.extend((pgn_path, start, end) for start, end in game_bounds(mm, shard_bytes))
+    return shards
+
+
+def shard_bytes_on_disk(shard: Shard) -> int:
+    pgn_path, start, end = shard
+    return pgn_path.stat().st_size if end is None else end - start
+
+
+class MappedRange(io.RawIOBase):
+    """Read-only raw stream over a memoryview, copying only what each read asks for."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), len(self._view) - self._pos)
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+@contextmanager
+def open_shard(shard: Shard) -> Iterator[TextIO]:
+    """Text stream over one shard: read straight from the memory map, or the decompressed stream."""
+    pgn_path, start, end = shard
+    if end is None:
+        with open_pgn(pgn_path) as handle:
+            yield handle
+        return
+    with open(pgn_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as whole, whole[start:end] as view:
+            handle = io.TextIOWrapper(io.BufferedReader(MappedRange(view)), encoding="utf-8", errors="replace")
+            try:
+                yield handle
+            finally:
+                # Drop the stream before the views are released and the map closed.
+                handle.close()
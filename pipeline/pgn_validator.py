@@ -4,22 +4,45 @@ Phase 3 — PGN Corpus Validation
 
 Validates the Knowledge Base move tree against TWIC/master PGN archives.
 Flags named variations present in master games but absent from the tree.
+Every position key in the tree is loaded once into a PositionKeySet, so
+membership checks are local and the scan makes no per-ply queries.
+Inputs may be plain, .gz, .bz2 or .zst (streamed, never decompressed to
+disk). Plain files are memory-mapped and cut into byte ranges at game
+boundaries; with --workers N the shards are counted in N processes and the
+per-shard tables merged before reporting. MB/s is printed per file.
+Counts are keyed by position key and held to --memory-mb: exact counts spill
+sorted runs to disk and are merged at the end; --approximate keeps a
+count-min sketch with heavy-hitter records instead (position_counts.py).
+Games are read through OpeningScanVisitor: unnamed openings skip their
+movetext, and SAN is parsed only up to --max-ply (default: the tree's depth).
 
 Usage:
   python pgn_validator.py --pgn data/twic/*.pgn --min-games 10
+  python pgn_validator.py --pgn data/twic/*.pgn --workers 0   # one per core
+  python pgn_validator.py --pgn data/masters.pgn.zst
 """
 
 import argparse
+import os
 import sys
-from collections import defaultdict
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import chess
 import chess.pgn
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from db import get_connection, get_node_by_fen
+from db import get_connection, get_max_ply, iter_position_keys
 from models import MissingVariation
+from pgn_io import Shard, open_shard, plan_shards, shard_bytes_on_disk
+from position_counts import HeavyHitterSketch, PositionCounter
+from positions import PositionKeySet, position_key
+
+KEY_ITERSIZE = 50_000  # keys are 8 bytes; fetch many per round trip
+SHARD_BYTES = 64 << 20
+MEMORY_MB = 1024
 
 
 def is_named_variation(opening_header: str) -> bool:
@@ -27,48 +50,200 @@ def is_named_variation(opening_header: str) -> bool:
     return bool(opening_header and opening_header.strip() and opening_header != "?")
 
 
+def load_known_keys(conn) -> PositionKeySet:
+    """Every position key in the tree, in one streamed pass."""
+    return PositionKeySet.from_sorted(iter_position_keys(conn, itersize=KEY_ITERSIZE))
+
+
+class OpeningScanVisitor(chess.pgn.BaseVisitor):
+    """
+    read_game visitor that parses only what the validator needs. Games without
+    a named Opening header skip their movetext entirely; otherwise mainline SAN
+    is parsed up to max_ply and no further, variations are skipped and comments
+    and NAGs dropped. The result is (opening, [(key, fen)] of positions not in known).
+    """
+
+    def __init__(self, known: PositionKeySet, max_ply: int):
+        self.known = known
+        self.max_ply = max_ply
+
+    def begin_game(self):
+        self.opening = ""
+        self.ply = 0
+        self.moved = False
+        self.stopped = False
+        self.unknown: list[tuple[int, str]] = []
+
+    def visit_header(self, tagname: str, tagvalue: str) -> None:
+        if tagname == "Opening":
+            self.opening = tagvalue
+
+    def end_headers(self):
+        if not is_named_variation(self.opening):
+            return chess.pgn.SKIP
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def begin_parse_san(self, board: chess.Board, san: str):
+        if self.stopped or self.ply >= self.max_ply:
+            return chess.pgn.SKIP
+
+    def visit_move(self, board: chess.Board, move: chess.Move) -> None:
+        self.ply += 1
+        self.moved = True
+
+    def visit_board(self, board: chess.Board) -> None:
+        # Also called for skipped SAN tokens; only record right after a move.
+        if self.moved:
+            self.moved = False
+            key = position_key(board)
+            if key not in self.known:
+                self.unknown.append((key, board.fen()))
+
+    def handle_error(self, error: Exception) -> None:
+        # An illegal move ends the game: keep the positions before it.
+        self.stopped = True
+
+    def result(self) -> tuple[str, list[tuple[int, str]]]:
+        return self.opening, self.unknown
+
+
+def scan_games(handle, source: str, known: PositionKeySet, counter, max_ply: int = sys.maxsize) -> None:
+    """Add unknown positions (to max_ply) of named-opening games read from a text stream to counter."""
+    visitor = lambda: OpeningScanVisitor(known, max_ply)  # noqa: E731 - read_game wants a factory
+    while (scanned := chess.pgn.read_game(handle, Visitor=visitor)) is not None:
+        opening_header, unknown = scanned
+        for key, fen in unknown:
+            counter.add(key, fen, opening_header, source)
+
+
+def count_shard(shard: Shard, known: PositionKeySet, counter, max_ply: int = sys.maxsize) -> float:
+    """Scan one shard of a PGN file into counter. Returns the seconds it took."""
+    pgn_path, start, end = shard
+    started = time.perf_counter()
+    try:
+        with open_shard(shard) as handle:
+            scan_games(handle, str(pgn_path), known, counter, max_ply)
+    except Exception as e:
+        print(f"Error reading {pgn_path} [{start}:{end}]: {e}", file=sys.stderr)
+    return time.perf_counter() - started
+
+
+def report_throughput(timings: dict[Path, list[float]]) -> None:
+    """Per-file MB/s from [bytes, seconds] totals (seconds summed over shards, i.e. per worker)."""
+    for pgn_path, (nbytes, seconds) in timings.items():
+        mb = nbytes / (1 << 20)
+        rate = mb / seconds if seconds else 0.0
+        print(f"{pgn_path}: {mb:.1f} MB in {seconds:.1f}s ({rate:.1f} MB/s)", file=sys.stderr)
+
+
+_pool_known: PositionKeySet | None = None
+_pool_max_ply = sys.maxsize
+_pool_memory_bytes = MEMORY_MB << 20
+_pool_spill_dir: str | None = None
+
+
+def _init_pool_worker(known: PositionKeySet, max_ply: int, memory_bytes: int, spill_dir: str) -> None:
+    global _pool_known, _pool_max_ply, _pool_memory_bytes, _pool_spill_dir
+    _pool_known, _pool_max_ply = known, max_ply
+    _pool_memory_bytes, _pool_spill_dir = memory_bytes, spill_dir
+
+
+def _pool_count_shard(shard: Shard) -> tuple[Shard, list[Path], float]:
+    """Runs in a pool process: count one shard under this worker's budget and return its spilled runs."""
+    counter = PositionCounter(_pool_memory_bytes, _pool_spill_dir)
+    seconds = count_shard(shard, _pool_known, counter, _pool_max_ply)
+    counter.spill()
+    return shard, counter.runs, seconds
+
+
 def validate_against_pgn(
-    conn, pgn_paths: list[Path], min_games: int
+    conn,
+    pgn_paths: list[Path],
+    min_games: int,
+    known: PositionKeySet | None = None,
+    *,
+    max_ply: int | None = None,
+    workers: int = 1,
+    shard_bytes: int = SHARD_BYTES,
+    memory_bytes: int = MEMORY_MB << 20,
+    approximate: bool = False,
+    spill_dir: str | None = None,
 ) -> list[MissingVariation]:
-    """Find positions from master games not in the tree."""
-    fen_counts: dict[str, dict] = defaultdict(lambda: {"count": 0, "names": set(), "sources": set()})
+    """
+    Find positions from master games not in the tree. known defaults to
+    load_known_keys(conn); max_ply (games are read no deeper) defaults to the
+    tree's deepest node, 0 means whole games. Plain files are split at game
+    boundaries into shards of about shard_bytes (compressed files are one
+    shard each); with workers > 1 shards are counted in a process pool.
+
+    Counting stays within memory_bytes: exactly, spilling sorted runs to
+    spill_dir, or with approximate=True in a count-min sketch (single process
+    only). The budget covers every process: each one's copy of known comes off
+    the top, and the rest is split evenly between the workers and the parent.
+    """
+    if approximate and workers > 1:
+        raise ValueError("approximate counting runs in one process; use workers=1")
+    if known is None:
+        known = load_known_keys(conn)
+    if max_ply is None:
+        max_ply = get_max_ply(conn) or 0
+    max_ply = max_ply or sys.maxsize
+    processes = workers + 1 if workers > 1 else 1
+    counting_bytes = memory_bytes - known.nbytes * processes
+    if counting_bytes <= 0:
+        raise ValueError(
+            f"memory budget of {memory_bytes >> 20} MB is used up by {processes} copies of the known-key set"
+        )
+    per_process = counting_bytes // processes
 
+    existing = []
     for pgn_path in pgn_paths:
         if not pgn_path.exists():
             print(f"Warning: {pgn_path} not found", file=sys.stderr)
             continue
+        existing.append(pgn_path)
+
+    shards = plan_shards(existing, shard_bytes)
+    timings: dict[Path, list[float]] = {}
+
+    def record(shard, seconds):
+        totals = timings.setdefault(shard[0], [0, 0.0])
+        totals[0] += shard_bytes_on_disk(shard)
+        totals[1] += seconds
+
+    with tempfile.TemporaryDirectory(prefix="pgn-validator-", dir=spill_dir) as run_dir:
+        if approximate:
+            counter = HeavyHitterSketch(counting_bytes, min_games)
+        else:
+            counter = PositionCounter(per_process, run_dir)
         try:
-            with open(pgn_path, encoding="utf-8", errors="replace") as f:
-                while True:
-                    game = chess.pgn.read_game(f)
-                    if game is None:
-                        break
-                    try:
-                        board = game.board()
-                        opening_header = game.headers.get("Opening", "")
-                        for node in game.mainline():
-                            board.push(node.move)
-                            fen = board.fen()
-                            if not get_node_by_fen(conn, fen) and is_named_variation(opening_header):
-                                fen_counts[fen]["count"] += 1
-                                fen_counts[fen]["names"].add(opening_header)
-                                fen_counts[fen]["sources"].add(str(pgn_path))
-                    except (chess.InvalidMoveError, chess.AmbiguousMoveError):
-                        continue
-        except Exception as e:
-            print(f"Error reading {pgn_path}: {e}", file=sys.stderr)
-
-    missing = []
-    for fen, data in fen_counts.items():
-        if data["count"] >= min_games:
-            missing.append(
+            if workers > 1:
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_pool_worker,
+                    initargs=(known, max_ply, per_process, run_dir),
+                ) as pool:
+                    for shard, runs, seconds in pool.map(_pool_count_shard, shards):
+                        counter.adopt(runs)
+                        record(shard, seconds)
+            else:
+                for shard in shards:
+                    record(shard, count_shard(shard, known, counter, max_ply))
+            report_throughput(timings)
+
+            missing = [
                 MissingVariation(
                     fen=fen,
-                    opening_name="; ".join(sorted(data["names"])[:3]),
-                    pgn_source="; ".join(sorted(data["sources"])[:3]),
-                    game_count=data["count"],
+                    opening_name="; ".join(names),
+                    pgn_source="; ".join(sources),
+                    game_count=count,
                 )
-            )
+                for fen, count, names, sources in counter.results(min_games)
+            ]
+        finally:
+            counter.close()
     return sorted(missing, key=lambda m: -m.game_count)
 
 
@@ -76,11 +251,34 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--pgn", nargs="+", required=True, help="PGN file paths")
     parser.add_argument("--min-games", type=int, default=10)
+    parser.add_argument(
+        "--max-ply", type=int, default=None, help="Read games this many half-moves deep (default: tree depth; 0 = all)"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (0 = one per core)")
+    parser.add_argument("--shard-mb", type=int, default=SHARD_BYTES >> 20, help="Target shard size for plain files")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_MB, help="Cap on known keys plus counts, all processes")
+    parser.add_argument(
+        "--approximate", action="store_true", help="Count-min sketch in fixed memory instead of spilling to disk"
+    )
+    parser.add_argument("--spill-dir", default=None, help="Directory for sorted runs (default: system temp)")
     args = parser.parse_args()
+    if args.approximate and args.workers != 1:
+        parser.error("--approximate runs in one process; drop --workers")
 
     pgn_paths = [Path(p) for p in args.pgn]
+    workers = args.workers if args.workers > 0 else os.cpu_count() or 1
     with get_connection() as conn:
-        missing = validate_against_pgn(conn, pgn_paths, args.min_games)
+        missing = validate_against_pgn(
+            conn,
+            pgn_paths,
+            args.min_games,
+            max_ply=args.max_ply,
+            workers=workers,
+            shard_bytes=args.shard_mb << 20,
+            memory_bytes=args.memory_mb << 20,
+            approximate=args.approximate,
+            spill_dir=args.spill_dir,
+        )
 
     print(f"Found {len(missing)} missing variations (game_count >= {args.min_games}):")
     for m in missing[:50]:
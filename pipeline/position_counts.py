@@ -0,0 +1,214 @@
+"""Bounded-memory position counting for the PGN validator.
+
+Both counters take add(key, fen, name, source) per unknown position, keyed by
+the 64-bit position key, and yield (fen, count, names, sources) rows for keys
+seen at least min_games times. Only the three alphabetically first names and
+sources are kept per key, which is all the report shows.
+
+PositionCounter is exact: when its entries reach the memory budget it writes
+them to disk as a run sorted by key, and results() merges every run with what
+is left in memory, at most MERGE_FAN_IN runs at a time (more runs are merged
+in passes through intermediate runs). Runs are plain files, so pool workers can spill their own
+and hand the paths to the parent. The spill/merge machinery is SpillingTally,
+which other counters with their own record layout (pgn_explorer) build on.
+
+HeavyHitterSketch is approximate and never touches disk: a count-min sketch
+estimates every key's count, and keys whose estimate reaches min_games get
+an exact-detail record from then on. Counts can only be overestimated, and
+names/sources seen before a key became heavy are missed.
+"""
+
+import heapq
+import json
+import os
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator
+
+# Rough in-memory cost of one entry: dict slot, key int, record list, FEN string, name tuples.
+ENTRY_BYTES = 400
+KEEP_NAMES = 3
+MERGE_FAN_IN = 128  # runs open at once while merging; well under the usual 1024-descriptor limit
+_UINT64 = (1 << 64) - 1
+
+
+def _smallest(values: Iterable[str]) -> list[str]:
+    return sorted(set(values))[:KEEP_NAMES]
+
+
+def _add_name(names: list[str], name: str) -> list[str]:
+    if name in names or (len(names) >= KEEP_NAMES and name > names[-1]):
+        return names
+    return _smallest([*names, name])
+
+
+class SpillingTally:
+    """
+    Per-key records held to memory_bytes: when entry_bytes-sized entries fill
+    the budget they are written to disk as a run sorted by key, and merged()
+    streams every run plus what is left in memory, one combined record per key.
+    Subclasses define combine(record, other), folding other into record in
+    place; records must round-trip through JSON (keys may be ints or tuples).
+    """
+
+    def __init__(self, memory_bytes: int, spill_dir: str | Path | None = None, entry_bytes: int = ENTRY_BYTES):
+        self.max_entries = max(1, memory_bytes // entry_bytes)
+        self.spill_dir = Path(spill_dir) if spill_dir else Path(tempfile.gettempdir())
+        self.runs: list[Path] = []
+        self.entries: dict = {}
+
+    def combine(self, record: list, other: list) -> None:
+        raise NotImplementedError
+
+    def insert(self, key, record: list) -> None:
+        """Store a key not yet in entries; spills if that fills the budget."""
+        self.entries[key] = record
+        if len(self.entries) >= self.max_entries:
+            self.spill()
+
+    def spill(self) -> Path | None:
+        """Write the in-memory entries as one run sorted by key and clear them."""
+        if not self.entries:
+            return None
+        path = self._write_run((key, self.entries[key]) for key in sorted(self.entries))
+        self.entries.clear()
+        self.runs.append(path)
+        return path
+
+    def adopt(self, runs: Iterable[Path]) -> None:
+        """Take ownership of runs spilled by another tally (e.g. in a pool worker)."""
+        self.runs.extend(Path(p) for p in runs)
+
+    def _combined(self, streams: list[Iterator[tuple]]) -> Iterator[tuple]:
+        current_key, current = None, None
+        for key, record in heapq.merge(*streams, key=lambda r: r[0]):
+            if current is not None and key == current_key:
+                self.combine(current, record)
+                continue
+            if current is not None:
+                yield current_key, current
+            current_key, current = key, list(record)
+        if current is not None:
+            yield current_key, current
+
+    def _write_run(self, records: Iterable[tuple]) -> Path:
+        fd, name = tempfile.mkstemp(prefix="positions-", suffix=".run", dir=self.spill_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for key, record in records:
+                f.write(json.dumps([key, record]))
+                f.write("\n")
+        return Path(name)
+
+    def merged(self) -> Iterator[tuple]:
+        """
+        (key, record) for every key, in key order, combined across runs. At most
+        MERGE_FAN_IN runs are open at once: beyond that, runs are first merged in
+        groups into intermediate runs, pass by pass.
+        """
+        while len(self.runs) >= MERGE_FAN_IN:  # keep one slot for the in-memory entries
+            group, rest = self.runs[:MERGE_FAN_IN], self.runs[MERGE_FAN_IN:]
+            merged_run = self._write_run(self._combined([_read_run(path) for path in group]))
+            for path in group:
+                path.unlink(missing_ok=True)
+            self.runs = rest + [merged_run]
+        streams = [_read_run(path) for path in self.runs]
+        streams.append(((key, self.entries[key]) for key in sorted(self.entries)))
+        yield from self._combined(streams)
+
+    def close(self) -> None:
+        for path in self.runs:
+            path.unlink(missing_ok=True)
+        self.runs = []
+        self.entries.clear()
+
+
+def _read_run(path: Path) -> Iterator[tuple]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            key, record = json.loads(line)
+            yield (tuple(key) if isinstance(key, list) else key), record
+
+
+class PositionCounter(SpillingTally):
+    """Exact per-key counts that spill sorted runs to disk at memory_bytes."""
+
+    # record: [count, fen, names, sources]
+
+    def add(self, key: int, fen: str, name: str, source: str) -> None:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.insert(key, [1, fen, [name], [source]])
+            return
+        entry[0] += 1
+        if fen < entry[1]:
+            entry[1] = fen
+        entry[2] = _add_name(entry[2], name)
+        entry[3] = _add_name(entry[3], source)
+
+    def combine(self, record: list, other: list) -> None:
+        record[0] += other[0]
+        record[1] = min(record[1], other[1])
+        record[2] = _smallest(record[2] + other[2])
+        record[3] = _smallest(record[3] + other[3])
+
+    def results(self, min_games: int) -> Iterator[tuple[str, int, list[str], list[str]]]:
+        for _, (count, fen, names, sources) in self.merged():
+            if count >= min_games:
+                yield fen, count, names, sources
+
+
+class HeavyHitterSketch:
+    """Approximate counts in fixed memory: count-min sketch plus records for keys above min_games."""
+
+    DEPTH = 4
+    # Odd 64-bit multipliers, one per row (multiplicative hashing of the Zobrist key).
+    _MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+
+    def __init__(self, memory_bytes: int, min_games: int):
+        # Half the budget for the sketch (4-byte cells), half for heavy-hitter records.
+        width = 1
+        while width * 2 * self.DEPTH * 4 <= memory_bytes // 2:
+            width *= 2
+        self._shift = 64 - (width.bit_length() - 1)
+        self._rows = [array("I", bytes(4 * width)) for _ in range(self.DEPTH)]
+        self.min_games = min_games
+        self.max_candidates = max(1, (memory_bytes // 2) // ENTRY_BYTES)
+        self.candidates: dict[int, list] = {}  # key -> [estimate, fen, names, sources]
+        self._warned = False
+
+    def _estimate_and_add(self, key: int) -> int:
+        unsigned = key & _UINT64
+        cols = [((unsigned * m) & _UINT64) >> self._shift for m in self._MULTIPLIERS]
+        estimate = min(row[c] for row, c in zip(self._rows, cols)) + 1
+        # Conservative update: raise only the cells below the new estimate.
+        for row, c in zip(self._rows, cols):
+            if row[c] < estimate:
+                row[c] = estimate
+        return estimate
+
+    def add(self, key: int, fen: str, name: str, source: str) -> None:
+        estimate = self._estimate_and_add(key)
+        entry = self.candidates.get(key)
+        if entry is not None:
+            entry[0] = estimate
+            entry[2] = _add_name(entry[2], name)
+            entry[3] = _add_name(entry[3], source)
+            return
+        if estimate < self.min_games:
+            return
+        if len(self.candidates) >= self.max_candidates:
+            if not self._warned:
+                print("Warning: heavy-hitter table full; raise --memory-mb", file=sys.stderr)
+                self._warned = True
+            return
+        self.candidates[key] = [estimate, fen, [name], [source]]
+
+    def results(self, min_games: int) -> Iterator[tuple[str, int, list[str], list[str]]]:
+        for estimate, fen, names, sources in self.candidates.values():
+            if estimate >= min_games:
+                yield fen, estimate, names, sources
+
+    def close(self) -> None:
+        self.candidates.clear()
@@ -0,0 +1,88 @@
+"""Position keys: 64-bit Polyglot Zobrist hashes of board positions.
+
+The hash covers pieces, side to move, castling rights and en passant, but not
+the halfmove/fullmove counters, so the same position reached by different move
+orders gets the same key. Keys are stored in a signed BIGINT column; the
+polyglot exporter converts back to the unsigned form.
+"""
+
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+
+import chess
+import chess.polyglot
+
+_SIGN_BIT = 1 << 63
+_UINT64 = (1 << 64) - 1
+
+
+def to_signed64(key: int) -> int:
+    """Map an unsigned 64-bit key into BIGINT range."""
+    return key - (1 << 64) if key & _SIGN_BIT else key
+
+
+def to_unsigned64(key: int) -> int:
+    """Inverse of to_signed64: the Polyglot key for a stored position_key."""
+    return key & _UINT64
+
+
+def position_key(board: chess.Board) -> int:
+    """Signed 64-bit position key for board."""
+    return to_signed64(chess.polyglot.zobrist_hash(board))
+
+
+def fen_position_key(fen: str) -> int:
+    """Position key for a FEN. Raises ValueError for an invalid FEN."""
+    return position_key(chess.Board(fen))
+
+
+def fen_pawn_bitboards(fen: str) -> tuple[int, int]:
+    """
+    (white, black) pawn bitboards from a FEN's placement field, without
+    building a chess.Board. Bit i is square i in python-chess numbering (a1 = 0).
+    """
+    white = black = 0
+    square = 56  # a8; the placement field runs rank 8 to rank 1
+    for ch in fen.split(" ", 1)[0]:
+        if ch == "/":
+            square -= 16
+        elif ch in "12345678":
+            square += int(ch)
+        else:
+            if ch == "P":
+                white |= 1 << square
+            elif ch == "p":
+                black |= 1 << square
+            square += 1
+    return white, black
+
+
+class PositionKeySet:
+    """
+    Read-only set of position keys in a sorted int64 array: 8 bytes per key,
+    membership by binary search. Built once so hot loops make no DB queries.
+    """
+
+    __slots__ = ("_keys",)
+
+    def __init__(self, keys: Iterable[int] = ()):
+        self._keys = array("q", sorted(set(keys)))
+
+    @classmethod
+    def from_sorted(cls, keys: Iterable[int]) -> "PositionKeySet":
+        """Build from keys already in ascending order without duplicates (no sort pass)."""
+        key_set = cls.__new__(cls)
+        key_set._keys = array("q", keys)
+        return key_set
+
+    def __contains__(self, key: int) -> bool:
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def nbytes(self) -> int:
+        return self._keys.itemsize * len(self._keys)
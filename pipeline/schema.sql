@@ -23,15 +23,38 @@ CREATE TABLE IF NOT EXISTS opening_nodes (
     game_count      INTEGER NOT NULL DEFAULT 0,
     white_win_pct   REAL,
     draw_pct        REAL,
+    position_key    BIGINT,
+    minimax_eval    REAL,                   -- best child value for the side to move (minimax_backprop.py)
+    minimax_disagrees BOOLEAN NOT NULL DEFAULT FALSE,
+    white_pawns     BIGINT,                 -- pawn bitboards (a1 = bit 0), see positions.fen_pawn_bitboards
+    black_pawns     BIGINT,
+    pawn_structure  TEXT GENERATED ALWAYS AS (  -- classify_pawns label, structure_sql.structure_case_sql()
+        CASE
+            WHEN white_pawns IS NULL OR black_pawns IS NULL THEN NULL
+            WHEN (((white_pawns & 578721382704613384) <> 0 AND (white_pawns & 1446803456761533460) = 0) OR ((black_pawns & 578721382704613384) <> 0 AND (black_pawns & 1446803456761533460) = 0)) THEN 'Isolated Queen''s Pawn'
+            WHEN ((((white_pawns & 72340172838076673) <> 0 AND (white_pawns & 144680345676153346) <> 0 AND (white_pawns & 289360691352306692) = 0) OR ((white_pawns & 144680345676153346) <> 0 AND (white_pawns & 289360691352306692) <> 0 AND (white_pawns & 651061555542690057) = 0) OR ((white_pawns & 289360691352306692) <> 0 AND (white_pawns & 578721382704613384) <> 0 AND (white_pawns & 1302123111085380114) = 0) OR ((white_pawns & 578721382704613384) <> 0 AND (white_pawns & 1157442765409226768) <> 0 AND (white_pawns & 2604246222170760228) = 0) OR ((white_pawns & 1157442765409226768) <> 0 AND (white_pawns & 2314885530818453536) <> 0 AND (white_pawns & 5208492444341520456) = 0) OR ((white_pawns & 2314885530818453536) <> 0 AND (white_pawns & 4629771061636907072) <> 0 AND (white_pawns & (-8029759185026510704)::BIGINT) = 0) OR ((white_pawns & 4629771061636907072) <> 0 AND (white_pawns & (-9187201950435737472)::BIGINT) <> 0 AND (white_pawns & 2314885530818453536) = 0)) OR (((black_pawns & 72340172838076673) <> 0 AND (black_pawns & 144680345676153346) <> 0 AND (black_pawns & 289360691352306692) = 0) OR ((black_pawns & 144680345676153346) <> 0 AND (black_pawns & 289360691352306692) <> 0 AND (black_pawns & 651061555542690057) = 0) OR ((black_pawns & 289360691352306692) <> 0 AND (black_pawns & 578721382704613384) <> 0 AND (black_pawns & 1302123111085380114) = 0) OR ((black_pawns & 578721382704613384) <> 0 AND (black_pawns & 1157442765409226768) <> 0 AND (black_pawns & 2604246222170760228) = 0) OR ((black_pawns & 1157442765409226768) <> 0 AND (black_pawns & 2314885530818453536) <> 0 AND (black_pawns & 5208492444341520456) = 0) OR ((black_pawns & 2314885530818453536) <> 0 AND (black_pawns & 4629771061636907072) <> 0 AND (black_pawns & (-8029759185026510704)::BIGINT) = 0) OR ((black_pawns & 4629771061636907072) <> 0 AND (black_pawns & (-9187201950435737472)::BIGINT) <> 0 AND (black_pawns & 2314885530818453536) = 0))) THEN 'Hanging Pawns'
+            WHEN (white_pawns & 335544320) = 335544320 THEN 'Maroczy Bind'
+            WHEN (white_pawns & 289360691352305664) <> 0 AND (white_pawns & 578721382704611328) <> 0 AND (white_pawns & 1157442765409222656) <> 0 AND (black_pawns & 4415293752324) <> 0 AND (black_pawns & 8830587504648) <> 0 AND (black_pawns & 17661175009296) <> 0 THEN 'Carlsbad'
+            WHEN (black_pawns & 34360786944) = 34360786944 THEN 'Caro-Kann Structure'
+            WHEN (black_pawns & 34360786944) = 34360786944 AND (white_pawns & 34628173824) <> 0 THEN 'French Structure'
+            WHEN (black_pawns & 17179869184) <> 0 THEN 'Sicilian Structure'
+            WHEN (black_pawns & 273154048) = 273154048 THEN 'King''s Indian Structure'
+            ELSE 'Unknown'
+        END
+    ) STORED,
     created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
 CREATE UNIQUE INDEX IF NOT EXISTS idx_opening_nodes_fen ON opening_nodes(fen);
+CREATE INDEX IF NOT EXISTS idx_opening_nodes_position_key ON opening_nodes(position_key);
 CREATE INDEX IF NOT EXISTS idx_opening_nodes_eco ON opening_nodes(eco_code);
 CREATE INDEX IF NOT EXISTS idx_opening_nodes_parent ON opening_nodes(parent_node_id);
 CREATE INDEX IF NOT EXISTS idx_opening_nodes_branching ON opening_nodes(is_branching_node) WHERE is_branching_node = TRUE;
 CREATE INDEX IF NOT EXISTS idx_opening_nodes_structure ON opening_nodes(resulting_structure) WHERE resulting_structure IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_opening_nodes_minimax_disagrees ON opening_nodes(minimax_disagrees) WHERE minimax_disagrees = TRUE;
+CREATE INDEX IF NOT EXISTS idx_opening_nodes_pawn_structure ON opening_nodes(pawn_structure, game_count DESC) INCLUDE (eco_code, opening_name);
+CREATE INDEX IF NOT EXISTS idx_opening_nodes_game_count ON opening_nodes(game_count DESC);
 
 -- Transposition cross-reference (many-to-many)
 CREATE TABLE IF NOT EXISTS node_transpositions (
@@ -82,6 +105,34 @@ CREATE TABLE IF NOT EXISTS node_changelog (
 CREATE INDEX IF NOT EXISTS idx_node_changelog_node ON node_changelog(node_id);
 CREATE INDEX IF NOT EXISTS idx_node_changelog_changed_at ON node_changelog(changed_at);
 
+-- Annotation work queue: drained by stockfish_annotator.py --queue with FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS annotation_jobs (
+    node_id         UUID NOT NULL REFERENCES opening_nodes(node_id) ON DELETE CASCADE,
+    target_depth    INTEGER NOT NULL,
+    priority        INTEGER NOT NULL DEFAULT 0,     -- higher is claimed first (game_count)
+    status          TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    leased_until    TIMESTAMPTZ,                    -- running jobs past this are claimable again
+    worker          TEXT,
+    last_error      TEXT,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (node_id, target_depth)
+);
+
+CREATE INDEX IF NOT EXISTS idx_annotation_jobs_claim ON annotation_jobs(priority DESC)
+    WHERE status IN ('pending', 'running');
+
+-- Engine eval cache: one row per position, reused by any node (or move order) reaching it
+CREATE TABLE IF NOT EXISTS position_evals (
+    position_key    BIGINT PRIMARY KEY,             -- see positions.py; ignores move counters
+    depth           INTEGER NOT NULL,
+    score_cp        REAL NOT NULL,                  -- White's perspective, mate capped at ±1000
+    pv              TEXT[] NOT NULL DEFAULT '{}',   -- UCI moves
+    multipv         JSONB NOT NULL DEFAULT '[]',    -- [{"score_cp", "pv"}] per MultiPV line
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
 -- Pawn structures
 CREATE TABLE IF NOT EXISTS pawn_structures (
     structure_id    UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Fill opening_nodes.position_key for rows written before migration 003.
+
+Usage:
+  python scripts/backfill_position_keys.py --batch-size 5000
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from db import get_connection, set_position_keys, stream_query
+from positions import fen_position_key
+
+
+def backfill_position_keys(conn, batch_size: int = 5000) -> int:
+    """Compute and store missing position keys, committing every batch_size rows."""
+    updated = 0
+    batch = []
+    rows = stream_query(
+        conn,
+        "SELECT node_id, fen FROM opening_nodes WHERE position_key IS NULL",
+        withhold=True,
+    )
+    for node_id, fen in rows:
+        try:
+            batch.append((node_id, fen_position_key(fen)))
+        except ValueError:
+            print(f"Warning: invalid FEN for {node_id}: {fen}", file=sys.stderr)
+            continue
+        if len(batch) >= batch_size:
+            set_position_keys(conn, batch)
+            conn.commit()
+            updated += len(batch)
+            batch = []
+    set_position_keys(conn, batch)
+    conn.commit()
+    return updated + len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill opening_nodes.position_key")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    with get_connection() as conn:
+        n = backfill_position_keys(conn, args.batch_size)
+    print(f"Backfilled {n} position keys.")
+
+
+if __name__ == "__main__":
+    main()
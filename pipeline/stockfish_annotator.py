@@ -8,18 +8,47 @@ Populates stockfish_eval, stockfish_depth, best_move, is_dubious, is_busted.
 Usage:
   python stockfish_annotator.py
   STOCKFISH_PATH=/usr/bin/stockfish python stockfish_annotator.py
+  python stockfish_annotator.py --enqueue   # fill annotation_jobs
+  python stockfish_annotator.py --queue     # drain it; start one per core
+  python stockfish_annotator.py --engines 0 # local pool, one engine per core
 """
 
 import argparse
+import itertools
+import multiprocessing
 import os
+import socket
 import sys
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 import chess
 import chess.engine
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from db import get_connection, get_nodes, get_leaf_nodes, update_node, log_node_change
+from db import (
+    annotation_job_counts,
+    claim_annotation_jobs,
+    complete_annotation_jobs,
+    enqueue_annotation_jobs,
+    fail_annotation_job,
+    get_cached_eval,
+    get_cached_evals,
+    get_children,
+    get_connection,
+    get_nodes_by_ids,
+    iter_leaf_nodes,
+    iter_nodes,
+    log_node_change,
+    log_node_changes,
+    release_annotation_job,
+    store_evals,
+    update_annotations,
+    update_node,
+)
+from models import PositionEval
+from positions import fen_position_key, position_key
 
 
 def is_dubious(eval_cp: float, side: str) -> bool:
@@ -44,60 +73,481 @@ def score_to_cp(score: chess.engine.PovScore) -> float:
     return white_score.score(mate_score=10000)
 
 
-def annotate_nodes(conn, stockfish_path: str = "stockfish", max_nodes: int | None = None) -> int:
-    """Annotate branching and terminal nodes. Returns count annotated."""
-    branching = get_nodes(conn, is_branching=True, order_by="game_count DESC", limit=max_nodes)
-    leaves = get_leaf_nodes(conn, limit=max_nodes)
-    nodes_to_annotate = branching + leaves
+STOCKFISH_THREADS = int(os.environ.get("STOCKFISH_THREADS", "1"))
+STOCKFISH_HASH_MB = int(os.environ.get("STOCKFISH_HASH_MB", "256"))
 
-    depth_branching = 22
-    depth_high_freq = 26
-    depth_leaf = 18
+
+class PersistentEngine:
+    """
+    A Stockfish process kept open across many analyses, so the UCI handshake
+    and the hash table are paid for once. If the engine dies it is restarted
+    and the analysis retried once.
+    """
+
+    def __init__(self, path: str = "stockfish", threads: int = STOCKFISH_THREADS, hash_mb: int = STOCKFISH_HASH_MB):
+        self.path = path
+        self.options = {"Threads": threads, "Hash": hash_mb}
+        self._engine = None
+
+    @property
+    def engine(self) -> chess.engine.SimpleEngine:
+        if self._engine is None:
+            self._engine = chess.engine.SimpleEngine.popen_uci(self.path)
+            self._engine.configure(self.options)
+        return self._engine
+
+    def analyse(self, board: chess.Board, limit: chess.engine.Limit, **kwargs):
+        try:
+            return self.engine.analyse(board, limit, **kwargs)
+        except chess.engine.EngineTerminatedError:
+            self.restart()
+            return self.engine.analyse(board, limit, **kwargs)
+
+    def restart(self) -> None:
+        self.close()
+        print(f"Restarting Stockfish ({self.path})", file=sys.stderr)
+
+    def close(self) -> None:
+        if self._engine is not None:
+            try:
+                self._engine.quit()
+            except chess.engine.EngineError:
+                pass
+            self._engine = None
+
+
+DEPTH_BRANCHING = 22
+DEPTH_HIGH_FREQ = 26
+DEPTH_LEAF = 18
+MAX_MULTIPV = 12
+
+
+def target_depth(node) -> int:
+    """Search depth for a node: deeper for popular branching nodes, shallower for leaves."""
+    if not node.is_branching_node:
+        return DEPTH_LEAF
+    return DEPTH_HIGH_FREQ if node.game_count >= 1000 else DEPTH_BRANCHING
+
+
+def node_position_key(node) -> int:
+    """The node's stored position_key, or one computed from its FEN."""
+    return node.position_key if node.position_key is not None else fen_position_key(node.fen)
+
+
+def search_position(engine, board: chess.Board, depth: int, multipv: int = 1) -> PositionEval | None:
+    """Search board to depth. Returns None if the engine gave no score."""
+    info = engine.analyse(board, chess.engine.Limit(depth=depth), multipv=multipv)
+    if not info or info[0].get("score") is None:
+        return None
+    lines = [
+        {"score_cp": score_to_cp(line["score"]), "pv": [m.uci() for m in line.get("pv", [])]}
+        for line in info
+        if line.get("score") is not None
+    ]
+    return PositionEval(
+        position_key=position_key(board),
+        depth=depth,
+        score_cp=lines[0]["score_cp"],
+        pv=lines[0]["pv"],
+        multipv=lines if multipv > 1 else [],
+    )
+
+
+def annotation_from_eval(node, ev: PositionEval) -> dict:
+    """update_node fields for node from a search of its position."""
+    best_move = ev.best_move
+    if best_move:
+        board = chess.Board(node.fen)
+        try:
+            best_move = board.san(chess.Move.from_uci(best_move))
+        except ValueError:
+            pass
+    return {
+        "stockfish_eval": ev.score_cp,
+        "stockfish_depth": ev.depth,
+        "best_move": best_move,
+        "is_dubious": is_dubious(ev.score_cp, node.side),
+        "is_busted": is_busted(ev.score_cp, node.side),
+    }
+
+
+def analyse_node(engine, node, depth: int, conn=None) -> dict | None:
+    """
+    Search node to depth. Returns update_node fields, or None if the engine gave no score.
+    With conn, the position_evals cache is consulted first (any entry at least as deep
+    answers, whatever move order or counters reached the position) and new searches are stored.
+    """
+    if conn is not None:
+        cached = get_cached_eval(conn, node_position_key(node), depth)
+        if cached is not None:
+            return annotation_from_eval(node, cached)
+    ev = search_position(engine, chess.Board(node.fen), depth)
+    if ev is None:
+        return None
+    if conn is not None:
+        store_evals(conn, [ev])
+    return annotation_from_eval(node, ev)
+
+
+def write_annotation(conn, node_id, annotation: dict) -> None:
+    """Store an analyse_node result and record it in the changelog."""
+    update_node(conn, node_id, **annotation)
+    log_node_change(conn, node_id, "stockfish_eval", None, annotation["stockfish_eval"])
+    log_node_change(conn, node_id, "stockfish_depth", None, annotation["stockfish_depth"])
+
+
+def write_annotations(conn, annotations: list[tuple]) -> None:
+    """Bulk write_annotation for (node_id, annotation) pairs."""
+    update_annotations(conn, annotations)
+    log_node_changes(conn, [
+        change
+        for node_id, annotation in annotations
+        for change in (
+            (node_id, "stockfish_eval", None, annotation["stockfish_eval"]),
+            (node_id, "stockfish_depth", None, annotation["stockfish_depth"]),
+        )
+    ])
+
+
+def analyse_with_children(engine, node, children: list, depth: int, conn=None) -> tuple[dict | None, list[tuple]]:
+    """
+    One MultiPV search at node, with one line per stored child (up to MAX_MULTIPV).
+    Each line whose first move leads to a child is that child's eval at depth - 1,
+    so the search goes one ply past the deepest target_depth of the children still
+    lacking an eval (or to depth, if deeper). Returns node's annotation and
+    (child_id, annotation) for children that had no eval and whose own target
+    depth the line reaches. Children without a legal pgn_move are left out.
+    With conn, the search is answered from / stored in the position_evals cache,
+    child lines included.
+    """
+    board = chess.Board(node.fen)
+    by_move = {}
+    for child in children:
+        if not child.pgn_move:
+            continue
+        try:
+            by_move[board.parse_san(child.pgn_move).uci()] = child
+        except ValueError:
+            continue
+    depth = max([depth, *(target_depth(child) + 1 for child in by_move.values() if child.stockfish_eval is None)])
+    multipv = max(1, min(len(by_move), MAX_MULTIPV))
+    ev = None
+    if conn is not None:
+        ev = get_cached_eval(conn, node_position_key(node), depth, min_multipv=multipv)
+    searched = ev is None
+    if searched:
+        ev = search_position(engine, board, depth, multipv=multipv)
+    if ev is None:
+        return None, []
+
+    child_evals, child_annotations = [], []
+    for line in ev.multipv or [{"score_cp": ev.score_cp, "pv": ev.pv}]:
+        child = by_move.get(line["pv"][0]) if line["pv"] else None
+        if child is None:
+            continue
+        child_ev = PositionEval(
+            position_key=node_position_key(child),
+            depth=ev.depth - 1,
+            score_cp=line["score_cp"],
+            pv=line["pv"][1:],
+        )
+        child_evals.append(child_ev)
+        if child.stockfish_eval is None and child_ev.depth >= target_depth(child):
+            child_annotations.append((child.node_id, annotation_from_eval(child, child_ev)))
+    if conn is not None and searched:
+        store_evals(conn, [ev, *child_evals])
+    return annotation_from_eval(node, ev), child_annotations
+
+
+def annotate_nodes(
+    conn,
+    stockfish_path: str = "stockfish",
+    max_nodes: int | None = None,
+    multipv_children: bool = False,
+) -> int:
+    """
+    Annotate branching and terminal nodes. Returns count annotated.
+    With multipv_children, branching nodes are searched with analyse_with_children
+    and the children annotated from that search are skipped in their own pass.
+    """
+    # Streamed from server-side cursors; WITH HOLD because we commit while iterating.
+    nodes_to_annotate = itertools.chain(
+        iter_nodes(conn, is_branching=True, order_by="game_count DESC", limit=max_nodes, withhold=True),
+        iter_leaf_nodes(conn, limit=max_nodes, withhold=True),
+    )
     annotated = 0
+    pending = []
+    covered = set()
 
     try:
         with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
             for node in nodes_to_annotate:
-                if node.stockfish_eval is not None:
+                if node.stockfish_eval is not None or node.node_id in covered:
                     continue
-                depth = depth_high_freq if node.game_count >= 1000 else depth_branching
-                if not node.is_branching_node:
-                    depth = depth_leaf
-
-                board = chess.Board(node.fen)
                 try:
-                    info = engine.analyse(board, chess.engine.Limit(depth=depth), multipv=1)
+                    if multipv_children and node.is_branching_node:
+                        child_ids = [child_id for child_id, _ in get_children(conn, node.node_id)]
+                        children = get_nodes_by_ids(conn, child_ids)
+                        annotation, child_annotations = analyse_with_children(
+                            engine, node, children, target_depth(node), conn
+                        )
+                    else:
+                        annotation = analyse_node(engine, node, target_depth(node), conn)
+                        child_annotations = []
                 except chess.engine.EngineError:
                     continue
-                if not info:
+                if annotation is None:
                     continue
 
-                score = info[0].get("score")
-                if score is None:
-                    continue
-                eval_cp = score_to_cp(score)
-                pv = info[0].get("pv", [])
-                best_uci = pv[0].uci() if pv else None
-                best_san = board.san(pv[0]) if pv and len(pv) > 0 else None
-
-                update_node(
-                    conn,
-                    node.node_id,
-                    stockfish_eval=eval_cp,
-                    stockfish_depth=depth,
-                    best_move=best_san or best_uci,
-                    is_dubious=is_dubious(eval_cp, node.side),
-                    is_busted=is_busted(eval_cp, node.side),
-                )
-                log_node_change(conn, node.node_id, "stockfish_eval", None, eval_cp)
-                log_node_change(conn, node.node_id, "stockfish_depth", None, depth)
-                annotated += 1
-                if annotated % 100 == 0:
+                pending.append((node.node_id, annotation))
+                pending.extend(child_annotations)
+                covered.update(child_id for child_id, _ in child_annotations)
+                if len(pending) >= 100:
+                    write_annotations(conn, pending)
                     conn.commit()
+                    annotated += len(pending)
+                    pending = []
                     print(f"Annotated {annotated} nodes...", file=sys.stderr)
+            write_annotations(conn, pending)
+            conn.commit()
+            annotated += len(pending)
+    except FileNotFoundError:
+        print("Stockfish not found. Install it or set STOCKFISH_PATH.", file=sys.stderr)
+        sys.exit(1)
+
+    return annotated
+
+
+def split_cores(engines: int, cores: int | None = None) -> tuple[int, int]:
+    """
+    (engines, threads per engine) for a pool on this box. engines <= 0 means one
+    single-threaded engine per core, which scales best: positions are independent,
+    while Stockfish's own threads share one search. Otherwise the cores are divided
+    evenly among the requested engines.
+    """
+    cores = cores or os.cpu_count() or 1
+    if engines <= 0:
+        return cores, 1
+    return engines, max(1, cores // engines)
+
+
+_pool_engine: PersistentEngine | None = None
+MAX_POOL_RESTARTS = 3  # per run; a pool that keeps breaking is a real problem
+
+
+def _init_pool_engine(stockfish_path: str, threads: int, hash_mb: int) -> None:
+    global _pool_engine
+    _pool_engine = PersistentEngine(stockfish_path, threads=threads, hash_mb=hash_mb)
+
+
+def _pool_analyse(node, depth: int) -> PositionEval | None:
+    """Runs in a pool process: search_position for node on this process's engine."""
+    try:
+        return search_position(_pool_engine, chess.Board(node.fen), depth)
+    except chess.engine.EngineError as e:
+        print(f"Engine error on {node.node_id}: {e}", file=sys.stderr)
+        return None
+
+
+def _chunks(iterable, size: int):
+    it = iter(iterable)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
+
+def annotate_nodes_pool(
+    conn,
+    stockfish_path: str = "stockfish",
+    engines: int = 0,
+    max_nodes: int | None = None,
+    write_batch: int = 200,
+    hash_mb: int = STOCKFISH_HASH_MB,
+) -> int:
+    """
+    annotate_nodes on a pool of Stockfish processes. Nodes are streamed from the
+    database to the pool with a bounded number in flight, after a bulk lookup in
+    the position_evals cache; results are written back write_batch at a time,
+    one commit each. Pool processes are spawned, not forked, so none inherits the
+    open database connection. If a pool process dies, the nodes in flight are
+    re-queued on a fresh pool (up to MAX_POOL_RESTARTS times). Returns count annotated.
+    """
+    engines, threads = split_cores(engines)
+    print(f"Annotating with {engines} engines x {threads} threads", file=sys.stderr)
+    nodes_to_annotate = (
+        node
+        for node in itertools.chain(
+            iter_nodes(conn, is_branching=True, order_by="game_count DESC", limit=max_nodes, withhold=True),
+            iter_leaf_nodes(conn, limit=max_nodes, withhold=True),
+        )
+        if node.stockfish_eval is None
+    )
+    window = engines * 4
+    annotated = 0
+    restarts = 0
+    results = []
+    new_evals = []
+    in_flight = {}
+
+    def start_pool():
+        return ProcessPoolExecutor(
+            max_workers=engines,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pool_engine,
+            initargs=(stockfish_path, threads, hash_mb),
+        )
+
+    def submit(node, depth):
+        try:
+            in_flight[pool.submit(_pool_analyse, node, depth)] = (node, depth)
+        except BrokenProcessPool as e:
+            restart([(node, depth)], e)
+
+    def restart(lost, error):
+        nonlocal pool, restarts
+        lost = lost + list(in_flight.values())
+        in_flight.clear()
+        restarts += 1
+        if restarts > MAX_POOL_RESTARTS:
+            raise error
+        print(f"Engine pool broke ({error}); re-queueing {len(lost)} nodes on a new pool", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        pool = start_pool()
+        for node, depth in lost:
+            submit(node, depth)
+
+    def collect(return_when):
+        done, _ = wait(in_flight, return_when=return_when)
+        lost, error = [], None
+        for future in done:
+            node, depth = in_flight.pop(future)
+            try:
+                ev = future.result()
+            except BrokenProcessPool as e:
+                lost.append((node, depth))
+                error = e
+                continue
+            if ev is not None:
+                new_evals.append(ev)
+                results.append((node.node_id, annotation_from_eval(node, ev)))
+        if lost:
+            restart(lost, error)
+
+    def flush():
+        nonlocal annotated, results, new_evals
+        if results:
+            store_evals(conn, new_evals)
+            write_annotations(conn, results)
+            conn.commit()
+            annotated += len(results)
+            results, new_evals = [], []
+            print(f"Annotated {annotated} nodes...", file=sys.stderr)
+
+    pool = start_pool()
+    try:
+        for chunk in _chunks(nodes_to_annotate, window):
+            depths = [target_depth(node) for node in chunk]
+            cached = get_cached_evals(conn, [node_position_key(node) for node in chunk], min(depths))
+            for node, depth in zip(chunk, depths):
+                ev = cached.get(node_position_key(node))
+                if ev is not None and ev.depth >= depth:
+                    results.append((node.node_id, annotation_from_eval(node, ev)))
+                    continue
+                submit(node, depth)
+                # Keep every engine busy without queueing the whole table in memory.
+                while len(in_flight) >= window:
+                    collect(FIRST_COMPLETED)
+            if len(results) >= write_batch:
+                flush()
+        while in_flight:
+            collect(ALL_COMPLETED)
+        flush()
+    except FileNotFoundError:
+        print("Stockfish not found. Install it or set STOCKFISH_PATH.", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        pool.shutdown()
+
+    return annotated
+
+
+def enqueue_annotations(conn, max_nodes: int | None = None, batch_size: int = 5000) -> int:
+    """Queue every unannotated branching and leaf node in annotation_jobs. Returns jobs added."""
+    nodes = itertools.chain(
+        iter_nodes(conn, is_branching=True, order_by="game_count DESC", limit=max_nodes),
+        iter_leaf_nodes(conn, limit=max_nodes),
+    )
+    added = 0
+    batch = []
+    for node in nodes:
+        if node.stockfish_eval is not None:
+            continue
+        batch.append((node.node_id, node.game_count, target_depth(node)))
+        if len(batch) >= batch_size:
+            added += enqueue_annotation_jobs(conn, batch)
+            batch = []
+    added += enqueue_annotation_jobs(conn, batch)
+    conn.commit()
+    return added
+
+
+def drain_annotation_queue(
+    conn,
+    stockfish_path: str = "stockfish",
+    batch_size: int = 10,
+    lease_seconds: int = 600,
+    max_attempts: int = 3,
+) -> int:
+    """
+    Claim jobs from annotation_jobs until none are left and annotate them.
+    Safe to run in any number of processes at once; jobs whose lease expires
+    (the worker died) are claimed again, and a worker that lost a lease leaves
+    the job to whoever holds it now. A job is handed back without spending an
+    attempt the first time the engine dies on it. Returns count annotated.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    annotated = 0
+    crashed = set()  # jobs the engine died on once already; a second crash counts
+
+    engine = PersistentEngine(stockfish_path)
+    try:
+        while True:
+            jobs = claim_annotation_jobs(conn, worker, batch_size, lease_seconds, max_attempts)
+            conn.commit()
+            if not jobs:
+                break
+            done = []
+            for node, depth in jobs:
+                if node.stockfish_depth is not None and node.stockfish_depth >= depth:
+                    done.append((node.node_id, depth))
+                    continue
+                try:
+                    annotation = analyse_node(engine, node, depth, conn)
+                except chess.engine.EngineTerminatedError as e:
+                    if (node.node_id, depth) not in crashed:
+                        crashed.add((node.node_id, depth))
+                        release_annotation_job(conn, worker, node.node_id, depth, str(e))
+                    else:
+                        fail_annotation_job(conn, worker, node.node_id, depth, str(e), max_attempts)
+                    continue
+                except chess.engine.EngineError as e:
+                    fail_annotation_job(conn, worker, node.node_id, depth, str(e), max_attempts)
+                    continue
+                if annotation is None:
+                    fail_annotation_job(conn, worker, node.node_id, depth, "no score", max_attempts)
+                    continue
+                write_annotation(conn, node.node_id, annotation)
+                done.append((node.node_id, depth))
+                annotated += 1
+            held = complete_annotation_jobs(conn, worker, done)
+            conn.commit()
+            if held < len(done):
+                print(f"Lease lost on {len(done) - held} jobs; left to their new worker", file=sys.stderr)
+            print(f"Annotated {annotated} nodes...", file=sys.stderr)
     except FileNotFoundError:
         print("Stockfish not found. Install it or set STOCKFISH_PATH.", file=sys.stderr)
         sys.exit(1)
+    finally:
+        engine.close()
 
     return annotated
 
@@ -110,26 +560,74 @@ def main():
         action="store_true",
         help="Enqueue Celery tasks instead of running locally (requires Redis)",
     )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Add unannotated nodes to the annotation_jobs queue and exit",
+    )
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="Annotate jobs claimed from annotation_jobs; run as many processes as you like",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10,
+        help="Jobs claimed per round trip (--queue) or nodes per Celery task (--parallel)",
+    )
+    parser.add_argument("--lease-seconds", type=int, default=600, help="Claimed jobs are retried after this (--queue)")
+    parser.add_argument(
+        "--engines",
+        type=int,
+        default=None,
+        help="Annotate on a local pool of N Stockfish processes, cores split between them (0 = one per core)",
+    )
+    parser.add_argument(
+        "--multipv",
+        action="store_true",
+        help="Search branching nodes with one MultiPV line per stored child and annotate the children from it",
+    )
     args = parser.parse_args()
     path = os.environ.get("STOCKFISH_PATH", "stockfish")
 
-    if args.parallel:
-        from celery_app import annotate_node_task
-
+    if args.enqueue:
+        with get_connection() as conn:
+            n = enqueue_annotations(conn, args.max_nodes)
+            counts = annotation_job_counts(conn)
+        print(f"Queued {n} annotation jobs. Queue: {counts}")
+    elif args.queue:
+        with get_connection() as conn:
+            n = drain_annotation_queue(conn, path, args.batch_size, args.lease_seconds)
+        print(f"Annotated {n} nodes.")
+    elif args.engines is not None:
         with get_connection() as conn:
-            branching = get_nodes(conn, is_branching=True, order_by="game_count DESC", limit=args.max_nodes)
-            leaves = get_leaf_nodes(conn, limit=args.max_nodes)
+            n = annotate_nodes_pool(conn, path, args.engines, args.max_nodes)
+        print(f"Annotated {n} nodes.")
+    elif args.parallel:
+        from celery_app import annotate_nodes_task
+
         enqueued = 0
-        for node in branching + leaves:
-            if node.stockfish_eval is not None:
-                continue
-            depth = 26 if node.game_count >= 1000 else (22 if node.is_branching_node else 18)
-            annotate_node_task.delay(str(node.node_id), path, depth)
-            enqueued += 1
-        print(f"Enqueued {enqueued} annotation tasks.")
+        batch = []
+        with get_connection() as conn:
+            for node in itertools.chain(
+                iter_nodes(conn, is_branching=True, order_by="game_count DESC", limit=args.max_nodes),
+                iter_leaf_nodes(conn, limit=args.max_nodes),
+            ):
+                if node.stockfish_eval is not None:
+                    continue
+                batch.append(str(node.node_id))
+                if len(batch) >= args.batch_size:
+                    annotate_nodes_task.delay(batch)
+                    enqueued += len(batch)
+                    batch = []
+        if batch:
+            annotate_nodes_task.delay(batch)
+            enqueued += len(batch)
+        print(f"Enqueued {enqueued} nodes in batches of {args.batch_size}.")
     else:
         with get_connection() as conn:
-            n = annotate_nodes(conn, path, args.max_nodes)
+            n = annotate_nodes(conn, path, args.max_nodes, multipv_children=args.multipv)
         print(f"Annotated {n} nodes.")
 
 
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Phase 5 (batch variant) — Vectorized structure tagging
+
+Classifies whole arrays of pawn bitboards with NumPy: every rule in
+structure_tagger.PAWN_MASK_RULES becomes a handful of uint64 array ops, so a
+chunk of a million positions costs a few dozen vector passes instead of a
+Python loop. The driver streams (node_id, white_pawns, black_pawns) from
+opening_nodes in chunks (migration 007 columns) and writes labels back with
+COPY via db.set_structures.
+
+Usage:
+  python structure_batch.py                 # untagged nodes only
+  python structure_batch.py --all --chunk-size 500000
+"""
+
+import argparse
+import itertools
+import sys
+import time
+from pathlib import Path
+
+import chess
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from db import get_connection, set_structures, stream_query
+from structure_tagger import (
+    BLACK_ADVANCED,
+    CARO_KANN_BLACK,
+    CDE_FILES,
+    KID_BLACK,
+    MAROCZY_WHITE,
+    PAWN_MASK_RULES,
+    WHITE_ADVANCED,
+)
+
+LABELS = [label for _, label in PAWN_MASK_RULES] + ["Unknown"]
+UNKNOWN = len(LABELS) - 1
+CHUNK_SIZE = 200_000
+
+
+def _u64(mask: int) -> np.uint64:
+    return np.uint64(mask)
+
+
+def pawn_files(pawns: np.ndarray) -> np.ndarray:
+    """8-bit file occupancy per element (bit 0 = a-file), as uint64."""
+    for shift in (32, 16, 8):
+        pawns = pawns | (pawns >> _u64(shift))
+    return pawns & _u64(0xFF)
+
+
+def _iqp(files: np.ndarray) -> np.ndarray:
+    return (files & _u64(0b0001_1100)) == _u64(0b0000_1000)
+
+
+def _hanging(files: np.ndarray) -> np.ndarray:
+    one, two = _u64(1), _u64(2)
+    return (files & (files >> one) & ~(files << one) & ~(files >> two) & _u64(0x7F)) != 0
+
+
+def _all(pawns: np.ndarray, mask: int) -> np.ndarray:
+    return (pawns & _u64(mask)) == _u64(mask)
+
+
+def classify_arrays(white: np.ndarray, black: np.ndarray) -> np.ndarray:
+    """
+    Label indices into LABELS for uint64 pawn bitboard arrays; same result as
+    structure_tagger.classify_pawns element by element (first matching rule wins).
+    """
+    white = np.asarray(white, dtype=np.uint64)
+    black = np.asarray(black, dtype=np.uint64)
+    white_files, black_files = pawn_files(white), pawn_files(black)
+    cde = _u64(CDE_FILES)
+    caro_kann = _all(black, CARO_KANN_BLACK)
+    matches = [
+        _iqp(white_files) | _iqp(black_files),
+        _hanging(white_files) | _hanging(black_files),
+        _all(white, MAROCZY_WHITE),
+        ((pawn_files(white & _u64(WHITE_ADVANCED)) & cde) == cde)
+        & ((pawn_files(black & _u64(BLACK_ADVANCED)) & cde) == cde),
+        caro_kann,
+        caro_kann & ((white & _u64(chess.BB_E4 | chess.BB_D5)) != 0),
+        (black & _u64(chess.BB_C5)) != 0,
+        _all(black, KID_BLACK),
+    ]
+    labels = np.full(white.shape, UNKNOWN, dtype=np.int8)
+    # Last rule first, so earlier rules overwrite later ones.
+    for index in range(len(matches) - 1, -1, -1):
+        labels[matches[index]] = index
+    return labels
+
+
+def _chunks(rows, size: int):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def tag_all(conn, *, retag: bool = False, chunk_size: int = CHUNK_SIZE) -> int:
+    """Stream bitboards, classify each chunk in one vector pass, COPY labels back. Commits per chunk."""
+    sql = "SELECT node_id, white_pawns, black_pawns FROM opening_nodes WHERE white_pawns IS NOT NULL"
+    if not retag:
+        sql += " AND resulting_structure IS NULL"
+    rows = stream_query(conn, sql, itersize=chunk_size, withhold=True)
+    labels = np.array(LABELS, dtype=object)
+    tagged = 0
+    for chunk in _chunks(rows, chunk_size):
+        node_ids = [row[0] for row in chunk]
+        # Stored signed (positions.to_signed64); reinterpret the bits as unsigned.
+        white = np.fromiter((row[1] for row in chunk), dtype=np.int64, count=len(chunk)).view(np.uint64)
+        black = np.fromiter((row[2] for row in chunk), dtype=np.int64, count=len(chunk)).view(np.uint64)
+        set_structures(conn, list(zip(node_ids, labels[classify_arrays(white, black)])))
+        conn.commit()
+        tagged += len(chunk)
+    return tagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized structure tagging from stored pawn bitboards")
+    parser.add_argument("--all", action="store_true", help="Re-tag every node, not just untagged ones")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with get_connection() as conn:
+        tagged = tag_all(conn, retag=args.all, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - started
+    print(f"Tagged {tagged} nodes in {elapsed:.1f}s ({tagged / elapsed if elapsed else 0:.0f} nodes/s).")
+
+
+if __name__ == "__main__":
+    main()
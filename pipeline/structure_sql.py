@@ -0,0 +1,137 @@
+"""Pawn structure predicates as SQL over opening_nodes.white_pawns / black_pawns.
+
+RULE_SQL mirrors structure_tagger.PAWN_MASK_RULES rule for rule; as one CASE
+expression it is the stored generated column opening_nodes.pawn_structure,
+so a structure is an indexed equality lookup and never needs a tagging pass.
+pawn_filter_sql builds ad-hoc searches such as "white c4 and e4, no black d-pawn". Masks are
+rendered as signed BIGINT literals, matching how the bitboards are stored.
+Everything here is generated from integer masks, never from request text.
+"""
+
+import chess
+
+from positions import to_signed64
+from structure_tagger import (
+    BLACK_ADVANCED,
+    CARO_KANN_BLACK,
+    CDE_FILES,
+    KID_BLACK,
+    MAROCZY_WHITE,
+    WHITE_ADVANCED,
+)
+
+WHITE = "white_pawns"
+BLACK = "black_pawns"
+
+
+def mask_sql(mask: int) -> str:
+    """A bitboard as a BIGINT literal."""
+    value = to_signed64(mask)
+    return str(value) if value >= 0 else f"({value})::BIGINT"
+
+
+def all_of(column: str, mask: int) -> str:
+    return f"({column} & {mask_sql(mask)}) = {mask_sql(mask)}"
+
+
+def none_of(column: str, mask: int) -> str:
+    return f"({column} & {mask_sql(mask)}) = 0"
+
+
+def any_of(column: str, mask: int) -> str:
+    return f"({column} & {mask_sql(mask)}) <> 0"
+
+
+def _files_mask(files: int) -> int:
+    mask = 0
+    for f in range(8):
+        if files >> f & 1:
+            mask |= chess.BB_FILES[f]
+    return mask
+
+
+def _files_sql(column: str, occupied: int, empty: int, within: int = chess.BB_ALL) -> str:
+    """Every file in occupied holds a pawn (inside within), every file in empty holds none (8-bit file masks)."""
+    clauses = [any_of(column, chess.BB_FILES[f] & within) for f in range(8) if occupied >> f & 1]
+    if empty:
+        clauses.append(none_of(column, _files_mask(empty) & within))
+    return " AND ".join(clauses)
+
+
+def _either(clause) -> str:
+    return f"(({clause(WHITE)}) OR ({clause(BLACK)}))"
+
+
+def _iqp(column: str) -> str:
+    return _files_sql(column, 0b0000_1000, 0b0001_0100)
+
+
+def _hanging(column: str) -> str:
+    pairs = []
+    for f in range(7):
+        empty = (1 << (f - 1) if f > 0 else 0) | (1 << (f + 2) if f < 6 else 0)
+        pairs.append(f"({_files_sql(column, 0b11 << f, empty)})")
+    return " OR ".join(pairs)
+
+
+RULE_SQL: list[tuple[str, str]] = [
+    (_either(_iqp), "Isolated Queen's Pawn"),
+    (_either(_hanging), "Hanging Pawns"),
+    (all_of(WHITE, MAROCZY_WHITE), "Maroczy Bind"),
+    (
+        f"{_files_sql(WHITE, CDE_FILES, 0, WHITE_ADVANCED)} AND {_files_sql(BLACK, CDE_FILES, 0, BLACK_ADVANCED)}",
+        "Carlsbad",
+    ),
+    (all_of(BLACK, CARO_KANN_BLACK), "Caro-Kann Structure"),
+    (f"{all_of(BLACK, CARO_KANN_BLACK)} AND {any_of(WHITE, chess.BB_E4 | chess.BB_D5)}", "French Structure"),
+    (any_of(BLACK, chess.BB_C5), "Sicilian Structure"),
+    (all_of(BLACK, KID_BLACK), "King's Indian Structure"),
+]
+
+STRUCTURE_LABELS = [label for _, label in RULE_SQL] + ["Unknown"]
+
+
+def structure_case_sql() -> str:
+    """
+    CASE expression giving classify_pawns' label for every row (NULL without
+    bitboards). This is the opening_nodes.pawn_structure generated column in
+    migration 008 and schema.sql; both must be regenerated if a rule changes.
+    """
+    whens = ["    WHEN white_pawns IS NULL OR black_pawns IS NULL THEN NULL"]
+    for sql, label in RULE_SQL:
+        quoted = label.replace("'", "''")
+        whens.append(f"    WHEN {sql} THEN '{quoted}'")
+    return "CASE\n" + "\n".join(whens) + "\n    ELSE 'Unknown'\nEND"
+
+
+def parse_pawn_squares(spec: str) -> int:
+    """
+    Mask for a comma/space separated list of squares ("c4,e4") or whole files
+    ("d"). Raises ValueError for anything else.
+    """
+    mask = 0
+    for token in spec.replace(",", " ").replace("+", " ").lower().split():
+        if len(token) == 1 and token in chess.FILE_NAMES:
+            mask |= chess.BB_FILES[chess.FILE_NAMES.index(token)]
+        else:
+            mask |= chess.BB_SQUARES[chess.parse_square(token)]
+    return mask
+
+
+def pawn_filter_sql(white: int = 0, black: int = 0, white_absent: int = 0, black_absent: int = 0) -> str:
+    """
+    WHERE clause: White has pawns on every square of white, none on white_absent;
+    likewise for Black. Raises ValueError if all masks are empty.
+    """
+    clauses = []
+    if white:
+        clauses.append(all_of(WHITE, white))
+    if white_absent:
+        clauses.append(none_of(WHITE, white_absent))
+    if black:
+        clauses.append(all_of(BLACK, black))
+    if black_absent:
+        clauses.append(none_of(BLACK, black_absent))
+    if not clauses:
+        raise ValueError("empty pawn filter")
+    return " AND ".join(clauses)
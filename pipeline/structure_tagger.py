@@ -5,17 +5,35 @@ Phase 5 — Structure Tagging
 Tags terminal/leaf nodes with pawn structure labels.
 Uses rule-based classification against known pawn skeletons.
 
+Classification works on the two pawn bitboards only: each rule is a few mask
+tests (classify_pawns), so a FEN needs no chess.Board. The per-square
+predicates in PAWN_STRUCTURE_RULES are the reference the masks must match.
+Openings share pawn skeletons heavily, so results are memoized per
+(white, black) bitboard pair in a bounded LRU (pawn_cache).
+
+--incremental tags every untagged node, not just leaves, by walking
+node_children down from the roots. A child reached by a non-pawn move keeps
+its parent's pawns: a quiet piece move inherits the parent's label outright,
+a piece capture clears the captured square from the parent's bitboards. Only
+pawn moves (and children whose parent's bitboards are unknown) read the FEN.
+
 Usage:
   python structure_tagger.py
+  python structure_tagger.py --incremental
 """
 
+import argparse
+import itertools
 import sys
+import time
+from collections import OrderedDict, deque
 from pathlib import Path
 
 import chess
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from db import get_connection, get_leaf_nodes, update_node
+from db import get_connection, set_structures, stream_query
+from positions import fen_pawn_bitboards
 
 
 def get_pawns(board: chess.Board, color: chess.Color) -> list[tuple[int, int]]:
@@ -118,42 +136,326 @@ PAWN_STRUCTURE_RULES: list[tuple[callable, str]] = [
 ]
 
 
+# Bitboard forms of the rules above. Squares and rank filters mirror the
+# predicates exactly, including their coordinate slips (the Caro-Kann/French
+# "e6" is (4, 2) = e3, and the KID pawns are d3/e4/g3).
+WHITE_ADVANCED = ~(chess.BB_RANK_1 | chess.BB_RANK_2) & chess.BB_ALL  # rank index >= 2
+BLACK_ADVANCED = ~(chess.BB_RANK_7 | chess.BB_RANK_8) & chess.BB_ALL  # rank index <= 5
+CDE_FILES = 0b0001_1100
+CARO_KANN_BLACK = chess.BB_D5 | chess.BB_E3
+MAROCZY_WHITE = chess.BB_C4 | chess.BB_E4
+KID_BLACK = chess.BB_D3 | chess.BB_E4 | chess.BB_G3
+
+
+def pawn_files(pawns: int) -> int:
+    """8-bit mask of the files holding at least one pawn (bit 0 = a-file)."""
+    pawns |= pawns >> 32
+    pawns |= pawns >> 16
+    pawns |= pawns >> 8
+    return pawns & 0xFF
+
+
+def _has_iqp(files: int) -> bool:
+    return files & 0b0001_1100 == 0b0000_1000
+
+
+def _has_hanging_pair(files: int) -> bool:
+    # Bit f: files f and f+1 occupied, f-1 and f+2 empty.
+    return bool(files & (files >> 1) & ~(files << 1) & ~(files >> 2) & 0x7F)
+
+
+def pawns_iqp(white: int, black: int) -> bool:
+    return _has_iqp(pawn_files(white)) or _has_iqp(pawn_files(black))
+
+
+def pawns_hanging(white: int, black: int) -> bool:
+    return _has_hanging_pair(pawn_files(white)) or _has_hanging_pair(pawn_files(black))
+
+
+def pawns_maroczy(white: int, black: int) -> bool:
+    return white & MAROCZY_WHITE == MAROCZY_WHITE
+
+
+def pawns_carlsbad(white: int, black: int) -> bool:
+    return (
+        pawn_files(white & WHITE_ADVANCED) & CDE_FILES == CDE_FILES
+        and pawn_files(black & BLACK_ADVANCED) & CDE_FILES == CDE_FILES
+    )
+
+
+def pawns_caro_kann(white: int, black: int) -> bool:
+    return black & CARO_KANN_BLACK == CARO_KANN_BLACK
+
+
+def pawns_french(white: int, black: int) -> bool:
+    return black & CARO_KANN_BLACK == CARO_KANN_BLACK and bool(white & (chess.BB_E4 | chess.BB_D5))
+
+
+def pawns_sicilian(white: int, black: int) -> bool:
+    return bool(black & chess.BB_C5)
+
+
+def pawns_kings_indian(white: int, black: int) -> bool:
+    return black & KID_BLACK == KID_BLACK
+
+
+PAWN_MASK_RULES: list[tuple[callable, str]] = [
+    (pawns_iqp, "Isolated Queen's Pawn"),
+    (pawns_hanging, "Hanging Pawns"),
+    (pawns_maroczy, "Maroczy Bind"),
+    (pawns_carlsbad, "Carlsbad"),
+    (pawns_caro_kann, "Caro-Kann Structure"),
+    (pawns_french, "French Structure"),
+    (pawns_sicilian, "Sicilian Structure"),
+    (pawns_kings_indian, "King's Indian Structure"),
+]
+
+
+def pawn_bitboards(board: chess.Board) -> tuple[int, int]:
+    """(white, black) pawn bitboards of board."""
+    return board.pieces_mask(chess.PAWN, chess.WHITE), board.pieces_mask(chess.PAWN, chess.BLACK)
+
+
+def classify_pawns(white: int, black: int) -> str:
+    """Classify pawn structure from pawn bitboards. Returns label or 'Unknown'."""
+    for predicate, label in PAWN_MASK_RULES:
+        if predicate(white, black):
+            return label
+    return "Unknown"
+
+
+PAWN_CACHE_SIZE = 1 << 16
+
+
+class PawnStructureCache:
+    """
+    Bounded LRU of classify_pawns results keyed by the pawn bitboards, with
+    hit/miss counters. Only misses are timed; hits are kept clock-free and
+    their cost is sampled when stats() is asked for.
+    """
+
+    HIT_SAMPLE = 1000  # lookups timed by stats() to price a hit
+
+    def __init__(self, maxsize: int = PAWN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._labels: OrderedDict[tuple[int, int], str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0  # time spent classifying misses
+
+    def classify(self, white: int, black: int) -> str:
+        key = (white, black)
+        label = self._labels.get(key)
+        if label is not None:
+            self._labels.move_to_end(key)
+            self.hits += 1
+            return label
+        started = time.perf_counter()
+        label = classify_pawns(white, black)
+        self.miss_seconds += time.perf_counter() - started
+        self._labels[key] = label
+        if len(self._labels) > self.maxsize:
+            self._labels.popitem(last=False)
+        self.misses += 1
+        return label
+
+    def _hit_seconds(self) -> float:
+        """Average cost of one hit, timed over up to HIT_SAMPLE lookups of cached keys."""
+        # The most recent keys, oldest first, so moving each to the end keeps the LRU order.
+        keys = list(itertools.islice(reversed(self._labels), self.HIT_SAMPLE))[::-1]
+        if not keys:
+            return 0.0
+        labels = self._labels
+        started = time.perf_counter()
+        for key in keys:
+            labels.get(key)
+            labels.move_to_end(key)
+        return (time.perf_counter() - started) / len(keys)
+
+    def stats(self) -> dict:
+        """Counters plus hit rate and the estimated speedup over classifying every call."""
+        calls = self.hits + self.misses
+        per_miss = self.miss_seconds / self.misses if self.misses else 0.0
+        cached = self.miss_seconds + self.hits * self._hit_seconds()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._labels),
+            "hit_rate": self.hits / calls if calls else 0.0,
+            "speedup": per_miss * calls / cached if cached else 1.0,
+        }
+
+    def clear(self) -> None:
+        self._labels.clear()
+        self.hits = self.misses = 0
+        self.miss_seconds = 0.0
+
+
+pawn_cache = PawnStructureCache()
+
+
 def classify_structure(board: chess.Board) -> str:
     """Classify pawn structure. Returns label or 'Unknown'."""
-    for predicate, label in PAWN_STRUCTURE_RULES:
+    return pawn_cache.classify(*pawn_bitboards(board))
+
+
+def classify_fen(fen: str) -> str:
+    """Classify the pawn structure of a FEN without building a board."""
+    return pawn_cache.classify(*fen_pawn_bitboards(fen))
+
+
+def format_cache_stats(stats: dict) -> str:
+    return (
+        f"Pawn cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.1%} hit rate, {stats['speedup']:.1f}x vs uncached)."
+    )
+
+
+def is_quiet_piece_move(san: str | None) -> bool:
+    """A non-capturing piece move or castling: pawns are unchanged."""
+    return bool(san) and san[0] not in "abcdefgh" and "x" not in san
+
+
+def capture_pawns(san: str | None, parent_pawns: tuple[int, int] | None) -> tuple[int, int] | None:
+    """
+    Pawn bitboards after a piece capture, from the parent's: the target square
+    is cleared. None for pawn moves, unknown moves or unknown parent bitboards.
+    """
+    if not san or san[0] in "abcdefgh" or "x" not in san or parent_pawns is None:
+        return None
+    square = chess.BB_SQUARES[chess.parse_square(san.rstrip("+#")[-2:])]
+    white, black = parent_pawns
+    return white & ~square, black & ~square
+
+
+def tag_incrementally(nodes: dict, edges: list[tuple]) -> tuple[dict, dict]:
+    """
+    Breadth-first over edges from every node with no incoming edge. nodes maps
+    node_id to (parent_node_id, pgn_move, resulting_structure, fen); fen is only
+    read for untagged nodes. pgn_move is the move from parent_node_id, so other
+    incoming edges (transpositions) count as unknown moves.
+    Returns ({node_id: label} for untagged nodes, counts).
+    """
+    children: dict = {}
+    has_parent = set()
+    for parent_id, child_id in edges:
+        if parent_id in nodes and child_id in nodes:
+            children.setdefault(parent_id, []).append(child_id)
+            has_parent.add(child_id)
+
+    labels = {}
+    pawns: dict = {}  # bitboards of visited nodes whose children are still queued
+    stats = {"inherited": 0, "captures": 0, "parsed": 0}
+
+    def tag_from_fen(node_id):
+        pawns[node_id] = fen_pawn_bitboards(nodes[node_id][3])
+        labels[node_id] = pawn_cache.classify(*pawns[node_id])
+        stats["parsed"] += 1
+
+    roots = [node_id for node_id in nodes if node_id not in has_parent]
+    for node_id in roots:
+        if nodes[node_id][2] is None:
+            tag_from_fen(node_id)
+    visited = set(roots)
+    queue = deque(roots)
+    while queue:
+        parent_id = queue.popleft()
+        parent_label = labels.get(parent_id) or nodes[parent_id][2]
+        parent_pawns = pawns.pop(parent_id, None)
+        for child_id in children.get(parent_id, ()):
+            if child_id in visited:
+                continue
+            visited.add(child_id)
+            queue.append(child_id)
+            primary_parent, san, label, _ = nodes[child_id]
+            if label is not None:
+                continue
+            if primary_parent != parent_id:
+                san = None
+            if is_quiet_piece_move(san):
+                labels[child_id] = parent_label
+                if parent_pawns is not None:
+                    pawns[child_id] = parent_pawns
+                stats["inherited"] += 1
+                continue
+            derived = capture_pawns(san, parent_pawns)
+            if derived is None:
+                tag_from_fen(child_id)
+                continue
+            pawns[child_id] = derived
+            labels[child_id] = pawn_cache.classify(*derived)
+            stats["captures"] += 1
+
+    # Unreachable from any root (not expected): classify directly.
+    for node_id, (_, _, label, fen) in nodes.items():
+        if node_id not in visited and label is None:
+            tag_from_fen(node_id)
+            pawns.pop(node_id)
+    return labels, stats
+
+
+def load_tag_graph(conn) -> tuple[dict, list[tuple]]:
+    """nodes and edges for tag_incrementally, via streaming cursors. FENs only for untagged nodes."""
+    nodes = {}
+    rows = stream_query(
+        conn,
+        """
+        SELECT node_id, parent_node_id, pgn_move, resulting_structure,
+               CASE WHEN resulting_structure IS NULL THEN fen END
+        FROM opening_nodes
+        """,
+    )
+    for node_id, *rest in rows:
+        nodes[node_id] = tuple(rest)
+    edges = list(stream_query(conn, "SELECT parent_id, child_id FROM node_children"))
+    return nodes, edges
+
+
+def tag_leaves(conn) -> int:
+    """Classify every untagged leaf from its FEN and bulk-write the labels."""
+    # All untagged leaves (get_leaf_nodes would also filter on stockfish_eval), streamed
+    rows = stream_query(
+        conn,
+        """
+        SELECT node_id, fen FROM opening_nodes n
+        WHERE NOT EXISTS (SELECT 1 FROM node_children WHERE parent_id = n.node_id)
+        AND n.resulting_structure IS NULL
+        """,
+    )
+    labels = []
+    for node_id, fen in rows:
         try:
-            if predicate(board):
-                return label
-        except Exception:
-            continue
-    return "Unknown"
+            labels.append((node_id, classify_fen(fen)))
+        except Exception as e:
+            print(f"Error tagging {fen[:50]}: {e}", file=sys.stderr)
+    set_structures(conn, labels)
+    return len(labels)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Tag nodes with pawn structure labels")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Tag every untagged node by walking the tree, inheriting labels across non-pawn moves",
+    )
+    args = parser.parse_args()
+
     with get_connection() as conn:
-        leaves = get_leaf_nodes(conn, limit=None)
-        # Re-fetch: get_leaf_nodes filters stockfish_eval IS NULL; we want all leaves
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT node_id, fen FROM opening_nodes n
-                WHERE NOT EXISTS (SELECT 1 FROM node_children WHERE parent_id = n.node_id)
-                AND n.resulting_structure IS NULL
-                """
+        if args.incremental:
+            nodes, edges = load_tag_graph(conn)
+            labels, stats = tag_incrementally(nodes, edges)
+            set_structures(conn, list(labels.items()))
+            conn.commit()
+            print(
+                f"Tagged {len(labels)} of {len(nodes)} nodes: {stats['inherited']} inherited, "
+                f"{stats['captures']} from captures, {stats['parsed']} parsed from FEN."
             )
-            rows = cur.fetchall()
-
-        tagged = 0
-        for node_id, fen in rows:
-            try:
-                board = chess.Board(fen)
-                label = classify_structure(board)
-                update_node(conn, node_id, resulting_structure=label)
-                tagged += 1
-            except Exception as e:
-                print(f"Error tagging {fen[:50]}: {e}", file=sys.stderr)
-        conn.commit()
-        print(f"Tagged {tagged} terminal nodes.")
+        else:
+            tagged = tag_leaves(conn)
+            conn.commit()
+            print(f"Tagged {tagged} terminal nodes.")
+        print(format_cache_stats(pawn_cache.stats()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+"""Tests for annotation_scheduler.py"""
+
+import sys
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import chess
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from annotation_scheduler import deepening_priority, schedule_annotations, threshold_closeness
+from models import OpeningNode, PositionEval
+from positions import position_key
+from stockfish_annotator import node_position_key
+
+
+def _two_ply_fens():
+    board = chess.Board()
+    for first in list(board.legal_moves):
+        board.push(first)
+        for second in list(board.legal_moves):
+            board.push(second)
+            yield board.fen()
+            board.pop()
+        board.pop()
+
+
+FENS = _two_ply_fens()  # a distinct position per node, so each has its own eval
+
+
+def make_node(**kwargs) -> OpeningNode:
+    defaults = dict(node_id=uuid.uuid4(), fen=next(FENS), side="W", is_branching_node=True, game_count=100)
+    defaults.update(kwargs)
+    return OpeningNode(**defaults)
+
+
+def test_threshold_closeness_peaks_at_thresholds_from_movers_view():
+    assert threshold_closeness(-50, "W") == 1.0
+    assert threshold_closeness(150, "B") == 1.0
+    assert threshold_closeness(-100, "W") < threshold_closeness(-60, "W")
+    assert threshold_closeness(300, "W") < threshold_closeness(0, "W")
+
+
+def test_priority_prefers_popular_branching_near_threshold_and_shallow():
+    node = make_node(game_count=10000)
+    assert deepening_priority(node, -45, 12) > deepening_priority(node, 200, 12)
+    assert deepening_priority(node, -45, 12) > deepening_priority(make_node(game_count=10), -45, 12)
+    assert deepening_priority(node, -45, 12) > deepening_priority(make_node(game_count=10000, is_branching_node=False), -45, 12)
+    assert deepening_priority(node, -45, 12) > deepening_priority(node, -45, 20)
+
+
+@contextmanager
+def _patched(branching, leaves, evals, cache=None):
+    """
+    Run schedule_annotations against fakes: evals maps node_id -> White-POV cp for
+    search_position, cache stands in for position_evals, and written annotations
+    update the nodes so iter_leaf_nodes sees them on a later run.
+    Yields (searches, write mock); searches lists (node_id, depth) per engine search.
+    """
+    cache = {} if cache is None else cache
+    by_id = {node.node_id: node for node in list(branching) + list(leaves)}
+    by_key = {node_position_key(node): node.node_id for node in by_id.values()}
+    searches = []
+
+    def search_position(engine, board, depth, multipv=1):
+        node_id = by_key[position_key(board)]
+        searches.append((node_id, depth))
+        return PositionEval(position_key=position_key(board), depth=depth, score_cp=evals[node_id])
+
+    def get_cached_eval(conn, key, min_depth=0, min_multipv=1):
+        ev = cache.get(key)
+        return ev if ev is not None and ev.depth >= min_depth else None
+
+    def store_evals(conn, evs):
+        cache.update((ev.position_key, ev) for ev in evs)
+
+    def write_annotations(conn, annotations):
+        for node_id, annotation in annotations:
+            by_id[node_id].stockfish_eval = annotation["stockfish_eval"]
+            by_id[node_id].stockfish_depth = annotation["stockfish_depth"]
+
+    def iter_leaf_nodes(conn, limit=None, *, below_depth=None, **kwargs):
+        return iter([leaf for leaf in leaves if (leaf.stockfish_depth or 0) < below_depth])
+
+    with patch("annotation_scheduler.iter_nodes", return_value=iter(branching)), \
+         patch("annotation_scheduler.iter_leaf_nodes", side_effect=iter_leaf_nodes), \
+         patch("annotation_scheduler.search_position", side_effect=search_position), \
+         patch("annotation_scheduler.get_cached_eval", side_effect=get_cached_eval), \
+         patch("annotation_scheduler.store_evals", side_effect=store_evals), \
+         patch("annotation_scheduler.write_annotations", side_effect=write_annotations) as write:
+        yield searches, write
+
+
+def test_sweeps_every_node_before_deepening_by_priority():
+    critical = make_node(game_count=5000)   # eval right at the dubious line
+    quiet = make_node(game_count=5000)      # clearly fine for the mover
+    leaf = make_node(is_branching_node=False, game_count=5000)
+    evals = {critical.node_id: -48.0, quiet.node_id: 20.0, leaf.node_id: 0.0}
+    conn = MagicMock()
+
+    with _patched([critical, quiet], [leaf], evals) as (calls, write):
+        stats = schedule_annotations(conn, MagicMock(), sweep_depth=10, step=4, max_searches=5)
+
+    assert calls[:3] == [(critical.node_id, 10), (quiet.node_id, 10), (leaf.node_id, 10)]
+    assert calls[3] == (critical.node_id, 14)
+    assert stats == {"swept": 3, "deepened": 2, "searches": 5}
+    assert sum(len(c.args[1]) for c in write.call_args_list) == 5
+    assert conn.commit.called
+
+
+def test_deepening_stops_at_each_nodes_cap():
+    leaf = make_node(is_branching_node=False)  # target_depth 18
+
+    with _patched([], [leaf], {leaf.node_id: -50.0}) as (calls, _):
+        stats = schedule_annotations(MagicMock(), MagicMock(), sweep_depth=12, step=4)
+
+    assert [d for _, d in calls] == [12, 16, 18]
+    assert stats["deepened"] == 2
+
+
+def test_already_swept_nodes_are_not_searched_again_in_the_sweep():
+    node = make_node(stockfish_eval=-55.0, stockfish_depth=14)
+
+    with _patched([node], [], {node.node_id: -55.0}) as (calls, _):
+        stats = schedule_annotations(MagicMock(), MagicMock(), sweep_depth=12, step=4, max_searches=1)
+
+    assert calls == [(node.node_id, 18)]
+    assert stats["swept"] == 0
+
+
+def test_leaves_swept_by_a_capped_run_are_deepened_by_the_next():
+    leaves = [make_node(is_branching_node=False, game_count=100 - i) for i in range(3)]
+    evals = {leaf.node_id: -50.0 for leaf in leaves}
+    cache = {}
+
+    with _patched([], leaves, evals, cache) as (calls, _):
+        first = schedule_annotations(MagicMock(), MagicMock(), sweep_depth=12, step=4, max_searches=3)
+    assert first == {"swept": 3, "deepened": 0, "searches": 3}
+    assert all(leaf.stockfish_depth == 12 for leaf in leaves)
+
+    with _patched([], leaves, evals, cache) as (calls, _):
+        second = schedule_annotations(MagicMock(), MagicMock(), sweep_depth=12, step=4, max_searches=3)
+    assert second == {"swept": 0, "deepened": 3, "searches": 3}
+    assert sorted(calls) == sorted((leaf.node_id, 16) for leaf in leaves)
+    assert all(leaf.stockfish_depth == 16 for leaf in leaves)
+
+
+def test_cache_hits_do_not_count_toward_max_searches():
+    cached = make_node(is_branching_node=False, game_count=200)
+    fresh = make_node(is_branching_node=False, game_count=100)
+    cache = {node_position_key(cached): PositionEval(node_position_key(cached), depth=20, score_cp=10.0)}
+
+    with _patched([], [cached, fresh], {cached.node_id: 10.0, fresh.node_id: 0.0}, cache) as (calls, _):
+        stats = schedule_annotations(MagicMock(), MagicMock(), sweep_depth=12, step=4, max_searches=1)
+
+    assert calls == [(fresh.node_id, 12)]
+    assert stats == {"swept": 2, "deepened": 0, "searches": 1}
+    assert cached.stockfish_depth == 20
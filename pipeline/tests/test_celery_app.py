@@ -0,0 +1,70 @@
+"""Tests for celery_app.py"""
+
+import sys
+import uuid
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import celery_app
+from models import OpeningNode
+
+
+def test_annotate_nodes_task_reuses_worker_engine_and_commits_once():
+    nodes = [
+        OpeningNode(node_id=uuid.uuid4(), fen="fen-a", is_branching_node=True, game_count=10),
+        OpeningNode(node_id=uuid.uuid4(), fen="fen-b", is_branching_node=True, stockfish_eval=5.0),
+        OpeningNode(node_id=uuid.uuid4(), fen="fen-c", is_branching_node=False),
+    ]
+    conn = MagicMock()
+    conn.__enter__ = MagicMock(return_value=conn)
+    conn.__exit__ = MagicMock(return_value=False)
+    engine = MagicMock()
+    annotation = {"stockfish_eval": 10.0, "stockfish_depth": 22}
+
+    with patch("celery_app._engine", engine), \
+         patch("db.get_connection", return_value=conn), \
+         patch("db.get_nodes_by_ids", return_value=nodes) as get_nodes, \
+         patch("stockfish_annotator.analyse_node", return_value=annotation) as analyse, \
+         patch("stockfish_annotator.write_annotation") as write:
+        result = celery_app.annotate_nodes_task.apply(args=([str(n.node_id) for n in nodes],)).get()
+
+    assert result == 2
+    get_nodes.assert_called_once_with(conn, [n.node_id for n in nodes])
+    assert [c.args[0] for c in analyse.call_args_list] == [engine, engine]
+    assert [c.args[2] for c in analyse.call_args_list] == [22, 18]
+    assert write.call_count == 2
+    conn.commit.assert_called_once()
+
+
+def test_annotate_node_task_delegates_with_depth_and_ignores_engine_path():
+    node_id = str(uuid.uuid4())
+    with patch("celery_app.annotate_nodes_task", return_value=1) as batch:
+        assert celery_app.annotate_node_task.apply(args=(node_id,), kwargs={"depth": 30}).get() == 1
+        with pytest.warns(DeprecationWarning, match="stockfish_path"):
+            assert celery_app.annotate_node_task.apply(args=(node_id, "/usr/bin/stockfish", 22)).get() == 1
+
+    assert batch.call_args_list[0].args == ([node_id], 30)
+    assert batch.call_args_list[1].args == ([node_id], 22)
+
+
+def test_engine_errors_go_to_stderr(capsys):
+    import chess.engine
+
+    node = OpeningNode(node_id=uuid.uuid4(), fen="fen-a", is_branching_node=True)
+    conn = MagicMock()
+    conn.__enter__ = MagicMock(return_value=conn)
+    conn.__exit__ = MagicMock(return_value=False)
+
+    with patch("celery_app._engine", MagicMock()), \
+         patch("db.get_connection", return_value=conn), \
+         patch("db.get_nodes_by_ids", return_value=[node]), \
+         patch("stockfish_annotator.analyse_node", side_effect=chess.engine.EngineError("crashed")):
+        assert celery_app.annotate_nodes_task.apply(args=([str(node.node_id)],)).get() == 0
+
+    out, err = capsys.readouterr()
+    assert out == ""
+    assert "Engine error" in err
@@ -0,0 +1,440 @@
+"""Tests for db.py"""
+
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import psycopg
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db
+
+
+def test_get_connection_checks_out_from_pool():
+    """get_connection() yields a pooled connection instead of dialing a new one."""
+    pooled_conn = MagicMock()
+    pool = MagicMock()
+    pool.connection.return_value.__enter__ = MagicMock(return_value=pooled_conn)
+    pool.connection.return_value.__exit__ = MagicMock(return_value=False)
+
+    with patch("db.get_pool", return_value=pool), patch("db.psycopg.connect") as mock_connect:
+        with db.get_connection() as conn:
+            assert conn is pooled_conn
+
+    pool.connection.assert_called_once()
+    mock_connect.assert_not_called()
+
+
+def test_get_pool_is_created_once_with_health_check():
+    created = []
+
+    class FakePool:
+        check_connection = staticmethod(lambda conn: None)
+
+        def __init__(self, conninfo, **kwargs):
+            self.kwargs = kwargs
+            created.append(self)
+
+    with patch("db.ConnectionPool", FakePool), patch("db._pool", None):
+        first = db.get_pool()
+        second = db.get_pool()
+
+    assert first is second
+    assert len(created) == 1
+    assert created[0].kwargs["check"] is FakePool.check_connection
+    assert created[0].kwargs["max_size"] >= created[0].kwargs["min_size"]
+
+
+def test_pool_stats_reports_size_wait_and_checkouts():
+    pool = MagicMock()
+    pool.get_stats.return_value = {
+        "pool_min": 1,
+        "pool_max": 10,
+        "pool_size": 4,
+        "pool_available": 3,
+        "requests_num": 20,
+        "requests_wait_ms": 100,
+        "requests_waiting": 0,
+    }
+
+    with patch("db._pool", pool), patch("db._async_pool", None):
+        stats = db.pool_stats()
+
+    assert set(stats) == {"sync"}
+    assert stats["sync"]["size"] == 4
+    assert stats["sync"]["checkouts"] == 20
+    assert stats["sync"]["wait_ms_avg"] == 5.0
+
+
+def _mock_conn_with_cursor():
+    conn = MagicMock()
+    cur = MagicMock()
+    conn.cursor.return_value.__enter__ = MagicMock(return_value=cur)
+    conn.cursor.return_value.__exit__ = MagicMock(return_value=False)
+    return conn, cur
+
+
+def test_upsert_nodes_copies_batch_and_merges_once():
+    import uuid
+    from models import OpeningNode
+
+    nodes = [OpeningNode(fen=f"fen-{i}", pgn_move="e4", game_count=i, position_key=i) for i in range(500)]
+    conn, cur = _mock_conn_with_cursor()
+    copy = MagicMock()
+    cur.copy.return_value.__enter__ = MagicMock(return_value=copy)
+    cur.copy.return_value.__exit__ = MagicMock(return_value=False)
+    ids = {n.fen: uuid.uuid4() for n in nodes}
+    cur.fetchall.return_value = list(ids.items())
+
+    result = db.upsert_nodes(conn, nodes)
+
+    assert result == ids
+    assert copy.write_row.call_count == 500
+    # create staging table, truncate, merge — independent of batch size
+    assert cur.execute.call_count == 3
+    merge_sql = cur.execute.call_args_list[-1][0][0]
+    assert "ON CONFLICT (fen)" in merge_sql
+    assert "DISTINCT ON (fen)" in merge_sql
+    assert "GREATEST(opening_nodes.game_count" in merge_sql
+
+
+def test_node_write_values_derive_position_key_from_fen():
+    import chess
+    from models import OpeningNode
+    from positions import position_key
+
+    board = chess.Board()
+    board.push_san("e4")
+    values = db._node_write_values(OpeningNode(fen=board.fen(), pgn_move="e4"))
+
+    assert values[db._NODE_WRITE_COLUMNS.index("position_key")] == position_key(board)
+
+
+def test_node_write_values_derive_pawn_bitboards_from_fen():
+    import chess
+    from models import OpeningNode
+
+    board = chess.Board("rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq c6 0 2")
+
+    values = db._node_write_values(OpeningNode(fen=board.fen(), pgn_move="c5"))
+
+    assert values[db._NODE_WRITE_COLUMNS.index("white_pawns")] == board.pieces_mask(chess.PAWN, chess.WHITE)
+    assert values[db._NODE_WRITE_COLUMNS.index("black_pawns")] == board.pieces_mask(chess.PAWN, chess.BLACK)
+
+
+def test_get_nodes_by_position_keys_keeps_most_played():
+    conn, cur = _mock_conn_with_cursor()
+    cur.fetchall.return_value = []
+
+    assert db.get_nodes_by_position_keys(conn, [1, 2]) == {}
+    sql, params = cur.execute.call_args[0]
+    assert "DISTINCT ON (position_key)" in sql
+    assert "game_count DESC" in sql
+    assert params == ([1, 2],)
+
+
+def test_upsert_nodes_empty_batch_skips_database():
+    conn = MagicMock()
+    assert db.upsert_nodes(conn, []) == {}
+    conn.cursor.assert_not_called()
+
+
+def test_get_subtree_groups_rows_by_parent():
+    import uuid
+
+    root, a, b = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    def row(parent, sort_order, node_id, san, games):
+        return (parent, sort_order, node_id, f"fen-{san}", san, 1, "W", "C50", "Italian Game",
+                None, parent, False, False, None, None, None, False, False, None, games, None, None, None)
+
+    conn, cur = _mock_conn_with_cursor()
+    cur.fetchall.return_value = [
+        row(None, 0, root, "e4", 1000),
+        row(root, 1, b, "c5", 300),
+        row(root, 0, a, "e5", 600),
+    ]
+
+    nodes, children = db.get_subtree(conn, root, max_depth=15, min_games=50)
+
+    assert cur.execute.call_count == 1
+    assert "WITH RECURSIVE" in cur.execute.call_args[0][0]
+    assert set(nodes) == {root, a, b}
+    assert nodes[a].pgn_move == "e5"
+    assert children == {root: [(a, 0), (b, 1)]}
+
+
+def test_stream_query_uses_named_cursor_with_itersize():
+    conn, cur = _mock_conn_with_cursor()
+    cur.__iter__ = MagicMock(return_value=iter([(1,), (2,)]))
+
+    rows = db.stream_query(conn, "SELECT 1", itersize=500, withhold=True)
+    conn.cursor.assert_not_called()  # lazy until iterated
+    assert list(rows) == [(1,), (2,)]
+
+    kwargs = conn.cursor.call_args.kwargs
+    assert kwargs["name"].startswith("stream_")
+    assert kwargs["withhold"] is True
+    assert cur.itersize == 500
+    cur.fetchall.assert_not_called()
+
+
+def test_iter_nodes_yields_opening_nodes():
+    import uuid
+
+    node_id = uuid.uuid4()
+    row = (node_id, "fen", "e4", 1, "W", None, None, None, None, True, False,
+           None, None, None, False, False, None, None, None, None, None)
+    def fake_stream(conn, sql, params, **kwargs):
+        make_row = kwargs["row_factory"](None)
+        return iter([make_row(row)])
+
+    with patch("db.stream_query", side_effect=fake_stream) as mock_stream:
+        nodes = list(db.iter_nodes(MagicMock(), is_branching=True, itersize=10))
+
+    assert mock_stream.call_args.kwargs["itersize"] == 10
+    assert nodes[0].node_id == node_id
+    assert nodes[0].eco_code == ""
+    assert nodes[0].game_count == 0
+
+
+def test_node_columns_match_row_mapper():
+    import uuid
+
+    row = tuple(range(len(db.NODE_COLUMNS)))
+    node = db.node_from_row(("parent", 0) + row, 2)
+    for i, column in enumerate(db.NODE_COLUMNS):
+        assert getattr(node, column) == i
+    assert db.node_columns("n").startswith("n.node_id, n.fen")
+
+
+def test_opening_node_is_slotted_with_lazy_lists():
+    from models import OpeningNode
+
+    node = OpeningNode(fen="x")
+    assert not hasattr(node, "__dict__")
+    assert node._child_node_ids is None and node._transposition_ids is None
+    node.child_node_ids.append("child")
+    assert node.child_node_ids == ["child"]
+    assert node == OpeningNode(fen="x")  # lazy lists do not take part in equality
+
+
+def test_enqueue_annotation_jobs_is_idempotent_insert():
+    import uuid
+
+    conn, cur = _mock_conn_with_cursor()
+    cur.rowcount = 2
+    jobs = [(uuid.uuid4(), 500, 22), (uuid.uuid4(), 5000, 26)]
+
+    assert db.enqueue_annotation_jobs(conn, jobs) == 2
+    sql, params = cur.execute.call_args[0]
+    assert "ON CONFLICT (node_id, target_depth) DO NOTHING" in sql
+    assert params == ([j[0] for j in jobs], [500, 5000], [22, 26])
+    assert db.enqueue_annotation_jobs(conn, []) == 0
+
+
+def test_claim_annotation_jobs_skips_locked_and_reclaims_expired_leases():
+    import uuid
+
+    conn, cur = _mock_conn_with_cursor()
+    node_id = uuid.uuid4()
+    row = (26, node_id, "fen", "e4", 1, "W", None, None, None, None, True, False,
+           None, None, None, False, False, None, 5000, None, None, None)
+    cur.fetchall.return_value = [row]
+
+    jobs = db.claim_annotation_jobs(conn, "host:1", batch_size=10, lease_seconds=60)
+
+    sql, params = cur.execute.call_args[0]
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert "leased_until < NOW()" in sql
+    assert "ORDER BY priority DESC" in sql
+    assert params["batch_size"] == 10 and params["worker"] == "host:1"
+    (node, depth), = jobs
+    assert node.node_id == node_id and node.game_count == 5000
+    assert depth == 26
+
+
+def test_claim_annotation_jobs_fails_expired_jobs_with_no_attempts_left():
+    conn, cur = _mock_conn_with_cursor()
+    cur.fetchall.return_value = []
+
+    db.claim_annotation_jobs(conn, "host:1", batch_size=10, lease_seconds=60, max_attempts=3)
+
+    sql, params = cur.execute.call_args[0]
+    expired, claim = sql.split("UPDATE annotation_jobs j SET")
+    assert "status = 'failed'" in expired
+    assert "status = 'running' AND leased_until < NOW() AND attempts >= %(max_attempts)s" in expired
+    assert "attempts < %(max_attempts)s" in claim
+    assert params["max_attempts"] == 3
+    cur.execute.assert_called_once()
+
+
+def test_settling_annotation_jobs_requires_the_workers_live_lease():
+    import uuid
+
+    conn, cur = _mock_conn_with_cursor()
+    node_id = uuid.uuid4()
+    cur.rowcount = 1
+
+    assert db.complete_annotation_jobs(conn, "host:1", [(node_id, 22)]) == 1
+    sql, params = cur.executemany.call_args[0]
+    assert params == [(node_id, 22, "host:1")]
+    assert db.fail_annotation_job(conn, "host:1", node_id, 22, "no score") is True
+    assert db.release_annotation_job(conn, "host:1", node_id, 22, "engine died") is True
+    for settle_sql in [sql] + [c.args[0] for c in cur.execute.call_args_list]:
+        assert "worker = %s AND status = 'running' AND leased_until > NOW()" in settle_sql
+    assert "attempts = GREATEST(attempts - 1, 0)" in cur.execute.call_args[0][0]
+
+    cur.rowcount = 0
+    assert db.fail_annotation_job(conn, "host:2", node_id, 22, "no score") is False
+    assert db.complete_annotation_jobs(conn, "host:1", []) == 0
+
+
+@pytest.mark.integration
+def test_expired_lease_is_reclaimed_and_only_the_new_holder_settles_it():
+    import uuid
+
+    from models import OpeningNode
+
+    try:
+        conn = psycopg.connect(db.get_connection_string())
+    except psycopg.OperationalError:
+        pytest.skip("No database at DATABASE_URL")
+    with conn:
+        node_id = db.upsert_nodes(conn, [OpeningNode(fen=f"lease-test {uuid.uuid4()}", side="W")]).popitem()[1]
+        try:
+            db.enqueue_annotation_jobs(conn, [(node_id, 1 << 30, 22)])  # top priority, claimed first
+            conn.commit()
+
+            (node, depth), = db.claim_annotation_jobs(conn, "first", batch_size=1, lease_seconds=60)
+            conn.commit()
+            assert (node.node_id, depth) == (node_id, 22)
+            assert node_id not in [n.node_id for n, _ in db.claim_annotation_jobs(conn, "second", 1, 60)]
+            conn.rollback()
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE annotation_jobs SET leased_until = NOW() - interval '1 second' WHERE node_id = %s",
+                    (node_id,),
+                )
+            conn.commit()
+            (node, _), = db.claim_annotation_jobs(conn, "second", batch_size=1, lease_seconds=60)
+            conn.commit()
+            assert node.node_id == node_id
+
+            assert db.complete_annotation_jobs(conn, "first", [(node_id, 22)]) == 0
+            assert db.fail_annotation_job(conn, "first", node_id, 22, "stale") is False
+            assert db.complete_annotation_jobs(conn, "second", [(node_id, 22)]) == 1
+            conn.commit()
+            with conn.cursor() as cur:
+                cur.execute("SELECT status, attempts, worker FROM annotation_jobs WHERE node_id = %s", (node_id,))
+                assert cur.fetchone() == ("done", 2, "second")
+        finally:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM opening_nodes WHERE node_id = %s", (node_id,))
+            conn.commit()
+
+
+def test_get_cached_evals_filters_by_depth():
+    conn, cur = _mock_conn_with_cursor()
+    cur.fetchall.return_value = [(42, 26, 31.0, ["e2e4"], [])]
+
+    evals = db.get_cached_evals(conn, [42, 43], min_depth=22)
+
+    sql, params = cur.execute.call_args[0]
+    assert "depth >= %s" in sql
+    assert params[:2] == ([42, 43], 22)
+    assert evals[42].depth == 26 and evals[42].best_move == "e2e4"
+
+
+def test_store_evals_only_replaces_with_deeper_results():
+    from models import PositionEval
+
+    conn, cur = _mock_conn_with_cursor()
+    db.store_evals(conn, [PositionEval(position_key=42, depth=20, score_cp=10.0, pv=["d2d4"])])
+
+    sql, rows = cur.executemany.call_args[0]
+    assert "ON CONFLICT (position_key)" in sql
+    assert "WHERE EXCLUDED.depth > position_evals.depth" in sql
+    assert rows[0][:4] == (42, 20, 10.0, ["d2d4"])
+
+
+def test_set_minimax_evals_copies_then_updates_once():
+    conn, cur = _mock_conn_with_cursor()
+    copy = MagicMock()
+    cur.copy.return_value.__enter__ = MagicMock(return_value=copy)
+    cur.copy.return_value.__exit__ = MagicMock(return_value=False)
+
+    db.set_minimax_evals(conn, [("id1", 12.0, False), ("id2", None, False)])
+
+    assert copy.write_row.call_count == 2
+    assert cur.execute.call_count == 3
+    assert "FROM minimax_stage" in cur.execute.call_args[0][0]
+
+
+def test_set_structures_copies_then_updates_once():
+    conn, cur = _mock_conn_with_cursor()
+    copy = MagicMock()
+    cur.copy.return_value.__enter__ = MagicMock(return_value=copy)
+    cur.copy.return_value.__exit__ = MagicMock(return_value=False)
+
+    db.set_structures(conn, [("id1", "Carlsbad"), ("id2", "Unknown")])
+
+    assert copy.write_row.call_count == 2
+    assert "FROM structure_stage" in cur.execute.call_args[0][0]
+
+
+def test_set_node_stats_sets_all_three_columns_plainly():
+    conn, cur = _mock_conn_with_cursor()
+    copy = MagicMock()
+    cur.copy.return_value.__enter__ = MagicMock(return_value=copy)
+    cur.copy.return_value.__exit__ = MagicMock(return_value=False)
+
+    db.set_node_stats(conn, [("id1", 40, 50.0, 25.0)])
+
+    copy.write_row.assert_called_once_with(("id1", 40, 50.0, 25.0))
+    sql = cur.execute.call_args[0][0]
+    assert "FROM node_stats_stage" in sql
+    assert "game_count = s.game_count" in sql and "GREATEST" not in sql
+
+
+def test_upsert_transpositions_orders_pairs_and_drops_self_links():
+    import uuid
+
+    conn, cur = _mock_conn_with_cursor()
+    a, b = sorted([uuid.uuid4(), uuid.uuid4()])
+
+    db.upsert_transpositions(conn, [(b, a), (a, b), (a, a)])
+
+    assert cur.executemany.call_args[0][1] == [(a, b)]
+
+
+def test_iter_position_keys_streams_sorted_distinct_keys():
+    with patch("db.stream_query", return_value=iter([(-5,), (3,)])) as mock_stream:
+        keys = list(db.iter_position_keys(MagicMock()))
+
+    assert keys == [-5, 3]
+    sql = mock_stream.call_args[0][1]
+    assert "DISTINCT position_key" in sql and "ORDER BY position_key" in sql
+
+
+def test_iter_leaf_nodes_selects_by_depth_when_below_depth_given():
+    with patch("db.stream_query", return_value=iter([])) as mock_stream:
+        list(db.iter_leaf_nodes(MagicMock()))
+        list(db.iter_leaf_nodes(MagicMock(), below_depth=18))
+
+    (unevaluated, no_params), (shallow, params) = [c.args[1:3] for c in mock_stream.call_args_list]
+    assert "stockfish_eval IS NULL" in unevaluated and no_params is None
+    assert "COALESCE(n.stockfish_depth, 0) < %s" in shallow and "stockfish_eval IS NULL" not in shallow
+    assert params == (18,)
+
+
+def test_get_max_ply_counts_half_moves_from_side_and_move_number():
+    conn, cur = _mock_conn_with_cursor()
+    cur.fetchone.return_value = (15,)
+
+    assert db.get_max_ply(conn) == 15
+    assert "2 * move_number - 1" in cur.execute.call_args[0][0]
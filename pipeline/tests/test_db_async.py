@@ -0,0 +1,96 @@
+"""Tests for db_async.py"""
+
+import sys
+import uuid
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db
+import db_async
+
+
+def _mock_async_conn_with_cursor():
+    """Async connection whose cursor() works as `async with conn.cursor(...) as cur`."""
+    cur = MagicMock()
+    cur.execute = AsyncMock()
+    cur.fetchone = AsyncMock()
+    cur.fetchall = AsyncMock(return_value=[])
+    conn = MagicMock()
+    conn.cursor.return_value.__aenter__.return_value = cur
+    conn.cursor.return_value.__aexit__.return_value = False
+    return conn, cur
+
+
+@pytest.mark.asyncio
+async def test_get_async_connection_checks_out_from_async_pool():
+    pooled_conn = MagicMock()
+    pool = MagicMock()
+    pool.connection.return_value.__aenter__.return_value = pooled_conn
+    pool.connection.return_value.__aexit__.return_value = False
+
+    with patch("db.get_async_pool", AsyncMock(return_value=pool)):
+        async with db_async.get_connection() as conn:
+            assert conn is pooled_conn
+
+    pool.connection.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_node_by_fen_uses_node_row_factory():
+    conn, cur = _mock_async_conn_with_cursor()
+    sentinel = object()
+    cur.fetchone.return_value = sentinel
+
+    node = await db_async.get_node_by_fen(conn, "some fen")
+
+    assert node is sentinel
+    conn.cursor.assert_called_once_with(row_factory=db.node_row)
+    sql, params = cur.execute.call_args[0]
+    assert "WHERE fen = %s" in sql
+    assert params == ("some fen",)
+
+
+@pytest.mark.asyncio
+async def test_get_child_summaries_is_one_query():
+    conn, cur = _mock_async_conn_with_cursor()
+    child_id = uuid.uuid4()
+    cur.fetchall.return_value = [(child_id, "Nf3", None)]
+
+    children = await db_async.get_child_summaries(conn, uuid.uuid4())
+
+    assert children == [(child_id, "Nf3", 0)]
+    cur.execute.assert_awaited_once()
+    assert cur.execute.call_args[0][0] is db._CHILD_SUMMARY_SQL
+
+
+@pytest.mark.asyncio
+async def test_get_subtree_shares_sync_sql_and_grouping():
+    conn, cur = _mock_async_conn_with_cursor()
+    root_id = uuid.uuid4()
+
+    with patch("db_async._subtree_from_rows", return_value=({}, {})) as mock_group:
+        result = await db_async.get_subtree(conn, root_id, 5, 100)
+
+    assert result == ({}, {})
+    sql, params = cur.execute.call_args[0]
+    assert sql is db._SUBTREE_SQL
+    assert params == {"root_id": root_id, "max_depth": 5, "min_games": 100}
+    mock_group.assert_called_once_with(cur.fetchall.return_value)
+
+
+@pytest.mark.asyncio
+async def test_get_structure_openings_looks_up_generated_label():
+    conn, cur = _mock_async_conn_with_cursor()
+    cur.fetchall.return_value = [("D30", "Queen's Gambit Declined")]
+
+    rows = await db_async.get_structure_openings(conn, "carlsbad")
+
+    assert rows == [("D30", "Queen's Gambit Declined")]
+    sql, params = cur.execute.call_args[0]
+    assert "pawn_structure = ANY(%s)" in sql
+    assert "&" not in sql
+    assert params == (["Carlsbad"],)
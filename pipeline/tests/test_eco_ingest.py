@@ -46,3 +46,28 @@ def test_eco_ingest_creates_nodes_in_db(tmp_path):
         n, e = ingest_eco(conn, tmp_path)
         assert n >= 1
         assert e >= 1
+
+
+def test_ingest_eco_writes_nodes_and_entries_in_bulk(tmp_path):
+    """All TSV rows go through a single upsert_nodes and a single upsert_entries call."""
+    import uuid
+    from unittest.mock import MagicMock, patch
+    from eco_ingest import ingest_eco
+
+    tsv = tmp_path / "c.tsv"
+    tsv.write_text(
+        "eco\tname\tpgn\n"
+        "C50\tItalian Game\t1. e4 e5 2. Nf3 Nc6 3. Bc4\n"
+        "C60\tRuy Lopez\t1. e4 e5 2. Nf3 Nc6 3. Bb5\n"
+    )
+
+    with patch("eco_ingest.upsert_nodes", side_effect=lambda conn, nodes: {n.fen: uuid.uuid4() for n in nodes}) as mock_nodes, \
+         patch("eco_ingest.upsert_entries") as mock_entries:
+        n, e = ingest_eco(MagicMock(), tmp_path)
+
+    assert (n, e) == (2, 2)
+    assert mock_nodes.call_count == 1
+    assert mock_entries.call_count == 1
+    entries = mock_entries.call_args[0][1]
+    assert {entry.name for entry in entries} == {"Italian Game", "Ruy Lopez"}
+    assert all(entry.root_node_id is not None for entry in entries)
@@ -12,7 +12,7 @@ import pytest
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from models import OpeningNode
-from export import node_to_openingiq, export_json, export_csv, export_pgn
+from export import node_to_openingiq, export_json, export_csv, export_pgn, export_polyglot
 
 
 def make_node(**kwargs) -> OpeningNode:
@@ -150,3 +150,91 @@ def test_pgn_export_contains_eval_annotations(tmp_path):
     assert len(pgn_files) == 1
     content = pgn_files[0].read_text()
     assert "%eval" in content
+
+
+def _legacy_build_tree(nodes, children, node_id, max_depth, current_depth, min_games):
+    """Reference: the per-node query algorithm build_tree used before get_subtree."""
+    node = nodes.get(node_id)
+    if node is None:
+        return None
+    children_data = [
+        {"san": nodes[cid].pgn_move, "game_count": nodes[cid].game_count or 0, "child_id": cid}
+        for cid, _ in sorted(children.get(node_id, []), key=lambda p: p[1])
+    ]
+    children_data = [c for c in children_data if c["game_count"] >= min_games]
+    children_data.sort(key=lambda x: -x["game_count"])
+    out = node_to_openingiq(node, children_data)
+    if current_depth < max_depth and children_data:
+        out["children"] = []
+        for c in children_data:
+            sub = _legacy_build_tree(nodes, children, c["child_id"], max_depth, current_depth + 1, min_games)
+            if sub:
+                out["children"].append(sub)
+    return out
+
+
+def test_assemble_tree_matches_per_node_build():
+    """In-memory assembly yields exactly the dict the per-node queries produced."""
+    import random
+    from export import assemble_tree
+
+    rng = random.Random(7)
+    ids = [uuid.uuid4() for _ in range(120)]
+    nodes = {
+        nid: make_node(node_id=nid, pgn_move=f"m{i}", fen=f"fen-{i}", game_count=rng.choice([0, 10, 60, 60, 500]))
+        for i, nid in enumerate(ids)
+    }
+    children = {}
+    for i, nid in enumerate(ids[1:], start=1):
+        # mostly a tree, with some transpositions (second parents)
+        for parent in {ids[rng.randrange(0, i)], ids[rng.randrange(0, i)]}:
+            children.setdefault(parent, []).append((nid, rng.randrange(0, 4)))
+    for pairs in children.values():
+        pairs.sort(key=lambda p: p[1])  # get_subtree returns children ordered by sort_order
+
+    for max_depth in (0, 2, 15):
+        expected = _legacy_build_tree(nodes, children, ids[0], max_depth, 0, 50)
+        assert assemble_tree(nodes, children, ids[0], max_depth, 0, 50) == expected
+
+
+def test_build_tree_fetches_subtree_once():
+    from export import build_tree
+
+    root = make_node()
+    child = make_node(pgn_move="e5", game_count=600)
+    mock_conn = MagicMock()
+    with patch("export.get_subtree", return_value=(
+        {root.node_id: root, child.node_id: child},
+        {root.node_id: [(child.node_id, 0)]},
+    )) as mock_subtree:
+        tree = build_tree(mock_conn, root.node_id, 15, 0, 50)
+
+    mock_subtree.assert_called_once_with(mock_conn, root.node_id, 15, 50)
+    assert tree["engineResponses"] == ["e5"]
+    assert tree["children"][0]["san"] == "e5"
+
+
+def test_polyglot_export_uses_stored_position_key(tmp_path):
+    """Stored signed position_key is written back as the unsigned Polyglot key."""
+    import struct
+
+    import chess.polyglot
+
+    from positions import position_key
+
+    seed = make_node(eco_code="C20", opening_name="King's Pawn Game")
+    board = chess.Board(seed.fen)
+
+    def fake_collect(conn, node_id, current_depth, max_depth, min_games, entries):
+        entries.append((seed.fen, position_key(board), "e5", 65535))
+
+    with patch("export.get_seed_nodes", return_value=[seed]), \
+         patch("export._collect_polyglot_entries", side_effect=fake_collect):
+        n = export_polyglot(MagicMock(), tmp_path, None)
+
+    assert n == 1
+    (book,) = tmp_path.glob("*.bin")
+    key, move_int, weight, _ = struct.unpack(">QHHI", book.read_bytes())
+    assert key == chess.polyglot.zobrist_hash(board)
+    assert move_int == chess.E5 | (chess.E7 << 6)
+    assert weight == 65535
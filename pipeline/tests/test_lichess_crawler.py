@@ -9,6 +9,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from lichess_crawler import lichess_master_moves, expand_tree
+from positions import fen_position_key
 
 
 @pytest.fixture
@@ -27,6 +28,11 @@ def make_move(san: str, white: int, draws: int, black: int) -> dict:
     return {"san": san, "white": white, "draws": draws, "black": black}
 
 
+def fake_upsert_nodes(conn, nodes):
+    import uuid
+    return {n.fen: uuid.uuid4() for n in nodes}
+
+
 @pytest.mark.asyncio
 async def test_crawler_prunes_below_min_game_count(mock_db_conn):
     """Moves with total games below threshold are not added."""
@@ -53,10 +59,10 @@ async def test_crawler_prunes_below_min_game_count(mock_db_conn):
     mock_session.get = AsyncMock(return_value=mock_response)
 
     with patch("lichess_crawler.get_seed_nodes", return_value=[seed]), \
-         patch("lichess_crawler.get_node_by_fen", return_value=None), \
-         patch("lichess_crawler.upsert_node", side_effect=lambda conn, n: n), \
-         patch("lichess_crawler.add_child"), \
-         patch("lichess_crawler.set_branching"), \
+         patch("lichess_crawler.get_nodes_by_position_keys", return_value={}), \
+         patch("lichess_crawler.upsert_nodes", side_effect=fake_upsert_nodes), \
+         patch("lichess_crawler.add_children"), \
+         patch("lichess_crawler.set_branching_nodes"), \
          patch("lichess_crawler.upsert_transposition"):
 
         semaphore = asyncio.Semaphore(1)
@@ -96,10 +102,10 @@ async def test_crawler_respects_depth_limit(mock_db_conn):
 
     with patch("lichess_crawler.lichess_master_moves", side_effect=fake_lichess), \
          patch("lichess_crawler.get_seed_nodes", return_value=[seed]), \
-         patch("lichess_crawler.get_node_by_fen", return_value=None), \
-         patch("lichess_crawler.upsert_node", side_effect=lambda conn, n: n), \
-         patch("lichess_crawler.add_child"), \
-         patch("lichess_crawler.set_branching"), \
+         patch("lichess_crawler.get_nodes_by_position_keys", return_value={}), \
+         patch("lichess_crawler.upsert_nodes", side_effect=fake_upsert_nodes), \
+         patch("lichess_crawler.add_children"), \
+         patch("lichess_crawler.set_branching_nodes"), \
          patch("lichess_crawler.upsert_transposition"):
 
         semaphore = asyncio.Semaphore(1)
@@ -126,22 +132,19 @@ async def test_crawler_records_win_rates(mock_db_conn):
 
     captured_nodes = []
 
-    def capture_upsert(conn, node):
-        if node.pgn_move:
-            captured_nodes.append(node)
-        if not node.node_id:
-            node.node_id = uuid.uuid4()
-        return node
+    def capture_upsert(conn, nodes):
+        captured_nodes.extend(n for n in nodes if n.pgn_move)
+        return fake_upsert_nodes(conn, nodes)
 
     async def fake_lichess(fen, session, token=None):
         return make_lichess_response([make_move("e4", 60, 25, 15)])
 
     with patch("lichess_crawler.lichess_master_moves", side_effect=fake_lichess), \
          patch("lichess_crawler.get_seed_nodes", return_value=[seed]), \
-         patch("lichess_crawler.get_node_by_fen", return_value=None), \
-         patch("lichess_crawler.upsert_node", side_effect=capture_upsert), \
-         patch("lichess_crawler.add_child"), \
-         patch("lichess_crawler.set_branching"), \
+         patch("lichess_crawler.get_nodes_by_position_keys", return_value={}), \
+         patch("lichess_crawler.upsert_nodes", side_effect=capture_upsert), \
+         patch("lichess_crawler.add_children"), \
+         patch("lichess_crawler.set_branching_nodes"), \
          patch("lichess_crawler.upsert_transposition"):
 
         semaphore = asyncio.Semaphore(1)
@@ -181,10 +184,10 @@ async def test_crawler_retries_on_429(mock_db_conn):
 
     with patch("lichess_crawler.lichess_master_moves", side_effect=fake_lichess_with_429), \
          patch("lichess_crawler.get_seed_nodes", return_value=[seed]), \
-         patch("lichess_crawler.get_node_by_fen", return_value=None), \
-         patch("lichess_crawler.upsert_node", side_effect=lambda conn, n: n), \
-         patch("lichess_crawler.add_child"), \
-         patch("lichess_crawler.set_branching"), \
+         patch("lichess_crawler.get_nodes_by_position_keys", return_value={}), \
+         patch("lichess_crawler.upsert_nodes", side_effect=fake_upsert_nodes), \
+         patch("lichess_crawler.add_children"), \
+         patch("lichess_crawler.set_branching_nodes"), \
          patch("lichess_crawler.upsert_transposition"), \
          patch("asyncio.sleep", new_callable=AsyncMock):
 
@@ -213,11 +216,15 @@ async def test_crawler_deduplicates_transposed_positions(mock_db_conn):
         parent_node_id=uuid.uuid4(),
     )
 
+    # Same position as 1.e4 but stored with different move counters: the crawler
+    # must resolve it through position_key rather than the exact FEN.
+    existing_fen = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 4 7"
     existing = OpeningNode(
         node_id=existing_node_id,
-        fen="rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1",
+        fen=existing_fen,
         pgn_move="e4",
         parent_node_id=uuid.uuid4(),
+        position_key=fen_position_key(existing_fen),
     )
 
     transposition_calls = []
@@ -227,10 +234,10 @@ async def test_crawler_deduplicates_transposed_positions(mock_db_conn):
 
     with patch("lichess_crawler.lichess_master_moves", side_effect=fake_lichess), \
          patch("lichess_crawler.get_seed_nodes", return_value=[seed]), \
-         patch("lichess_crawler.get_node_by_fen", return_value=existing), \
-         patch("lichess_crawler.upsert_node"), \
-         patch("lichess_crawler.add_child"), \
-         patch("lichess_crawler.set_branching"), \
+         patch("lichess_crawler.get_nodes_by_position_keys", return_value={existing.position_key: existing}), \
+         patch("lichess_crawler.upsert_nodes", side_effect=fake_upsert_nodes), \
+         patch("lichess_crawler.add_children"), \
+         patch("lichess_crawler.set_branching_nodes"), \
          patch("lichess_crawler.upsert_transposition",
                side_effect=lambda conn, a, b: transposition_calls.append((a, b))):
 
@@ -238,4 +245,46 @@ async def test_crawler_deduplicates_transposed_positions(mock_db_conn):
         await expand_tree(mock_db_conn, AsyncMock(), min_games=50, max_depth=1,
                           token=None, semaphore=semaphore)
 
-        assert len(transposition_calls) == 1
+        assert transposition_calls == [(seed_id, existing_node_id)]
+
+
+@pytest.mark.asyncio
+async def test_crawler_writes_each_level_in_bulk(mock_db_conn):
+    """All children of a level go through one upsert_nodes and one add_children call."""
+    import chess
+    from models import OpeningNode
+    import uuid
+
+    seed = OpeningNode(
+        node_id=uuid.uuid4(),
+        fen=chess.Board().fen(),
+        pgn_move="",
+        eco_code="A00",
+        opening_name="Test",
+    )
+
+    async def fake_lichess(fen, session, token=None):
+        return make_lichess_response([
+            make_move("e4", 60, 25, 15),
+            make_move("d4", 50, 30, 20),
+            make_move("c4", 40, 40, 20),
+        ])
+
+    with patch("lichess_crawler.lichess_master_moves", side_effect=fake_lichess), \
+         patch("lichess_crawler.get_seed_nodes", return_value=[seed]), \
+         patch("lichess_crawler.get_nodes_by_position_keys", return_value={}), \
+         patch("lichess_crawler.upsert_nodes", side_effect=fake_upsert_nodes) as mock_upsert, \
+         patch("lichess_crawler.add_children") as mock_add_children, \
+         patch("lichess_crawler.set_branching_nodes") as mock_branching, \
+         patch("lichess_crawler.upsert_transposition"):
+
+        semaphore = asyncio.Semaphore(1)
+        added = await expand_tree(mock_db_conn, AsyncMock(), min_games=50, max_depth=1,
+                                  token=None, semaphore=semaphore)
+
+    assert added == 3
+    assert mock_upsert.call_count == 1
+    assert len(mock_upsert.call_args[0][1]) == 3
+    assert mock_add_children.call_count == 1
+    assert [e[2] for e in mock_add_children.call_args[0][1]] == [0, 1, 2]
+    mock_branching.assert_called_once_with(mock_db_conn, [seed.node_id])
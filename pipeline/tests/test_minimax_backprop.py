@@ -0,0 +1,73 @@
+"""Tests for minimax_backprop.py"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from minimax_backprop import backpropagate, cyclic_nodes
+
+
+def test_backs_up_max_for_white_and_min_for_black():
+    # root (White to move) -> a, b (Black to move) -> leaves
+    evals = {"root": 10.0, "a": None, "b": None, "a1": 40.0, "a2": -20.0, "b1": 5.0, "b2": 60.0}
+    white_to_move = {"root": True, "a": False, "b": False, "a1": True, "a2": True, "b1": True, "b2": True}
+    edges = [("root", "a"), ("root", "b"), ("a", "a1"), ("a", "a2"), ("b", "b1"), ("b", "b2")]
+
+    result = backpropagate(evals, white_to_move, edges)
+
+    assert result["a"] == (-20.0, False)
+    assert result["b"] == (5.0, False)
+    assert result["root"] == (5.0, False)
+    assert "a1" not in result
+
+
+def test_unvalued_child_leaves_parent_unvalued():
+    evals = {"root": 0.0, "a": 30.0, "b": None}
+    white_to_move = {"root": True, "a": False, "b": False}
+
+    result = backpropagate(evals, white_to_move, [("root", "a"), ("root", "b")])
+
+    assert result["root"] == (None, False)
+
+
+def test_child_falls_back_to_direct_eval_and_disagreement_is_flagged():
+    # "mid" has an unvalued child, so its direct eval stands in for it at the root.
+    evals = {"root": 0.0, "mid": 90.0, "leaf": None, "other": 70.0}
+    white_to_move = {"root": True, "mid": False, "leaf": True, "other": False}
+    edges = [("root", "mid"), ("root", "other"), ("mid", "leaf")]
+
+    result = backpropagate(evals, white_to_move, edges, threshold=50)
+
+    assert result["mid"] == (None, False)
+    assert result["root"] == (90.0, True)
+
+
+def test_transposition_shared_child_is_valued_once():
+    evals = {"p1": None, "p2": None, "t": -15.0}
+    white_to_move = {"p1": False, "p2": True, "t": True}
+
+    result = backpropagate(evals, white_to_move, [("p1", "t"), ("p2", "t")])
+
+    assert result["p1"] == (-15.0, False)
+    assert result["p2"] == (-15.0, False)
+
+
+
+def test_two_cycle_is_unvalued_and_parent_uses_direct_evals():
+    # Ng1-f3 / Nf3-g1 style shuffle: a and b lead to each other (linked by position_key).
+    evals = {"root": 0.0, "a": 20.0, "b": 35.0, "c": 10.0, "leaf": -5.0}
+    white_to_move = {"root": True, "a": False, "b": True, "c": False, "leaf": True}
+    edges = [("root", "a"), ("root", "c"), ("a", "b"), ("b", "a"), ("b", "leaf"), ("c", "leaf")]
+
+    result = backpropagate(evals, white_to_move, edges)
+
+    assert result["a"] == (None, False)
+    assert result["b"] == (None, False)
+    assert result["c"] == (-5.0, False)
+    assert result["root"] == (20.0, False)  # a's direct eval stands in
+
+
+def test_cyclic_nodes_finds_only_cycle_members():
+    children = {"r": ["a"], "a": ["b"], "b": ["a", "x"], "x": ["x"], "y": ["z"]}
+    assert cyclic_nodes(children) == {"a", "b", "x"}
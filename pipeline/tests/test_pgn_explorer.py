@@ -0,0 +1,217 @@
+"""Tests for pgn_explorer.py"""
+
+import io
+import sys
+import uuid
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import chess
+import chess.pgn
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import OpeningNode
+from pgn_explorer import MoveTally, PositionTally, build_stats, count_games, plan_tree, write_tree
+from positions import position_key
+
+
+def make_game(moves: list[str], result: str, headers: dict | None = None) -> str:
+    game = chess.pgn.Game()
+    game.headers["Result"] = result
+    for name, value in (headers or {}).items():
+        game.headers[name] = value
+    board = game.board()
+    node = game
+    for san in moves:
+        move = board.parse_san(san)
+        node = node.add_main_variation(move)
+        board.push(move)
+    return str(game)
+
+
+def key_after(moves: list[str]) -> int:
+    board = chess.Board()
+    for san in moves:
+        board.push_san(san)
+    return position_key(board)
+
+
+def _corpus(tmp_path, games: list[str]) -> Path:
+    pgn_file = tmp_path / "corpus.pgn"
+    pgn_file.write_text("\n\n".join(games))
+    return pgn_file
+
+
+ITALIAN = ["e4", "e5", "Nf3", "Nc6", "Bc4"]
+RUY = ["e4", "e5", "Nf3", "Nc6", "Bb5"]
+
+
+def _sample_games() -> list[str]:
+    return (
+        [make_game(ITALIAN, "1-0") for _ in range(3)]
+        + [make_game(ITALIAN, "1/2-1/2") for _ in range(2)]
+        + [make_game(RUY, "0-1") for _ in range(4)]
+        + [make_game(["d4"], "*")]  # unfinished: not counted
+        + [make_game(["e4"], "1-0", {"FEN": chess.Board().fen(), "SetUp": "1"})]
+    )
+
+
+def _tallies(tmp_path):
+    return PositionTally(1 << 20, tmp_path), MoveTally(1 << 20, tmp_path)
+
+
+def test_count_games_tallies_results_and_moves(tmp_path):
+    position_tally, move_tally = _tallies(tmp_path)
+    games = count_games(io.StringIO("\n\n".join(_sample_games())), position_tally, move_tally)
+    positions, moves = position_tally.entries, move_tally.entries
+
+    assert games == 9
+    assert positions[key_after([])][2:] == [3, 2, 4]
+    assert positions[key_after(ITALIAN)][2:] == [3, 2, 0]
+    assert positions[key_after(RUY)][0] == 5
+    assert moves[(key_after(ITALIAN[:4]), key_after(ITALIAN))] == ["Bc4", 5]
+    assert key_after(["d4"]) not in positions
+
+
+def test_count_games_stops_at_max_ply(tmp_path):
+    position_tally, move_tally = _tallies(tmp_path)
+    count_games(io.StringIO(make_game(ITALIAN, "1-0")), position_tally, move_tally, max_ply=2)
+    positions, moves = position_tally.entries, move_tally.entries
+
+    assert {entry[0] for entry in positions.values()} == {0, 1, 2}
+    assert len(moves) == 2
+
+
+def test_transposition_keeps_earliest_ply_and_skips_back_edges(tmp_path):
+    # Knight shuffle returns to the start position at ply 4.
+    pgn_file = _corpus(tmp_path, [make_game(["Nf3", "Nf6", "Ng1", "Ng8", "e4"], "1-0")])
+    positions, moves, _ = build_stats([pgn_file])
+
+    start = key_after([])
+    assert positions[start][0] == 0
+    assert positions[start][2] == 2  # one game, reached twice
+
+    levels, parent, children = plan_tree(positions, moves, min_games=1)
+    assert levels[0] == [start]
+    assert start not in [child for kids in children.values() for child, _ in kids]
+    assert all(positions[p][0] < positions[c][0] for c, p in parent.items())
+
+
+def test_parallel_stats_match_serial(tmp_path):
+    pgn_file = _corpus(tmp_path, _sample_games() * 5)
+
+    serial = build_stats([pgn_file])
+    parallel = build_stats([pgn_file], workers=2, shard_bytes=300)
+
+    assert parallel == serial
+    assert serial[2] == 45
+
+
+def test_spilled_tallies_match_in_memory_and_prune_by_min_games(tmp_path):
+    pgn_file = _corpus(tmp_path, _sample_games() * 3)
+    spill_dir = tmp_path / "runs"
+    spill_dir.mkdir()
+
+    in_memory = build_stats([pgn_file], min_games=12)
+    spilled = build_stats([pgn_file], min_games=12, memory_bytes=4000, spill_dir=str(spill_dir))
+    pooled = build_stats([pgn_file], min_games=12, memory_bytes=6000, workers=2, shard_bytes=300)
+
+    assert spilled == in_memory == pooled
+    positions, moves, _ = in_memory
+    assert key_after(ITALIAN) in positions and key_after(RUY) in positions  # 15 and 12 games
+    assert all(sum(entry[2:]) >= 12 for entry in positions.values())
+    assert all(a in positions and b in positions for a, b in moves)
+    assert list(spill_dir.iterdir()) == []
+
+
+def test_plan_tree_prunes_and_orders_by_popularity(tmp_path):
+    pgn_file = _corpus(tmp_path, _sample_games())
+    positions, moves, _ = build_stats([pgn_file])
+
+    levels, parent, children = plan_tree(positions, moves, min_games=5)
+
+    assert [len(level) for level in levels] == [1, 1, 1, 1, 1, 1]  # Bb5 falls below 5
+    _, _, children = plan_tree(positions, moves, min_games=4)
+    assert children[key_after(ITALIAN[:4])] == [(key_after(ITALIAN), "Bc4"), (key_after(RUY), "Bb5")]
+
+
+def fake_upsert_nodes(conn, nodes):
+    return {n.fen: uuid.uuid4() for n in nodes}
+
+
+def _write(positions, moves, min_games, existing_nodes=()):
+    by_key = {node.position_key: node for node in existing_nodes}
+    conn = MagicMock()
+    calls = {"batches": []}
+
+    def upsert(conn, nodes):
+        calls["batches"].append(nodes)
+        return fake_upsert_nodes(conn, nodes)
+
+    with patch("pgn_explorer.get_nodes_by_position_keys", side_effect=lambda c, keys: {
+             k: by_key[k] for k in keys if k in by_key}), \
+         patch("pgn_explorer.upsert_nodes", side_effect=upsert), \
+         patch("pgn_explorer.set_node_stats") as mock_stats, \
+         patch("pgn_explorer.add_children") as mock_edges, \
+         patch("pgn_explorer.upsert_transpositions") as mock_transpositions, \
+         patch("pgn_explorer.set_branching_nodes") as mock_branching:
+        calls["result"] = write_tree(conn, positions, moves, min_games=min_games)
+    calls.update(
+        stats=mock_stats.call_args.args[1],
+        edges=mock_edges.call_args.args[1],
+        transpositions=mock_transpositions.call_args.args[1],
+        branching=mock_branching.call_args.args[1],
+    )
+    conn.commit.assert_called_once()
+    return calls
+
+
+def test_write_tree_bulk_writes_nodes_edges_and_branching(tmp_path):
+    pgn_file = _corpus(tmp_path, _sample_games())
+    positions, moves, _ = build_stats([pgn_file])
+    root = OpeningNode(
+        node_id=uuid.uuid4(), fen=chess.Board().fen(), eco_code="A00", opening_name="Start", game_count=1000,
+        position_key=key_after([]),
+    )
+
+    calls = _write(positions, moves, 4, [root])
+
+    assert calls["result"] == (7, 6, 6)
+    assert len(calls["batches"]) == 5  # one upsert per ply with new nodes; the root already exists
+    (node_id, game_count, white_win_pct, draw_pct), = calls["stats"]  # plain SET, may lower game_count
+    assert (node_id, game_count) == (root.node_id, 9)
+    assert white_win_pct == pytest.approx(100 * 3 / 9)
+    assert draw_pct == pytest.approx(100 * 2 / 9)
+
+    e4 = calls["batches"][0][0]
+    assert (e4.pgn_move, e4.move_number, e4.side, e4.opening_name) == ("e4", 1, "W", "Start")
+    assert e4.parent_node_id == root.node_id
+
+    leaves = {node.pgn_move: node for node in calls["batches"][4]}
+    assert leaves["Bc4"].game_count == 5 and leaves["Bb5"].game_count == 4
+    assert leaves["Bb5"].white_win_pct == 0.0
+
+    assert sorted(order for _, _, order in calls["edges"]) == [0, 0, 0, 0, 0, 1]
+    assert calls["transpositions"] == []
+    assert len(calls["branching"]) == 1
+
+
+def test_write_tree_records_transpositions(tmp_path):
+    # 1. d4 Nf6 2. c4 e6 (3 games) and 1. c4 e6 2. d4 Nf6 (2 games) reach the same position.
+    pgn_file = _corpus(
+        tmp_path,
+        [make_game(["d4", "Nf6", "c4", "e6"], "1-0") for _ in range(3)]
+        + [make_game(["c4", "e6", "d4", "Nf6"], "0-1") for _ in range(2)],
+    )
+    positions, moves, _ = build_stats([pgn_file])
+
+    calls = _write(positions, moves, 2)
+
+    nodes = {node.position_key: node for batch in calls["batches"] for node in batch}
+    shared = nodes[key_after(["d4", "Nf6", "c4", "e6"])]
+    assert shared.game_count == 5 and shared.pgn_move == "e6"
+    assert shared.parent_node_id == nodes[key_after(["d4", "Nf6", "c4"])].node_id
+    other_parent = nodes[key_after(["c4", "e6", "d4"])]
+    assert calls["transpositions"] == [(other_parent.node_id, shared.node_id)]
@@ -0,0 +1,85 @@
+"""Tests for pgn_io.py"""
+
+import bz2
+import gzip
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pgn_io import open_pgn, open_shard, plan_shards
+
+GAME = '[Event "Game {i}"]\n[Opening "Italian Game"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 *\n'
+
+
+def _corpus(tmp_path, games: int) -> Path:
+    pgn_file = tmp_path / "corpus.pgn"
+    pgn_file.write_text("\n".join(GAME.format(i=i) for i in range(games)))
+    return pgn_file
+
+
+def test_plan_shards_cut_on_game_boundaries(tmp_path):
+    pgn_file = _corpus(tmp_path, 40)
+    data = pgn_file.read_bytes()
+
+    shards = plan_shards([pgn_file], shard_bytes=500)
+
+    assert len(shards) > 1
+    assert shards[0][1] == 0 and shards[-1][2] == len(data)
+    for (_, _, end), (_, next_start, _) in zip(shards, shards[1:]):
+        assert end == next_start
+        assert data[next_start:].startswith(b"[Event ")
+
+
+def test_shards_read_back_every_game_once(tmp_path):
+    pgn_file = _corpus(tmp_path, 40)
+
+    text = ""
+    for shard in plan_shards([pgn_file], shard_bytes=300):
+        with open_shard(shard) as handle:
+            text += handle.read()
+
+    assert text == pgn_file.read_text()
+
+
+def test_mapped_shard_streams_across_buffer_refills(tmp_path):
+    pgn_file = _corpus(tmp_path, 2000)  # shards far larger than the 8 KB read buffer
+
+    lines = []
+    for shard in plan_shards([pgn_file], shard_bytes=50_000):
+        with open_shard(shard) as handle:
+            lines.extend(handle)
+        assert handle.closed
+
+    assert "".join(lines) == pgn_file.read_text()
+
+
+@pytest.mark.parametrize("suffix,compress", [(".gz", gzip.compress), (".bz2", bz2.compress)])
+def test_compressed_files_stream_as_one_shard(tmp_path, suffix, compress):
+    pgn_file = _corpus(tmp_path, 5)
+    packed = tmp_path / f"corpus.pgn{suffix}"
+    packed.write_bytes(compress(pgn_file.read_bytes()))
+
+    shards = plan_shards([packed], shard_bytes=100)
+
+    assert shards == [(packed, 0, None)]
+    with open_shard(shards[0]) as handle:
+        assert handle.read() == pgn_file.read_text()
+
+
+def test_open_pgn_reads_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    pgn_file = _corpus(tmp_path, 5)
+    packed = tmp_path / "corpus.pgn.zst"
+    packed.write_bytes(zstandard.ZstdCompressor().compress(pgn_file.read_bytes()))
+
+    with open_pgn(packed) as handle:
+        assert handle.read() == pgn_file.read_text()
+
+
+def test_empty_file_has_no_shards(tmp_path):
+    empty = tmp_path / "empty.pgn"
+    empty.write_text("")
+    assert plan_shards([empty], shard_bytes=100) == []
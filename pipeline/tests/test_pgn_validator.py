@@ -5,12 +5,14 @@ import sys
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import chess
 import chess.pgn
 import pytest
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from pgn_validator import validate_against_pgn, is_named_variation
+from pgn_validator import PositionCounter, validate_against_pgn, is_named_variation
+from positions import PositionKeySet, position_key
 
 
 def make_pgn_game(opening_header: str, moves: list[str]) -> str:
@@ -37,7 +39,8 @@ def test_validator_flags_missing_named_variation(tmp_path):
     pgn_file.write_text(pgn_content)
 
     mock_conn = MagicMock()
-    with patch("pgn_validator.get_node_by_fen", return_value=None):
+    with patch("pgn_validator.iter_position_keys", return_value=iter([])), \
+         patch("pgn_validator.get_max_ply", return_value=15):
         results = validate_against_pgn(mock_conn, [pgn_file], min_games=10)
 
     assert any("Italian" in r.opening_name for r in results)
@@ -53,7 +56,8 @@ def test_validator_ignores_low_frequency_variations(tmp_path):
     pgn_file.write_text(pgn_content)
 
     mock_conn = MagicMock()
-    with patch("pgn_validator.get_node_by_fen", return_value=None):
+    with patch("pgn_validator.iter_position_keys", return_value=iter([])), \
+         patch("pgn_validator.get_max_ply", return_value=15):
         results = validate_against_pgn(mock_conn, [pgn_file], min_games=10)
 
     assert len(results) == 0
@@ -65,9 +69,14 @@ def test_validator_no_false_positives_on_known_nodes(tmp_path):
     pgn_file = tmp_path / "test.pgn"
     pgn_file.write_text(pgn_content)
 
-    mock_node = MagicMock()
+    board = chess.Board()
+    keys = []
+    for san in ["e4", "e5", "Nf3", "Nc6", "Bc4", "Bc5"]:
+        board.push_san(san)
+        keys.append(position_key(board))
     mock_conn = MagicMock()
-    with patch("pgn_validator.get_node_by_fen", return_value=mock_node):
+    with patch("pgn_validator.iter_position_keys", return_value=iter(sorted(keys))), \
+         patch("pgn_validator.get_max_ply", return_value=15):
         results = validate_against_pgn(mock_conn, [pgn_file], min_games=1)
 
     assert len(results) == 0
@@ -81,3 +90,137 @@ def test_is_named_variation_returns_true_for_named_lines():
 def test_is_named_variation_returns_false_for_empty():
     assert is_named_variation("") is False
     assert is_named_variation(None) is False
+
+
+def test_validator_makes_no_per_ply_queries(tmp_path):
+    pgn_file = tmp_path / "test.pgn"
+    pgn_file.write_text(make_pgn_game("Italian Game", ["e4", "e5", "Nf3", "Nc6", "Bc4", "Bc5"]))
+    mock_conn = MagicMock()
+
+    results = validate_against_pgn(mock_conn, [pgn_file], min_games=1, known=PositionKeySet(), max_ply=0)
+
+    assert len(results) == 6
+    mock_conn.cursor.assert_not_called()
+    mock_conn.execute.assert_not_called()
+
+
+def _italian_corpus(tmp_path, games: int) -> Path:
+    pgn_file = tmp_path / "corpus.pgn"
+    pgn_file.write_text(
+        "\n\n".join(
+            make_pgn_game(f"Italian Game: Line {i % 3}", ["e4", "e5", "Nf3", "Nc6", "Bc4", "Bc5"][: 2 + i % 5])
+            for i in range(games)
+        )
+    )
+    return pgn_file
+
+
+def test_sharded_counts_match_serial(tmp_path):
+    from pgn_validator import PositionCounter, count_shard, plan_shards
+
+    pgn_file = _italian_corpus(tmp_path, 40)
+    known = PositionKeySet()
+    serial = validate_against_pgn(MagicMock(), [pgn_file], min_games=1, known=known, max_ply=0)
+
+    counter = PositionCounter(memory_bytes=1 << 20, spill_dir=tmp_path)
+    for shard in plan_shards([pgn_file], shard_bytes=500):
+        count_shard(shard, known, counter)
+        counter.spill()
+    assert len(counter.runs) > 1
+
+    merged = {fen: (count, "; ".join(names)) for fen, count, names, _ in counter.results(min_games=1)}
+    counter.close()
+    assert merged == {m.fen: (m.game_count, m.opening_name) for m in serial}
+
+
+def test_validator_spilled_and_approximate_counts_match_exact(tmp_path):
+    pgn_file = _italian_corpus(tmp_path, 30)
+    known = PositionKeySet()
+
+    def rows(**kwargs):
+        results = validate_against_pgn(MagicMock(), [pgn_file], min_games=5, known=known, max_ply=0, **kwargs)
+        return sorted((m.fen, m.game_count) for m in results)
+
+    exact = rows()
+    assert exact
+    assert rows(memory_bytes=2000, spill_dir=str(tmp_path)) == exact
+    assert rows(approximate=True) == exact
+    assert list(tmp_path.glob("pgn-validator-*")) == []
+
+
+def test_validator_budget_covers_known_keys_in_every_process(tmp_path):
+    pgn_file = _italian_corpus(tmp_path, 5)
+    known = PositionKeySet.from_sorted(range(1000))  # 8000 bytes per copy
+
+    with patch("pgn_validator.PositionCounter", wraps=PositionCounter) as counter:
+        validate_against_pgn(MagicMock(), [pgn_file], min_games=1, known=known, max_ply=0, memory_bytes=20_000)
+    assert counter.call_args.args[0] == 12_000
+
+    with pytest.raises(ValueError, match="known-key set"):
+        validate_against_pgn(
+            MagicMock(), [pgn_file], min_games=1, known=known, max_ply=0, memory_bytes=20_000, workers=2
+        )
+
+
+def test_validator_rejects_approximate_pool():
+    with pytest.raises(ValueError):
+        validate_against_pgn(MagicMock(), [], min_games=1, known=PositionKeySet(), approximate=True, workers=2)
+
+
+def test_validator_parallel_mode_matches_serial(tmp_path):
+    pgn_file = _italian_corpus(tmp_path, 30)
+    known = PositionKeySet()
+
+    serial = validate_against_pgn(MagicMock(), [pgn_file], min_games=2, known=known, max_ply=0)
+    parallel = validate_against_pgn(
+        MagicMock(), [pgn_file], min_games=2, known=known, max_ply=0, workers=2, shard_bytes=400
+    )
+
+    assert serial
+    assert sorted((m.fen, m.game_count, m.opening_name, m.pgn_source) for m in parallel) == sorted(
+        (m.fen, m.game_count, m.opening_name, m.pgn_source) for m in serial
+    )
+
+
+def test_validator_stops_at_max_ply(tmp_path):
+    pgn_file = _italian_corpus(tmp_path, 10)
+
+    results = validate_against_pgn(MagicMock(), [pgn_file], min_games=1, known=PositionKeySet(), max_ply=2)
+
+    assert {chess.Board(m.fen).ply() for m in results} == {1, 2}
+
+
+def test_validator_skips_unnamed_games_and_variations(tmp_path):
+    pgn_file = tmp_path / "test.pgn"
+    pgn_file.write_text(
+        '[Event "a"]\n[Opening "?"]\n\n1. e4 e5 2. Nf3 *\n\n'
+        '[Event "b"]\n[Opening "Sicilian Defense"]\n\n1. e4 {best by test} c5 (1... e5 2. Nf3) 2. Nf3 $1 *\n'
+    )
+
+    results = validate_against_pgn(MagicMock(), [pgn_file], min_games=1, known=PositionKeySet(), max_ply=0)
+
+    assert len(results) == 3
+    assert all(m.opening_name == "Sicilian Defense" for m in results)
+
+
+def test_validator_keeps_positions_before_an_illegal_move(tmp_path):
+    pgn_file = tmp_path / "test.pgn"
+    pgn_file.write_text('[Event "a"]\n[Opening "Italian Game"]\n\n1. e4 e5 2. Ke3 Nc6 *\n')
+
+    results = validate_against_pgn(MagicMock(), [pgn_file], min_games=1, known=PositionKeySet(), max_ply=0)
+
+    assert len(results) == 2
+
+
+def test_validator_reads_compressed_input(tmp_path):
+    import gzip
+
+    pgn_file = _italian_corpus(tmp_path, 12)
+    gz_file = tmp_path / "corpus.pgn.gz"
+    gz_file.write_bytes(gzip.compress(pgn_file.read_bytes()))
+    known = PositionKeySet()
+
+    plain = validate_against_pgn(MagicMock(), [pgn_file], min_games=1, known=known, max_ply=0)
+    packed = validate_against_pgn(MagicMock(), [gz_file], min_games=1, known=known, max_ply=0)
+
+    assert sorted((m.fen, m.game_count) for m in packed) == sorted((m.fen, m.game_count) for m in plain)
@@ -0,0 +1,95 @@
+"""Tests for position_counts.py"""
+
+import random
+import resource
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from position_counts import ENTRY_BYTES, MERGE_FAN_IN, HeavyHitterSketch, PositionCounter
+
+
+def _stream(n: int, keys: int, seed: int = 7) -> list[tuple[int, str, str, str]]:
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        key = int(rng.paretovariate(1.2)) % keys - keys // 2  # skewed, negative keys included
+        rows.append((key, f"fen {key}", f"Opening {rng.randrange(5)}", f"file{rng.randrange(4)}.pgn"))
+    return rows
+
+
+def test_spilled_counts_match_in_memory(tmp_path):
+    rows = _stream(3000, 400)
+    expected = Counter(key for key, *_ in rows)
+
+    counter = PositionCounter(memory_bytes=10 * ENTRY_BYTES, spill_dir=tmp_path)
+    for row in rows:
+        counter.add(*row)
+    assert len(counter.runs) > 1
+
+    results = {fen: count for fen, count, _, _ in counter.results(min_games=1)}
+    assert results == {f"fen {key}": count for key, count in expected.items()}
+
+    counter.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_merge_stays_under_a_low_open_file_limit(tmp_path):
+    counter = PositionCounter(memory_bytes=ENTRY_BYTES, spill_dir=tmp_path)  # one run per key
+    for key in range(300):
+        counter.add(key % 150, f"fen {key % 150}", "Opening", "a.pgn")
+    assert len(counter.runs) == 300 > MERGE_FAN_IN
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+    try:
+        results = {fen: count for fen, count, _, _ in counter.results(min_games=1)}
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    assert results == {f"fen {key}": 2 for key in range(150)}
+    counter.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_counter_keeps_first_three_names_and_sources_across_runs(tmp_path):
+    counter = PositionCounter(memory_bytes=ENTRY_BYTES, spill_dir=tmp_path)  # spills on every new key
+    for name in ["Opening D", "Opening B", "Opening E", "Opening A", "Opening C", "Opening B"]:
+        counter.add(1, "fen b", name, f"{name}.pgn")
+        counter.add(2, "other", name, "x.pgn")
+    counter.add(1, "fen a", "Opening A", "a.pgn")
+
+    results = {fen: (count, names, sources) for fen, count, names, sources in counter.results(min_games=7)}
+    counter.close()
+
+    assert results == {
+        "fen a": (7, ["Opening A", "Opening B", "Opening C"], ["Opening A.pgn", "Opening B.pgn", "Opening C.pgn"])
+    }
+
+
+def test_sketch_finds_heavy_hitters_without_underestimating():
+    rows = _stream(5000, 2000, seed=11)
+    exact = Counter(key for key, *_ in rows)
+    heavy = {f"fen {key}" for key, count in exact.items() if count >= 20}
+
+    sketch = HeavyHitterSketch(memory_bytes=64 * 1024, min_games=20)
+    for row in rows:
+        sketch.add(*row)
+    estimates = {fen: count for fen, count, _, _ in sketch.results(min_games=20)}
+
+    assert heavy and heavy <= set(estimates)
+    for fen, count in estimates.items():
+        assert count >= exact[int(fen.split()[1])]
+        assert count >= 20
+
+
+def test_sketch_ignores_positions_below_min_games():
+    sketch = HeavyHitterSketch(memory_bytes=1 << 20, min_games=3)
+    for _ in range(2):
+        sketch.add(5, "rare", "Opening", "a.pgn")
+    for _ in range(4):
+        sketch.add(6, "common", "Opening", "a.pgn")
+
+    assert [(fen, count) for fen, count, _, _ in sketch.results(min_games=3)] == [("common", 4)]
@@ -0,0 +1,77 @@
+"""Tests for positions.py"""
+
+import random
+import sys
+from pathlib import Path
+
+import chess
+import chess.polyglot
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from positions import PositionKeySet, fen_pawn_bitboards, fen_position_key, position_key, to_signed64, to_unsigned64
+
+
+def test_position_key_fits_bigint_and_round_trips():
+    rng = random.Random(7)
+    for _ in range(200):
+        board = chess.Board()
+        for _ in range(rng.randint(0, 30)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        key = position_key(board)
+        assert -(1 << 63) <= key < (1 << 63)
+        assert to_unsigned64(key) == chess.polyglot.zobrist_hash(board)
+        assert to_signed64(to_unsigned64(key)) == key
+
+
+def test_move_orders_and_counters_share_a_key():
+    a = chess.Board()
+    for san in ("Nf3", "Nf6", "c4", "e6"):
+        a.push_san(san)
+    b = chess.Board()
+    for san in ("c4", "e6", "Nf3", "Nf6"):
+        b.push_san(san)
+    assert position_key(a) == position_key(b)
+
+    fen = a.fen().rsplit(" ", 2)[0]
+    assert fen_position_key(fen + " 0 1") == fen_position_key(fen + " 12 40")
+
+
+def test_side_to_move_changes_key():
+    assert fen_position_key(chess.STARTING_FEN) != fen_position_key(chess.STARTING_FEN.replace(" w ", " b "))
+
+
+def test_invalid_fen_raises_value_error():
+    with pytest.raises(ValueError):
+        fen_position_key("not a fen")
+
+
+def test_fen_pawn_bitboards_match_board():
+    rng = random.Random(11)
+    for _ in range(200):
+        board = chess.Board()
+        for _ in range(rng.randint(0, 40)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        white, black = fen_pawn_bitboards(board.fen())
+        assert white == board.pieces_mask(chess.PAWN, chess.WHITE)
+        assert black == board.pieces_mask(chess.PAWN, chess.BLACK)
+
+
+def test_position_key_set_membership():
+    rng = random.Random(20)
+    keys = [rng.randrange(-(1 << 63), 1 << 63) for _ in range(1000)]
+    key_set = PositionKeySet(keys + keys[:10])
+
+    assert len(key_set) == 1000
+    assert key_set.nbytes == 8000
+    assert all(k in key_set for k in keys)
+    assert sum(rng.randrange(-(1 << 63), 1 << 63) in key_set for _ in range(1000)) == 0
+    assert PositionKeySet.from_sorted(sorted(keys)).nbytes == 8000
+    assert 1 not in PositionKeySet()
@@ -5,12 +5,14 @@ import uuid
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import chess
 import pytest
 from fastapi.testclient import TestClient
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from models import OpeningNode
+from positions import fen_position_key
 
 
 def make_node(**kwargs) -> OpeningNode:
@@ -39,6 +41,14 @@ def make_node(**kwargs) -> OpeningNode:
     return OpeningNode(**defaults)
 
 
+def _mock_conn():
+    """Connection mock usable as `async with get_connection() as conn`."""
+    conn = MagicMock()
+    conn.__aenter__.return_value = conn
+    conn.__aexit__.return_value = False
+    return conn
+
+
 @pytest.fixture
 def client():
     from api.main import app
@@ -47,13 +57,12 @@ def client():
 
 def test_fen_lookup_returns_correct_node(client):
     node = make_node()
-    mock_conn = MagicMock()
-    mock_conn.__enter__ = MagicMock(return_value=mock_conn)
-    mock_conn.__exit__ = MagicMock(return_value=False)
+    mock_conn = _mock_conn()
 
     with patch("api.main.get_connection", return_value=mock_conn), \
-         patch("api.main.get_node_by_fen", return_value=node), \
-         patch("api.main.get_children", return_value=[]):
+         patch("api.main.get_node_by_position_key", return_value=node), \
+         patch("api.main.get_child_summaries", return_value=[]), \
+         patch("api.main.get_transpositions", return_value=[]):
         resp = client.get(f"/node/fen/{node.fen.replace(' ', '_')}")
 
     assert resp.status_code == 200
@@ -66,17 +75,12 @@ def test_fen_lookup_returns_children(client):
     node = make_node()
     child_id = uuid.uuid4()
 
-    mock_conn = MagicMock()
-    mock_conn.__enter__ = MagicMock(return_value=mock_conn)
-    mock_conn.__exit__ = MagicMock(return_value=False)
-    mock_cursor = MagicMock()
-    mock_cursor.fetchone.return_value = (child_id, "Nf3", 5000)
-    mock_conn.cursor.return_value.__enter__ = MagicMock(return_value=mock_cursor)
-    mock_conn.cursor.return_value.__exit__ = MagicMock(return_value=False)
+    mock_conn = _mock_conn()
 
     with patch("api.main.get_connection", return_value=mock_conn), \
-         patch("api.main.get_node_by_fen", return_value=node), \
-         patch("api.main.get_children", return_value=[(child_id, 0)]):
+         patch("api.main.get_node_by_position_key", return_value=node), \
+         patch("api.main.get_child_summaries", return_value=[(child_id, "Nf3", 5000)]), \
+         patch("api.main.get_transpositions", return_value=[]):
         resp = client.get(f"/node/fen/{node.fen.replace(' ', '_')}")
 
     assert resp.status_code == 200
@@ -85,13 +89,11 @@ def test_fen_lookup_returns_children(client):
 
 
 def test_unknown_fen_returns_404(client):
-    mock_conn = MagicMock()
-    mock_conn.__enter__ = MagicMock(return_value=mock_conn)
-    mock_conn.__exit__ = MagicMock(return_value=False)
+    mock_conn = _mock_conn()
 
     with patch("api.main.get_connection", return_value=mock_conn), \
-         patch("api.main.get_node_by_fen", return_value=None):
-        resp = client.get("/node/fen/rnbqkbnr_pppppppp_8_8_8_8_PPPPPPPP_RNBQKBNR_w_KQkq_-_0_1")
+         patch("api.main.get_node_by_position_key", return_value=None):
+        resp = client.get("/node/fen/rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR_w_KQkq_-_0_1")
 
     assert resp.status_code == 404
 
@@ -102,9 +104,7 @@ def test_name_search_returns_fuzzy_matches(client):
         make_node(eco_code="C61", opening_name="Ruy Lopez: Bird's Defense"),
         make_node(eco_code="C50", opening_name="Italian Game"),
     ]
-    mock_conn = MagicMock()
-    mock_conn.__enter__ = MagicMock(return_value=mock_conn)
-    mock_conn.__exit__ = MagicMock(return_value=False)
+    mock_conn = _mock_conn()
 
     with patch("api.main.get_connection", return_value=mock_conn), \
          patch("api.main.get_seed_nodes", return_value=nodes):
@@ -116,6 +116,28 @@ def test_name_search_returns_fuzzy_matches(client):
     assert all("Ruy" in r["name"] for r in results)
 
 
+def test_fen_lookup_uses_position_key(client):
+    """Move counters are not part of the key, so any counters find the stored node."""
+    node = make_node()
+    mock_conn = _mock_conn()
+    board = chess.Board(node.fen)
+    board.halfmove_clock, board.fullmove_number = 4, 9
+
+    with patch("api.main.get_connection", return_value=mock_conn), \
+         patch("api.main.get_node_by_position_key", return_value=node) as mock_lookup, \
+         patch("api.main.get_child_summaries", return_value=[]), \
+         patch("api.main.get_transpositions", return_value=[]):
+        resp = client.get(f"/node/fen/{board.fen().replace(' ', '_')}")
+
+    assert resp.status_code == 200
+    mock_lookup.assert_awaited_once_with(mock_conn, fen_position_key(node.fen))
+
+
+def test_invalid_fen_returns_400(client):
+    resp = client.get("/node/fen/not_a_fen")
+    assert resp.status_code == 400
+
+
 def test_invalid_pgn_returns_400(client):
     resp = client.post("/node/pgn", json={"moves": "1. INVALID_MOVE"})
     assert resp.status_code == 400
@@ -123,13 +145,12 @@ def test_invalid_pgn_returns_400(client):
 
 def test_pgn_walk_returns_correct_final_node(client):
     node = make_node(eco_code="C50", opening_name="Italian Game")
-    mock_conn = MagicMock()
-    mock_conn.__enter__ = MagicMock(return_value=mock_conn)
-    mock_conn.__exit__ = MagicMock(return_value=False)
+    mock_conn = _mock_conn()
 
     with patch("api.main.get_connection", return_value=mock_conn), \
-         patch("api.main.get_node_by_fen", return_value=node), \
-         patch("api.main.get_children", return_value=[]):
+         patch("api.main.get_node_by_position_key", return_value=node), \
+         patch("api.main.get_child_summaries", return_value=[]), \
+         patch("api.main.get_transpositions", return_value=[]):
         resp = client.post("/node/pgn", json={"moves": "1.e4 e5 2.Nf3 Nc6 3.Bc4"})
 
     assert resp.status_code == 200
@@ -141,20 +162,68 @@ def test_fen_lookup_returns_transpositions(client):
     node = make_node()
     trans_node_id = uuid.uuid4()
 
-    mock_conn = MagicMock()
-    mock_conn.__enter__ = MagicMock(return_value=mock_conn)
-    mock_conn.__exit__ = MagicMock(return_value=False)
-    mock_cursor = MagicMock()
-    mock_cursor.fetchall.return_value = [(trans_node_id, "Four Knights Game", "C47")]
-    mock_cursor.fetchone.return_value = None
-    mock_conn.cursor.return_value.__enter__ = MagicMock(return_value=mock_cursor)
-    mock_conn.cursor.return_value.__exit__ = MagicMock(return_value=False)
+    mock_conn = _mock_conn()
 
     with patch("api.main.get_connection", return_value=mock_conn), \
-         patch("api.main.get_node_by_fen", return_value=node), \
-         patch("api.main.get_children", return_value=[]):
+         patch("api.main.get_node_by_position_key", return_value=node), \
+         patch("api.main.get_child_summaries", return_value=[]), \
+         patch("api.main.get_transpositions", return_value=[(trans_node_id, "Four Knights Game", "C47")]):
         resp = client.get(f"/node/fen/{node.fen.replace(' ', '_')}")
 
     assert resp.status_code == 200
     assert len(resp.json()["transpositions"]) == 1
     assert resp.json()["transpositions"][0]["eco_code"] == "C47"
+
+
+def test_pool_metrics_endpoint(client):
+    stats = {"sync": {"size": 2, "checkouts": 7, "wait_ms_avg": 0.5}}
+    with patch("api.main.pool_stats", return_value=stats):
+        resp = client.get("/metrics/pool")
+
+    assert resp.status_code == 200
+    assert resp.json()["sync"]["checkouts"] == 7
+
+
+def test_eco_tree_fetches_subtree_in_one_query(client):
+    seed = make_node(eco_code="C50", opening_name="Italian Game", game_count=10000)
+    child = make_node(pgn_move="Nf3", game_count=5000)
+    mock_conn = _mock_conn()
+
+    with patch("api.main.get_connection", return_value=mock_conn), \
+         patch("api.main.get_seed_nodes", return_value=[seed]), \
+         patch(
+             "api.main.get_subtree",
+             return_value=(
+                 {seed.node_id: seed, child.node_id: child},
+                 {seed.node_id: [(child.node_id, 0)]},
+             ),
+         ) as mock_subtree:
+        resp = client.get("/opening/eco/C50?depth=4&min_games=10")
+
+    assert resp.status_code == 200
+    assert resp.json()["tree"]["engineResponses"] == ["Nf3"]
+    mock_subtree.assert_awaited_once_with(mock_conn, seed.node_id, 4, 10)
+
+
+def test_structure_search_builds_bitwise_filter(client):
+    node = make_node()
+    mock_conn = _mock_conn()
+
+    with patch("api.main.get_connection", return_value=mock_conn), \
+         patch("api.main.search_pawn_structures", return_value=[node]) as mock_search:
+        resp = client.get("/structure/search", params={"white": "c4,e4", "black_absent": "d"})
+
+    assert resp.status_code == 200
+    assert resp.json()[0]["node_id"] == str(node.node_id)
+    predicate = mock_search.call_args[0][1]
+    assert "white_pawns &" in predicate and "black_pawns &" in predicate
+
+
+def test_structure_search_rejects_bad_square(client):
+    resp = client.get("/structure/search", params={"white": "z9"})
+    assert resp.status_code == 400
+
+
+def test_structure_search_requires_a_filter(client):
+    resp = client.get("/structure/search")
+    assert resp.status_code == 400
@@ -31,3 +31,373 @@ def test_is_busted_threshold():
     assert is_busted(-149, "W") is False
     assert is_busted(151, "B") is True
     assert is_busted(149, "B") is False
+
+
+def _node(**kwargs):
+    import uuid
+
+    import chess
+    from models import OpeningNode
+
+    defaults = dict(node_id=uuid.uuid4(), fen=chess.STARTING_FEN, side="B", is_branching_node=True, game_count=100)
+    defaults.update(kwargs)
+    return OpeningNode(**defaults)
+
+
+def test_target_depth_by_node_kind():
+    from stockfish_annotator import target_depth
+
+    assert target_depth(_node(game_count=5000)) == 26
+    assert target_depth(_node(game_count=500)) == 22
+    assert target_depth(_node(is_branching_node=False, game_count=5000)) == 18
+
+
+def test_annotate_nodes_pool_requeues_work_from_a_broken_pool():
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+    from unittest.mock import MagicMock, patch
+
+    import pytest
+
+    import stockfish_annotator
+    from models import PositionEval
+
+    nodes = [_node(fen=fen) for fen in _distinct_fens(4)]
+    pools = []
+
+    class BreakingPool:
+        """Pool stand-in: the first `broken` pools lose every task, later ones run them inline."""
+
+        broken = 1
+
+        def __init__(self, max_workers, mp_context, initializer, initargs):
+            self.breaks = len(pools) < self.broken
+            self.submitted = []
+            pools.append(self)
+
+        def submit(self, fn, *args):
+            self.submitted.append(args[0].node_id)
+            future = Future()
+            if self.breaks:
+                future.set_exception(BrokenProcessPool("A process in the pool was terminated abruptly"))
+            else:
+                future.set_result(fn(*args))
+            return future
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            pass
+
+    searched = PositionEval(position_key=1, depth=22, score_cp=12.0, pv=[])
+
+    def run():
+        with patch("stockfish_annotator.ProcessPoolExecutor", BreakingPool), \
+             patch("stockfish_annotator.iter_nodes", return_value=iter(nodes)), \
+             patch("stockfish_annotator.iter_leaf_nodes", return_value=iter([])), \
+             patch("stockfish_annotator.get_cached_evals", return_value={}), \
+             patch("stockfish_annotator.search_position", return_value=searched), \
+             patch("stockfish_annotator.store_evals"), \
+             patch("stockfish_annotator.update_annotations"), \
+             patch("stockfish_annotator.log_node_changes"):
+            return stockfish_annotator.annotate_nodes_pool(MagicMock(), engines=1)
+
+    assert run() == 4
+    assert len(pools) == 2 and not pools[1].breaks
+    assert sorted(pools[1].submitted) == sorted(node.node_id for node in nodes)
+
+    pools.clear()
+    BreakingPool.broken = stockfish_annotator.MAX_POOL_RESTARTS + 1
+    with pytest.raises(BrokenProcessPool):
+        run()
+
+
+def test_drain_annotation_queue_annotates_claimed_jobs_until_empty():
+    from unittest.mock import MagicMock, patch
+
+    import chess
+    import chess.engine
+
+    import stockfish_annotator
+
+    fresh = _node()
+    already_deep = _node(stockfish_eval=10.0, stockfish_depth=30)
+    engine = MagicMock()
+    engine.analyse.return_value = [{
+        "score": chess.engine.PovScore(chess.engine.Cp(25), chess.WHITE),
+        "pv": [chess.Move.from_uci("e2e4")],
+    }]
+    popen = MagicMock(return_value=engine)
+    conn = MagicMock()
+
+    with patch("stockfish_annotator.chess.engine.SimpleEngine.popen_uci", popen), \
+         patch("stockfish_annotator.get_cached_eval", return_value=None), \
+         patch("stockfish_annotator.store_evals"), \
+         patch("stockfish_annotator.claim_annotation_jobs",
+               side_effect=[[(fresh, 22), (already_deep, 22)], []]) as claim, \
+         patch("stockfish_annotator.complete_annotation_jobs", return_value=2) as complete, \
+         patch("stockfish_annotator.update_node") as update, \
+         patch("stockfish_annotator.log_node_change"):
+        n = stockfish_annotator.drain_annotation_queue(conn, batch_size=2)
+
+    assert n == 1
+    assert claim.call_count == 2
+    engine.analyse.assert_called_once()
+    assert update.call_args.kwargs["stockfish_eval"] == 25
+    assert update.call_args.kwargs["best_move"] == "e4"
+    worker = claim.call_args.args[1]
+    complete.assert_called_once_with(conn, worker, [(fresh.node_id, 22), (already_deep.node_id, 22)])
+
+
+def test_drain_annotation_queue_spends_no_attempt_on_the_first_engine_crash():
+    from unittest.mock import MagicMock, patch
+
+    import chess.engine
+
+    import stockfish_annotator
+
+    node = _node()
+    crash = chess.engine.EngineTerminatedError("engine process died unexpectedly")
+    conn = MagicMock()
+
+    with patch("stockfish_annotator.PersistentEngine"), \
+         patch("stockfish_annotator.analyse_node", side_effect=crash), \
+         patch("stockfish_annotator.claim_annotation_jobs", side_effect=[[(node, 22)], [(node, 22)], []]) as claim, \
+         patch("stockfish_annotator.complete_annotation_jobs", return_value=0), \
+         patch("stockfish_annotator.release_annotation_job") as release, \
+         patch("stockfish_annotator.fail_annotation_job") as fail:
+        assert stockfish_annotator.drain_annotation_queue(conn, max_attempts=3) == 0
+
+    worker = claim.call_args.args[1]
+    release.assert_called_once_with(conn, worker, node.node_id, 22, str(crash))
+    fail.assert_called_once_with(conn, worker, node.node_id, 22, str(crash), 3)
+
+
+def test_persistent_engine_is_reused_and_restarted_after_crash():
+    from unittest.mock import MagicMock, patch
+
+    import chess
+    import chess.engine
+
+    from stockfish_annotator import PersistentEngine
+
+    crashed, fresh = MagicMock(), MagicMock()
+    crashed.analyse.side_effect = [["first"], chess.engine.EngineTerminatedError("died")]
+    fresh.analyse.return_value = ["retried"]
+    limit = chess.engine.Limit(depth=10)
+
+    with patch("stockfish_annotator.chess.engine.SimpleEngine.popen_uci", side_effect=[crashed, fresh]) as popen:
+        engine = PersistentEngine("sf", threads=2, hash_mb=64)
+        assert engine.analyse(chess.Board(), limit) == ["first"]
+        assert engine.analyse(chess.Board(), limit) == ["retried"]
+
+    assert popen.call_count == 2
+    crashed.configure.assert_called_once_with({"Threads": 2, "Hash": 64})
+    crashed.quit.assert_called_once()
+    fresh.configure.assert_called_once_with({"Threads": 2, "Hash": 64})
+
+
+def test_split_cores_between_engines_and_threads():
+    from stockfish_annotator import split_cores
+
+    assert split_cores(0, cores=32) == (32, 1)
+    assert split_cores(8, cores=32) == (8, 4)
+    assert split_cores(48, cores=32) == (48, 1)
+
+
+def test_annotate_nodes_pool_writes_results_in_batches():
+    from concurrent.futures import Future
+    from unittest.mock import MagicMock, patch
+
+    import stockfish_annotator
+    from models import PositionEval
+    from positions import fen_position_key
+
+    nodes = [_node(fen=fen) for fen in _distinct_fens(5)] + [_node(stockfish_eval=1.0)]
+    cached_node = nodes[0]
+    cached = PositionEval(position_key=fen_position_key(cached_node.fen), depth=30, score_cp=-80.0, pv=["e7e5"])
+
+    class InlinePool:
+        """ProcessPoolExecutor stand-in that runs work in this process."""
+
+        def __init__(self, max_workers, mp_context, initializer, initargs):
+            assert mp_context.get_start_method() == "spawn"
+
+        def submit(self, fn, *args):
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            pass
+
+    searched = PositionEval(position_key=1, depth=22, score_cp=12.0, pv=[])
+    conn = MagicMock()
+
+    with patch("stockfish_annotator.ProcessPoolExecutor", InlinePool), \
+         patch("stockfish_annotator.iter_nodes", return_value=iter(nodes)), \
+         patch("stockfish_annotator.iter_leaf_nodes", return_value=iter([])), \
+         patch("stockfish_annotator.get_cached_evals", return_value={cached.position_key: cached}), \
+         patch("stockfish_annotator.search_position", return_value=searched) as search, \
+         patch("stockfish_annotator.store_evals") as store, \
+         patch("stockfish_annotator.update_annotations") as update, \
+         patch("stockfish_annotator.log_node_changes") as log:
+        n = stockfish_annotator.annotate_nodes_pool(conn, engines=1, write_batch=2)
+
+    assert n == 5
+    assert search.call_count == 4  # the cached position is not searched again
+    assert sum(len(c.args[1]) for c in store.call_args_list) == 4
+    batches = [len(c.args[1]) for c in update.call_args_list]
+    assert sum(batches) == 5 and len(batches) < 5
+    assert conn.commit.call_count == len(batches)
+    assert sum(len(c.args[1]) for c in log.call_args_list) == 10
+    written = dict(pair for c in update.call_args_list for pair in c.args[1])
+    assert written[cached_node.node_id]["stockfish_depth"] == 30
+    assert written[cached_node.node_id]["best_move"] == "e5"
+
+
+def _distinct_fens(n: int) -> list[str]:
+    import chess
+
+    fens = []
+    for move in list(chess.Board().legal_moves)[:n]:
+        board = chess.Board()
+        board.push(move)
+        fens.append(board.fen())
+    return fens
+
+
+def test_analyse_node_answers_from_deeper_cache_entry():
+    from unittest.mock import MagicMock, patch
+
+    import chess
+
+    import stockfish_annotator
+    from models import PositionEval
+
+    board = chess.Board()
+    board.push_san("e4")
+    node = _node(fen=board.fen(), side="W")
+    engine = MagicMock()
+    cached = PositionEval(position_key=0, depth=26, score_cp=30.0, pv=["c7c5"])
+
+    with patch("stockfish_annotator.get_cached_eval", return_value=cached) as lookup, \
+         patch("stockfish_annotator.store_evals") as store:
+        annotation = stockfish_annotator.analyse_node(engine, node, 22, conn=MagicMock())
+
+    assert lookup.call_args.args[2] == 22
+    engine.analyse.assert_not_called()
+    store.assert_not_called()
+    assert annotation["stockfish_depth"] == 26
+    assert annotation["best_move"] == "c5"
+
+
+def test_analyse_node_stores_new_search_in_cache():
+    from unittest.mock import MagicMock, patch
+
+    import chess
+    import chess.engine
+
+    import stockfish_annotator
+    from positions import position_key
+
+    node = _node()
+    engine = MagicMock()
+    engine.analyse.return_value = [{
+        "score": chess.engine.PovScore(chess.engine.Cp(15), chess.WHITE),
+        "pv": [chess.Move.from_uci("d2d4"), chess.Move.from_uci("d7d5")],
+    }]
+
+    with patch("stockfish_annotator.get_cached_eval", return_value=None), \
+         patch("stockfish_annotator.store_evals") as store:
+        annotation = stockfish_annotator.analyse_node(engine, node, 20, conn=MagicMock())
+
+    (ev,) = store.call_args.args[1]
+    assert ev.position_key == position_key(chess.Board(node.fen))
+    assert ev.depth == 20 and ev.pv == ["d2d4", "d7d5"]
+    assert annotation["best_move"] == "d4"
+
+
+def _multipv_info(lines):
+    import chess
+    import chess.engine
+
+    return [
+        {
+            "score": chess.engine.PovScore(chess.engine.Cp(cp), chess.WHITE),
+            "pv": [chess.Move.from_uci(m) for m in pv],
+        }
+        for cp, pv in lines
+    ]
+
+
+def _child(parent_fen, san, **kwargs):
+    import chess
+
+    board = chess.Board(parent_fen)
+    board.push_san(san)
+    return _node(fen=board.fen(), pgn_move=san, side="W" if board.turn == chess.BLACK else "B", **kwargs)
+
+
+def test_analyse_with_children_maps_multipv_lines_to_children():
+    from unittest.mock import MagicMock
+
+    import chess
+
+    from stockfish_annotator import analyse_with_children
+
+    parent = _node(fen=chess.STARTING_FEN, game_count=500)  # own target 22
+    e4 = _child(chess.STARTING_FEN, "e4", is_branching_node=False)       # needs depth 18
+    d4 = _child(chess.STARTING_FEN, "d4", is_branching_node=False, stockfish_eval=20.0)  # already annotated
+    c4 = _child(chess.STARTING_FEN, "c4", is_branching_node=True, game_count=5000)  # needs 26
+    unnamed = _node(pgn_move=None)
+    illegal = _node(pgn_move="Qxh7")
+    engine = MagicMock()
+    engine.analyse.return_value = _multipv_info([
+        (30, ["e2e4", "e7e5"]),
+        (25, ["d2d4", "d7d5"]),
+        (20, ["c2c4"]),
+    ])
+
+    annotation, children = analyse_with_children(engine, parent, [e4, unnamed, d4, illegal, c4], 22)
+
+    assert engine.analyse.call_args.kwargs["multipv"] == 3
+    assert engine.analyse.call_args.args[1].depth == 27  # one past c4's target depth
+    assert annotation["stockfish_eval"] == 30 and annotation["best_move"] == "e4"
+    assert annotation["stockfish_depth"] == 27
+    assert [child_id for child_id, _ in children] == [e4.node_id, c4.node_id]
+    (_, e4_annotation), (_, c4_annotation) = children
+    assert e4_annotation["stockfish_depth"] == c4_annotation["stockfish_depth"] == 26
+    assert e4_annotation["stockfish_eval"] == 30
+    assert e4_annotation["best_move"] == "e5"
+
+
+def test_annotate_nodes_skips_children_covered_by_parent_multipv():
+    from unittest.mock import MagicMock, patch
+
+    import chess
+
+    import stockfish_annotator
+
+    parent = _node(fen=chess.STARTING_FEN, game_count=5000)
+    leaf = _child(chess.STARTING_FEN, "e4", is_branching_node=False)
+    engine = MagicMock()
+    engine.analyse.return_value = _multipv_info([(30, ["e2e4", "e7e5"])])
+    popen = MagicMock()
+    popen.return_value.__enter__.return_value = engine
+    conn = MagicMock()
+
+    with patch("stockfish_annotator.chess.engine.SimpleEngine.popen_uci", popen), \
+         patch("stockfish_annotator.iter_nodes", return_value=iter([parent])), \
+         patch("stockfish_annotator.iter_leaf_nodes", return_value=iter([leaf])), \
+         patch("stockfish_annotator.get_children", return_value=[(leaf.node_id, 0)]), \
+         patch("stockfish_annotator.get_nodes_by_ids", return_value=[leaf]), \
+         patch("stockfish_annotator.get_cached_eval", return_value=None), \
+         patch("stockfish_annotator.store_evals") as store, \
+         patch("stockfish_annotator.update_annotations") as update, \
+         patch("stockfish_annotator.log_node_changes"):
+        n = stockfish_annotator.annotate_nodes(conn, max_nodes=None, multipv_children=True)
+
+    assert n == 2
+    engine.analyse.assert_called_once()
+    written = [node_id for c in update.call_args_list for node_id, _ in c.args[1]]
+    assert written == [parent.node_id, leaf.node_id]
+    assert len(store.call_args.args[1]) == 2  # parent and child evals cached
@@ -0,0 +1,50 @@
+"""Tests for structure_batch.py"""
+
+import random
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from positions import to_signed64
+from structure_batch import LABELS, classify_arrays, tag_all
+from structure_tagger import classify_pawns
+
+
+def _random_pawns(rng: random.Random, count: int) -> list[tuple[int, int]]:
+    rows = []
+    for _ in range(count):
+        squares = rng.sample(range(8, 56), rng.randint(0, 16))
+        split = rng.randint(0, len(squares))
+        rows.append((sum(1 << sq for sq in squares[:split]), sum(1 << sq for sq in squares[split:])))
+    return rows
+
+
+def test_classify_arrays_matches_classify_pawns():
+    rows = _random_pawns(random.Random(19), 5000)
+    white = np.array([w for w, _ in rows], dtype=np.uint64)
+    black = np.array([b for _, b in rows], dtype=np.uint64)
+
+    labels = classify_arrays(white, black)
+
+    assert [LABELS[i] for i in labels] == [classify_pawns(w, b) for w, b in rows]
+
+
+def test_tag_all_reads_signed_bitboards_and_copies_labels_per_chunk():
+    rows = _random_pawns(random.Random(20), 5)
+    stored = [(f"id{i}", to_signed64(w), to_signed64(b)) for i, (w, b) in enumerate(rows)]
+    conn = MagicMock()
+
+    with patch("structure_batch.stream_query", return_value=iter(stored)) as mock_stream, \
+         patch("structure_batch.set_structures") as mock_set:
+        tagged = tag_all(conn, chunk_size=2)
+
+    assert tagged == 5
+    assert "resulting_structure IS NULL" in mock_stream.call_args[0][1]
+    assert mock_set.call_count == 3
+    written = [row for call in mock_set.call_args_list for row in call[0][1]]
+    assert written == [(f"id{i}", classify_pawns(w, b)) for i, (w, b) in enumerate(rows)]
+    assert conn.commit.call_count == 3
@@ -0,0 +1,92 @@
+"""Tests for structure_sql.py"""
+
+import random
+import sqlite3
+import sys
+from pathlib import Path
+
+import chess
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from positions import to_signed64
+from structure_sql import (
+    STRUCTURE_LABELS,
+    parse_pawn_squares,
+    pawn_filter_sql,
+    structure_case_sql,
+)
+from structure_tagger import classify_pawns
+
+
+def _random_pawns(rng: random.Random) -> tuple[int, int]:
+    squares = rng.sample(range(8, 56), rng.randint(0, 16))
+    split = rng.randint(0, len(squares))
+    white = sum(1 << sq for sq in squares[:split])
+    black = sum(1 << sq for sq in squares[split:])
+    return white, black
+
+
+def _pawn_db(rows: list[tuple[int, int]]) -> sqlite3.Connection:
+    """SQLite has the same signed 64-bit & semantics; only the BIGINT casts need dropping."""
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE opening_nodes (id INTEGER, white_pawns INTEGER, black_pawns INTEGER)")
+    db.executemany(
+        "INSERT INTO opening_nodes VALUES (?, ?, ?)",
+        [(i, to_signed64(w), to_signed64(b)) for i, (w, b) in enumerate(rows)],
+    )
+    return db
+
+
+def _sqlite(sql: str) -> str:
+    return sql.replace("::BIGINT", "")
+
+
+def test_case_sql_matches_classify_pawns():
+    rng = random.Random(18)
+    rows = [_random_pawns(rng) for _ in range(3000)]
+    db = _pawn_db(rows)
+
+    labels = db.execute(f"SELECT id, {_sqlite(structure_case_sql())} FROM opening_nodes ORDER BY id").fetchall()
+
+    assert [label for _, label in labels] == [classify_pawns(w, b) for w, b in rows]
+
+
+def test_case_sql_is_null_without_bitboards():
+    db = _pawn_db([])
+    db.execute("INSERT INTO opening_nodes VALUES (0, NULL, NULL)")
+
+    assert db.execute(f"SELECT {_sqlite(structure_case_sql())} FROM opening_nodes").fetchone() == (None,)
+
+
+@pytest.mark.parametrize("path", ["migrations/008_add_pawn_structure.sql", "schema.sql"])
+def test_generated_column_matches_case_sql(path):
+    text = (Path(__file__).resolve().parent.parent / path).read_text()
+    assert " ".join(structure_case_sql().split()) in " ".join(text.split())
+
+
+def test_pawn_filter_sql_finds_c4_e4_without_black_d_pawn():
+    no_d_pawn = chess.Board("rnbqkbnr/ppp1pppp/8/8/2P1P3/8/PP1P1PPP/RNBQKBNR w KQkq - 0 3")
+    with_d_pawn = chess.Board("rnbqkbnr/ppp2ppp/4p3/3p4/2PPP3/8/PP3PPP/RNBQKBNR b KQkq - 0 3")
+    rows = [
+        (b.pieces_mask(chess.PAWN, chess.WHITE), b.pieces_mask(chess.PAWN, chess.BLACK))
+        for b in (no_d_pawn, with_d_pawn)
+    ]
+    db = _pawn_db(rows)
+
+    where = pawn_filter_sql(white=parse_pawn_squares("c4,e4"), black_absent=parse_pawn_squares("d"))
+
+    assert [i for (i,) in db.execute(f"SELECT id FROM opening_nodes WHERE {_sqlite(where)}")] == [0]
+
+
+def test_parse_pawn_squares_accepts_squares_and_files():
+    assert parse_pawn_squares("c4, e4") == chess.BB_C4 | chess.BB_E4
+    assert parse_pawn_squares("d") == chess.BB_FILE_D
+    assert parse_pawn_squares("") == 0
+    try:
+        parse_pawn_squares("z9")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
@@ -1,13 +1,49 @@
 """Tests for structure_tagger.py"""
 
+import random
 import sys
 from pathlib import Path
+from unittest.mock import patch
 
 import chess
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from structure_tagger import classify_structure
+from structure_tagger import (
+    PAWN_STRUCTURE_RULES,
+    PawnStructureCache,
+    classify_fen,
+    classify_pawns,
+    classify_structure,
+    pawn_bitboards,
+    tag_incrementally,
+)
+
+
+def _reference_label(board: chess.Board) -> str:
+    """The per-square predicates, applied in rule order."""
+    for predicate, label in PAWN_STRUCTURE_RULES:
+        if predicate(board):
+            return label
+    return "Unknown"
+
+
+def _random_pawn_board(rng: random.Random) -> chess.Board:
+    board = chess.Board.empty()
+    squares = rng.sample(range(8, 56), rng.randint(0, 16))
+    for sq in squares:
+        board.set_piece_at(sq, chess.Piece(chess.PAWN, rng.choice([chess.WHITE, chess.BLACK])))
+    return board
+
+
+def _random_game_board(rng: random.Random) -> chess.Board:
+    board = chess.Board()
+    for _ in range(rng.randint(0, 40)):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        board.push(rng.choice(moves))
+    return board
 
 
 def test_starting_position_returns_unknown():
@@ -35,3 +71,111 @@ def test_iqp_detection():
     # May or may not match depending on exact position
     result = classify_structure(board)
     assert isinstance(result, str)
+
+
+def test_bitboard_rules_match_reference_predicates():
+    rng = random.Random(15)
+    boards = [_random_pawn_board(rng) for _ in range(3000)]
+    boards += [_random_game_board(rng) for _ in range(1000)]
+    for board in boards:
+        assert classify_pawns(*pawn_bitboards(board)) == _reference_label(board), board.fen()
+        assert classify_fen(board.fen()) == _reference_label(board), board.fen()
+
+
+def test_bitboard_rules_cover_every_label():
+    rng = random.Random(16)
+    labels = {classify_pawns(*pawn_bitboards(_random_pawn_board(rng))) for _ in range(3000)}
+    # French is shadowed by Caro-Kann (its condition is a superset), so never reached.
+    assert labels >= {label for _, label in PAWN_STRUCTURE_RULES} - {"French Structure"}
+
+
+def test_pawn_cache_counts_hits_and_misses():
+    cache = PawnStructureCache(maxsize=8)
+    white, black = pawn_bitboards(chess.Board())
+
+    assert cache.classify(white, black) == "Unknown"
+    assert cache.classify(white, black) == "Unknown"
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_pawn_cache_times_only_misses_and_keeps_lru_order():
+    cache = PawnStructureCache(maxsize=8)
+    with patch("structure_tagger.time.perf_counter", side_effect=[0.0, 0.5]) as clock:
+        cache.classify(1 << 8, 0)
+        for _ in range(50):
+            cache.classify(1 << 8, 0)
+    assert clock.call_count == 2
+    assert cache.miss_seconds == 0.5
+
+    cache.classify(1 << 9, 0)
+    order = list(cache._labels)
+    stats = cache.stats()
+    assert list(cache._labels) == order
+    assert stats["hits"] == 50 and stats["speedup"] > 1.0
+
+
+def test_pawn_cache_evicts_least_recently_used():
+    cache = PawnStructureCache(maxsize=2)
+    cache.classify(1 << 8, 0)
+    cache.classify(1 << 9, 0)
+    cache.classify(1 << 8, 0)  # refresh, so 1 << 9 is now oldest
+    cache.classify(1 << 10, 0)
+
+    assert cache.stats()["size"] == 2
+    cache.classify(1 << 8, 0)
+    assert cache.hits == 2
+    cache.classify(1 << 9, 0)
+    assert cache.misses == 4
+
+
+def _random_tree(rng: random.Random, games: int = 60, plies: int = 24):
+    """nodes/edges in load_tag_graph's shape for a tree of random games, plus the FEN per node."""
+    nodes, edges, by_fen = {}, [], {}
+    root = chess.Board()
+    nodes[0] = (None, "", None, root.fen())
+    by_fen[root.fen()] = 0
+    for _ in range(games):
+        board, parent_id = chess.Board(), 0
+        for _ in range(plies):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            san = board.san(move)
+            board.push(move)
+            node_id = by_fen.get(board.fen())
+            if node_id is None:
+                node_id = len(nodes)
+                by_fen[board.fen()] = node_id
+                nodes[node_id] = (parent_id, san, None, board.fen())
+                edges.append((parent_id, node_id))
+            parent_id = node_id
+    return nodes, edges
+
+
+def test_incremental_tagging_matches_full_classification():
+    nodes, edges = _random_tree(random.Random(17))
+
+    labels, stats = tag_incrementally(nodes, edges)
+
+    assert labels == {node_id: classify_fen(fen) for node_id, (_, _, _, fen) in nodes.items()}
+    assert stats["inherited"] > 0 and stats["captures"] > 0
+    assert stats["parsed"] < len(nodes)
+
+
+def test_incremental_tagging_only_touches_untagged_nodes():
+    nodes, edges = _random_tree(random.Random(18))
+    # Tag everything but the last 20 nodes, as if those were added by a crawl.
+    tagged = {node_id: classify_fen(fen) for node_id, (_, _, _, fen) in nodes.items() if node_id < len(nodes) - 20}
+    nodes = {
+        node_id: (parent, san, tagged.get(node_id), None if node_id in tagged else fen)
+        for node_id, (parent, san, _, fen) in nodes.items()
+    }
+
+    labels, _ = tag_incrementally(nodes, edges)
+
+    assert set(labels) == set(range(len(nodes) - 20, len(nodes)))
+    assert all(labels[node_id] == classify_fen(nodes[node_id][3]) for node_id in labels)